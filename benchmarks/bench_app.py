@@ -0,0 +1,249 @@
+"""
+接口与抓取循环基准：在合成电表数据（benchmarks/fleet.py）上测量各接口与 scheduled_fetch 的耗时、
+每次请求的 SQL 条数与内存分配，结果可写入 JSON，用 --compare 与旧结果逐项对比。
+
+数据库使用嵌入式 SQLite（DB_BACKEND=sqlite），电表页面由本地模拟的 pay.aspx 提供（METER_PAGE_URL），
+不访问外部网络。默认关闭结果缓存（CACHE_MAX_MB=0），测量的是每次请求的实际计算；--cache 时测量缓存命中。
+
+用法：
+    python benchmarks/bench_app.py                                 # 5 块表 × 1 年，临时数据库
+    python benchmarks/bench_app.py --meters 50 --years 2 -n 100 --json app_bench.json
+    python benchmarks/bench_app.py --db /tmp/fleet.db              # 复用已生成的数据库（不存在时生成）
+    python benchmarks/bench_app.py --compare app_bench.json        # 与上次结果对比
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import fleet  # noqa: E402
+
+# 只统计读写数据的语句，不含事务控制与 PRAGMA
+_COUNTED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+class QueryCounter:
+    """通过 sqlite3 的 trace 回调统计所有连接执行的 SQL 条数"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _trace(self, statement):
+        if statement.lstrip().upper().startswith(_COUNTED):
+            with self._lock:
+                self.count += 1
+
+    def install(self, backend):
+        connect = backend.connect
+
+        def traced_connect():
+            conn = connect()
+            conn.raw.set_trace_callback(self._trace)
+            return conn
+
+        backend.connect = traced_connect
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meters", type=int, default=5, help="电表数量")
+    parser.add_argument("--years", type=float, default=1.0, help="每块表的历史年数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="SQLite 数据库文件；已有数据时直接复用，默认使用临时文件")
+    parser.add_argument("-n", "--number", type=int, default=50, help="每个接口的请求次数（轮流使用各电表）")
+    parser.add_argument("--fetch-rounds", type=int, default=5, help="scheduled_fetch 的执行轮数")
+    parser.add_argument("--page-latency", type=float, default=0.0, help="模拟页面的响应延迟（秒）")
+    parser.add_argument("--cache", action="store_true", help="保留结果缓存（测量缓存命中路径）")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前 --json 写出的结果对比")
+    return parser.parse_args()
+
+
+def endpoint_cases(today):
+    """(名称, URL 模板)；{meter} 替换为表号"""
+    history = (today - timedelta(days=30)).isoformat()
+    return [
+        ("data_day", "/data?period=day&device_id={meter}"),
+        ("data_day_history", f"/data?period=day&device_id={{meter}}&date={history}"),
+        ("data_week", "/data?period=week&device_id={meter}"),
+        ("data_month", "/data?period=month&device_id={meter}"),
+        ("kpi", "/kpi?device_id={meter}"),
+        ("period_kpi_day", "/period_kpi?period=day&device_id={meter}"),
+        ("period_kpi_month", "/period_kpi?period=month&device_id={meter}"),
+        ("recharge_history", "/recharge_history?device_id={meter}&days=365"),
+    ]
+
+
+def summarize(name, samples, queries, peak_kb):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(len(samples) * q), len(samples) - 1)]  # noqa: E731
+    return {
+        "name": name,
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(pick(0.5), 3),
+        "p90_ms": round(pick(0.9), 3),
+        "p99_ms": round(pick(0.99), 3),
+        "max_ms": round(samples[-1], 3),
+        "queries": round(queries, 1),
+        "peak_alloc_kb": round(peak_kb, 1),
+    }
+
+
+def bench_endpoints(main, counter, meters, number):
+    client = main.app.test_client()
+    results = []
+    for name, template in endpoint_cases(main.now_cn().date()):
+        urls = [template.format(meter=meter) for meter in meters]
+        resp = client.get(urls[0])
+        if resp.status_code != 200:
+            raise SystemExit(f"{name}: {urls[0]} 返回 {resp.status_code}")
+
+        samples, query_total = [], 0
+        for i in range(number):
+            before = counter.count
+            started = time.perf_counter()
+            client.get(urls[i % len(urls)])
+            samples.append((time.perf_counter() - started) * 1000)
+            query_total += counter.count - before
+
+        # 内存分配单独测一次：tracemalloc 会显著拖慢执行，不与计时混在一起
+        tracemalloc.start()
+        client.get(urls[0])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append(summarize(name, samples, query_total / number, peak / 1024))
+    return results
+
+
+def bench_fetch(main, counter, rounds):
+    samples, query_total = [], 0
+    for _ in range(rounds):
+        before = counter.count
+        started = time.perf_counter()
+        summary = main.scheduled_fetch()
+        samples.append((time.perf_counter() - started) * 1000)
+        query_total += counter.count - before
+        if summary["succeeded"] != summary["devices"]:
+            print(f"⚠️ scheduled_fetch：{summary['devices']} 台中 {summary['succeeded']} 台成功")
+    tracemalloc.start()
+    main.scheduled_fetch()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summarize("scheduled_fetch", samples, query_total / rounds, peak / 1024)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, previous=None):
+    baseline = {row["name"]: row for row in (previous or {}).get("results", [])}
+    header = f"{'name':<20}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'queries':>9}{'alloc KB':>10}"
+    print(header + (f"{'p50 vs base':>13}" if previous else ""))
+    for row in results:
+        line = (
+            f"{row['name']:<20}{row['p50_ms']:>9.2f}{row['p90_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+            f"{row['queries']:>9.1f}{row['peak_alloc_kb']:>10.0f}"
+        )
+        base = baseline.get(row["name"])
+        if base and base["p50_ms"]:
+            line += f"{row['p50_ms'] / base['p50_ms']:>12.2f}x"
+        print(line)
+
+
+def main():
+    args = parse_args()
+    tmpdir = None
+    db_path = args.db
+    if not db_path:
+        tmpdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmpdir.name, "fleet.db")
+    meters = fleet.meter_ids(args.meters)
+
+    server = fleet.FakeMeterServer({}, latency=args.page_latency, seed=args.seed)
+    os.environ.update({
+        "DB_BACKEND": "sqlite",
+        "SQLITE_PATH": db_path,
+        "METER_PAGE_URL": server.url_template,
+        "DEVICES_JSON": json.dumps([{"id": meter, "name": meter} for meter in meters]),
+        "CACHE_MAX_MB": os.environ.get("CACHE_MAX_MB", "16") if args.cache else "0",
+        # 每轮都抓取全部设备，测量完整一轮的耗时（自适应调度的效果见 sim_schedule.py）
+        "SCRAPE_ADAPTIVE": "false",
+    })
+    import main as app_main
+
+    counter = QueryCounter()
+    counter.install(app_main.DB_BACKEND)
+    app_main.ensure_schema()
+
+    with app_main.DB_POOL.connection() as conn:
+        latest = app_main._load_latest_rows(conn, meters)
+    if len(latest) < len(meters):
+        started = time.perf_counter()
+        print(f"生成 {args.meters} 块表 × {args.years} 年的读数 …")
+        fleet.load_fleet(app_main, [m for m in meters if m not in latest], args.years, args.seed)
+        print(f"生成完成，用时 {time.perf_counter() - started:.1f}s")
+        with app_main.DB_POOL.connection() as conn:
+            latest = app_main._load_latest_rows(conn, meters)
+    server.balances = {meter: float(row[2]) for meter, row in latest.items()}
+    with app_main.DB_POOL.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM electricity_balance")
+        row_count = cursor.fetchone()[0]
+
+    server.start()
+    try:
+        results = bench_endpoints(app_main, counter, meters, args.number)
+        results.append(bench_fetch(app_main, counter, args.fetch_rounds))
+    finally:
+        server.stop()
+        if tmpdir:
+            tmpdir.cleanup()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            previous = json.load(fh)
+    print(f"\n{args.meters} 块表，{row_count} 条读数，缓存{'开启' if args.cache else '关闭'}，每个接口 {args.number} 次")
+    print_results(results, previous)
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"进程峰值 RSS：{max_rss_kb / 1024:.1f} MB")
+
+    if args.json:
+        report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "params": {
+                "meters": args.meters, "years": args.years, "seed": args.seed, "number": args.number,
+                "fetch_rounds": args.fetch_rounds, "page_latency": args.page_latency, "cache": args.cache,
+            },
+            "rows": row_count,
+            "max_rss_kb": max_rss_kb,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
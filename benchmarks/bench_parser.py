@@ -0,0 +1,132 @@
+"""
+电表页面解析微基准：对比旧实现（整页 unescape + 未编译正则）与 meter_parser 的单页解析耗时。
+
+用法：
+    python benchmarks/bench_parser.py                 # 每页 2000 次
+    python benchmarks/bench_parser.py -n 500 --json parser_bench.json
+
+运行前会先校验两种实现在样例页面上的结果与 meter_pages/expected.json 一致。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+from html import unescape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "meter_pages")
+sys.path.insert(0, ROOT)
+
+from meter_parser import parse_meter_page  # noqa: E402
+
+
+# -----------------------
+# 旧实现（原 main._parse_meter_page，保留用于对比）
+# -----------------------
+def _legacy_strip_tags(html_text):
+    if not html_text:
+        return ""
+    return re.sub(r"<[^>]+>", " ", html_text)
+
+
+def _legacy_extract_first_number(text):
+    if not text:
+        return None
+    match = re.search(r"([0-9]+(?:\.[0-9]+)?)", text.replace(",", ""))
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            return None
+    return None
+
+
+def legacy_parse_meter_page(html_text):
+    normalized = unescape(html_text or "")
+    plain_text = None
+
+    meter_id_match = re.search(
+        r'id=["\']metid["\'][^>]*>([^<]+)', normalized, re.IGNORECASE | re.DOTALL
+    )
+    meter_id = meter_id_match.group(1).strip() if meter_id_match else None
+
+    if not meter_id:
+        plain_text = _legacy_strip_tags(normalized)
+        fallback_match = re.search(
+            r"(?:电表号|表号)\s*(?:[:：]|&#58;|&colon;)?\s*([0-9A-Za-z\-]+)",
+            plain_text,
+        )
+        if fallback_match:
+            meter_id = fallback_match.group(1).strip()
+
+    power_match = re.search(
+        r"剩余电量(?:[:：]|&#58;|&colon;)?</span>\s*<label[^>]*>([^<]+)</label>",
+        normalized,
+        re.IGNORECASE | re.DOTALL,
+    )
+    raw_power = power_match.group(1).strip() if power_match else None
+
+    if raw_power is None:
+        if plain_text is None:
+            plain_text = _legacy_strip_tags(normalized)
+        fallback_power = re.search(
+            r"剩余电量(?:[:：]|&#58;|&colon;)?[^0-9]*([0-9]+(?:\.[0-9]+)?)",
+            plain_text,
+        )
+        raw_power = fallback_power.group(1) if fallback_power else None
+
+    return meter_id, _legacy_extract_first_number(raw_power)
+
+
+def load_corpus():
+    with open(os.path.join(PAGES_DIR, "expected.json"), encoding="utf-8") as fh:
+        expected = json.load(fh)
+    corpus = []
+    for name in sorted(expected):
+        with open(os.path.join(PAGES_DIR, name), encoding="utf-8") as fh:
+            html_text = fh.read()
+        corpus.append((name, html_text, (expected[name]["meter_id"], expected[name]["remain"])))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=2000, help="每个页面的解析次数")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    failures = 0
+    for name, html_text, expected in corpus:
+        for label, fn in (("legacy", legacy_parse_meter_page), ("current", parse_meter_page)):
+            result = fn(html_text)
+            if result != expected:
+                failures += 1
+                print(f"[{label}] {name}: 期望 {expected}，实际 {result}")
+    if failures:
+        sys.exit(1)
+
+    results = []
+    print(f"{'page':<22}{'bytes':>8}{'legacy µs':>12}{'current µs':>12}{'speedup':>9}")
+    for name, html_text, _ in corpus:
+        legacy = min(timeit.repeat(lambda: legacy_parse_meter_page(html_text), number=args.number, repeat=3))
+        current = min(timeit.repeat(lambda: parse_meter_page(html_text), number=args.number, repeat=3))
+        legacy_us = legacy / args.number * 1e6
+        current_us = current / args.number * 1e6
+        results.append({
+            "page": name,
+            "bytes": len(html_text.encode("utf-8")),
+            "legacy_us": round(legacy_us, 2),
+            "current_us": round(current_us, 2),
+        })
+        print(f"{name:<22}{results[-1]['bytes']:>8}{legacy_us:>12.1f}{current_us:>12.1f}{legacy_us / current_us:>8.1f}x")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"number": args.number, "results": results}, fh, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
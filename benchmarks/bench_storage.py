@@ -0,0 +1,122 @@
+"""
+存储后端读性能基准：写入合成读数后，测量页面常用读操作的耗时
+（两种后端的一致性检查见 tests/test_storage.py）。
+
+用法：
+    python benchmarks/bench_storage.py                       # 嵌入式 SQLite，临时数据库文件
+    python benchmarks/bench_storage.py --backend mysql       # 使用 .env 中的 MySQL 配置
+    python benchmarks/bench_storage.py --days 90 --json storage_bench.json
+
+MySQL 下只写入表号 __storage_check__ 的数据，结束后清理。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+METER = "__storage_check__"
+START = datetime(2024, 1, 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--days", type=int, default=30, help="写入的读数天数（每 5 分钟一条）")
+    parser.add_argument("-n", "--number", type=int, default=200, help="每个读操作的重复次数")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    return parser.parse_args()
+
+
+def synthetic_readings(days):
+    """每 5 分钟一条，余额缓慢下降，每 10 天充值 100 元"""
+    readings, balance = [], 500.0
+    ts = START
+    while ts < START + timedelta(days=days):
+        balance = round(balance - 0.05, 2)
+        if ts.minute == 0 and ts.hour == 12 and ts.day % 10 == 0:
+            balance = round(balance + 100, 2)
+        readings.append({"meter_no": METER, "remain": balance, "collected_at": ts})
+        ts += timedelta(minutes=5)
+    return readings
+
+
+def cleanup(main):
+    with main.DB_POOL.connection() as conn:
+        with conn.cursor() as cursor:
+            for table in ("electricity_balance", "electricity_daily_usage", "electricity_hourly_usage",
+                          "electricity_recharge", "electricity_ingest_log"):
+                cursor.execute(f"DELETE FROM {table} WHERE meter_no=%s", (METER,))
+
+
+def write_readings(main, readings):
+    """分批写入（与抓取时的批量写入路径相同）"""
+    with main.DB_POOL.connection() as conn:
+        for i in range(0, len(readings), 200):
+            main._write_readings(conn, readings[i:i + 200])
+
+
+def run_benchmarks(main, number, days):
+    """页面常用读操作的耗时（同一连接上重复执行，取中位数与 p95，单位微秒）"""
+    end = START + timedelta(days=days)
+    day = end - timedelta(days=1)
+    operations = {
+        "latest_balance": lambda conn: main._get_latest_balance(conn, METER),
+        "series_window_1d": lambda conn: main._fetch_series_window(conn, METER, day, end),
+        "hourly_rollups_1d": lambda conn: main._load_rollups(conn, "hourly", METER, day, end),
+        "daily_rollups_30d": lambda conn: main._load_daily_rollups(conn, METER, (end - timedelta(days=30)).date(), end.date()),
+        "recharges": lambda conn: main._load_recharges(conn, METER, START, 50),
+        "latest_rows": lambda conn: main._load_latest_rows(conn, [METER]),
+    }
+    results = []
+    with main.DB_POOL.connection() as conn:
+        print(f"{'operation':<22}{'median µs':>12}{'p95 µs':>12}")
+        for name, fn in operations.items():
+            fn(conn)
+            samples = []
+            for _ in range(number):
+                started = time.perf_counter()
+                fn(conn)
+                samples.append((time.perf_counter() - started) * 1e6)
+            samples.sort()
+            median = statistics.median(samples)
+            p95 = samples[int(len(samples) * 0.95) - 1]
+            results.append({"operation": name, "median_us": round(median, 1), "p95_us": round(p95, 1)})
+            print(f"{name:<22}{median:>12.1f}{p95:>12.1f}")
+    return results
+
+
+def main():
+    args = parse_args()
+    os.environ["DB_BACKEND"] = args.backend
+    tmpdir = None
+    if args.backend == "sqlite":
+        tmpdir = tempfile.TemporaryDirectory()
+        os.environ["SQLITE_PATH"] = os.path.join(tmpdir.name, "check.db")
+
+    import main as app_main
+
+    app_main.ensure_schema()
+    cleanup(app_main)
+    try:
+        write_readings(app_main, synthetic_readings(args.days))
+        results = run_benchmarks(app_main, args.number, args.days)
+    finally:
+        cleanup(app_main)
+        if tmpdir:
+            tmpdir.cleanup()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"backend": args.backend, "days": args.days, "results": results},
+                      fh, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+合成电表数据：N 块电表 × M 年的 5 分钟读数，以及模拟 cnyiot pay.aspx 页面的本地 HTTP 服务。
+
+读数规则（每块表独立的随机种子，结果可复现）：
+- 用电按一天中的时段（夜间低、傍晚高峰）与季节（冬夏高）变化，每条读数叠加随机波动；
+- 空置期：整段时间余额不变（读数照常采集）；
+- 采集中断：一段时间内没有读数；
+- 余额低于阈值后择机充值 10 元的整数倍，余额耗尽时停在 0 直到充值。
+
+也可单独运行，生成一份 SQLite 数据库供其他基准复用：
+    python benchmarks/fleet.py --meters 20 --years 2 --db /tmp/fleet.db
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STEP = timedelta(minutes=5)
+# 各小时的用电权重（0 点开始）
+HOURLY_PROFILE = (
+    0.35, 0.3, 0.25, 0.25, 0.25, 0.3, 0.5, 0.8, 0.9, 0.7, 0.6, 0.65,
+    0.8, 0.7, 0.6, 0.6, 0.7, 0.9, 1.3, 1.6, 1.6, 1.4, 1.0, 0.6,
+)
+RECHARGE_AMOUNTS = (50, 100, 100, 200, 300)
+
+
+def meter_ids(count, prefix="9100"):
+    return [f"{prefix}{index:07d}" for index in range(count)]
+
+
+def generate_meter(meter_no, start, end, seed=0):
+    """生成一块表在 [start, end) 内的读数，逐条产出 (meter_no, remain, collected_at, None)"""
+    rng = random.Random(f"{seed}:{meter_no}")
+    rate = rng.uniform(0.25, 1.1)          # 高峰时段每小时电费（元）
+    threshold = rng.choice((20, 30, 50))   # 余额低于该值后准备充值
+    balance = rng.randint(100, 400) * 100  # 单位：分
+    flat_until = gap_until = recharge_at = None
+    ts = start
+    while ts < end:
+        if ts.hour == 0 and ts.minute == 0:
+            if flat_until is None and rng.random() < 0.015:
+                flat_until = ts + timedelta(days=rng.randint(1, 10))
+            if gap_until is None and rng.random() < 0.03:
+                gap_start = ts + timedelta(minutes=5 * rng.randrange(288))
+                gap_until = (gap_start, gap_start + timedelta(minutes=rng.randint(30, 720)))
+        if flat_until is not None and ts >= flat_until:
+            flat_until = None
+
+        if flat_until is None:
+            season = 1 + 0.35 * math.cos((ts.timetuple().tm_yday - 15) / 365 * 2 * math.pi) ** 2
+            cost = rate * HOURLY_PROFILE[ts.hour] * season / 12 * rng.uniform(0.6, 1.4)
+            balance = max(balance - int(round(cost * 100)), 0)
+
+        if recharge_at is None and balance < threshold * 100:
+            recharge_at = ts + timedelta(minutes=rng.randint(10, 36 * 60))
+        if recharge_at is not None and (ts >= recharge_at or balance == 0 and rng.random() < 0.02):
+            balance += rng.choice(RECHARGE_AMOUNTS) * 100
+            recharge_at = None
+
+        if gap_until is not None and ts >= gap_until[1]:
+            gap_until = None
+        if gap_until is None or ts < gap_until[0]:
+            yield meter_no, balance / 100, ts, None
+        ts += STEP
+
+
+def fleet_window(years, now=None):
+    """最近 years 年的区间，终点为当前时间所在的 5 分钟"""
+    now = now or datetime.now()
+    end = now.replace(second=0, microsecond=0) - timedelta(minutes=now.minute % 5) + STEP
+    return end - timedelta(days=round(365 * years)), end
+
+
+def load_fleet(main, meters, years, seed=0, batch_size=5000):
+    """
+    写入读数并回填汇总与充值记录；返回 {表号: 最后余额}。
+    直接批量写入 electricity_balance 后调用 backfill_rollups，与升级时回填历史数据的路径相同。
+    """
+    start, end = fleet_window(years, main.now_cn())
+    last = {}
+    with main.DB_POOL.connection() as conn:
+        with conn.cursor() as cursor:
+            for meter_no in meters:
+                batch = []
+                for row in generate_meter(meter_no, start, end, seed):
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        main.DB_BACKEND.insert_readings(cursor, batch)
+                        batch = []
+                main.DB_BACKEND.insert_readings(cursor, batch)
+                last[meter_no] = row[1]
+    main.backfill_rollups()
+    return last
+
+
+def fake_page(meter_no, remain):
+    """与真实 pay.aspx 结构一致的最小页面（电表号、剩余电量）"""
+    return (
+        '<html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8" />'
+        f'<title>电费充值</title></head><body><form method="post" action="pay.aspx?mid={meter_no}">'
+        f'<div class="c1"><span>电表号：</span><label id="metid">{meter_no}</label></div>'
+        f'<div class="c2"><span>剩余电量：</span><label id="syje">{remain:.2f}</label></div>'
+        "</form></body></html>"
+    ).encode("utf-8")
+
+
+class FakeMeterServer:
+    """
+    本地模拟 pay.aspx：GET /nat/pay.aspx?mid=表号 返回该表的当前余额，每次请求扣减 0.01～0.2 元。
+    latency 为每次响应前的等待秒数，error_rate 为返回 503 的比例（用于测试重试与超时）。
+    """
+
+    def __init__(self, balances, latency=0.0, error_rate=0.0, seed=0):
+        self.balances = dict(balances)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url_template(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/nat/pay.aspx?mid={{device_id}}"
+
+    def _next_page(self, meter_no):
+        with self._lock:
+            self.requests += 1
+            if meter_no not in self.balances:
+                return 200, "<html><body>表号不存在</body></html>".encode("utf-8")
+            if self._rng.random() < self.error_rate:
+                return 503, b"Service Unavailable"
+            remain = max(self.balances[meter_no] - self._rng.randint(1, 20) / 100, 0)
+            self.balances[meter_no] = remain
+        return 200, fake_page(meter_no, remain)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                meter_no = parse_qs(parts.query).get("mid", [""])[0]
+                if server.latency:
+                    threading.Event().wait(server.latency)
+                status, body = server._next_page(meter_no)
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-meter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meters", type=int, default=10)
+    parser.add_argument("--years", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", required=True, help="SQLite 数据库文件（已存在时追加）")
+    args = parser.parse_args()
+
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = args.db
+    sys.path.insert(0, ROOT)
+    import main as app_main
+
+    app_main.ensure_schema()
+    load_fleet(app_main, meter_ids(args.meters), args.years, args.seed)
+
+
+if __name__ == "__main__":
+    main()
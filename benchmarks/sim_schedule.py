@@ -0,0 +1,153 @@
+"""
+抓取调度模拟：在合成电表数据（benchmarks/fleet.py）上按模拟时钟回放，比较固定间隔与自适应调度
+（scrape_schedule.AdaptiveSchedule）的上游请求数、写入行数与数据质量，不访问网络、不需要数据库。
+
+- 上游页面的余额取该时刻之前最近的一条 5 分钟读数；合成数据中的采集中断视为页面无法解析（抓取失败）；
+- 小时覆盖率：有真实读数的小时中，至少抓到一条读数的比例（日视图每小时的余额依赖它）；
+- 日用电误差：按抓到的读数计算的每日用电与按全部 5 分钟读数计算的差（元，取绝对值的均值与最大值）；
+- 低余额间隔：余额不高于 low_balance 时相邻两次抓取的平均间隔。
+
+用法：
+    python benchmarks/sim_schedule.py                       # 20 块表 × 14 天
+    python benchmarks/sim_schedule.py --meters 100 --days 30 --min-interval 60 --max-interval 1800
+"""
+import argparse
+import os
+import statistics
+import sys
+from bisect import bisect_right
+from datetime import timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fleet  # noqa: E402
+import scrape_schedule  # noqa: E402
+import usage_engine  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meters", type=int, default=20)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--interval", type=int, default=300, help="固定间隔，也是自适应调度的基础间隔（秒）")
+    parser.add_argument("--min-interval", type=int, default=60)
+    parser.add_argument("--max-interval", type=int, default=1800)
+    parser.add_argument("--max-backoff", type=int, default=3600)
+    parser.add_argument("--low-balance", type=float, default=5.0)
+    return parser.parse_args()
+
+
+class Upstream:
+    """某块表的"页面"：返回 at 时刻能看到的余额，处于采集中断中时返回 None"""
+
+    def __init__(self, readings):
+        self.times = [ts for _, _, ts, _ in readings]
+        self.remains = [remain for _, remain, _, _ in readings]
+
+    def read(self, at):
+        i = bisect_right(self.times, at) - 1
+        if i < 0 or at - self.times[i] >= fleet.STEP:
+            return None
+        return self.remains[i]
+
+
+def simulate(upstreams, start, end, tick, choose):
+    """
+    按 tick 秒推进模拟时钟，choose(秒, 设备列表) 返回本轮要抓取的设备；
+    返回 {设备: [(采集时间, 余额), ...]}、请求数、失败数
+    """
+    samples = {meter: [] for meter in upstreams}
+    requests = failures = 0
+    seconds, total = 0, (end - start).total_seconds()
+    while seconds < total:
+        at = start + timedelta(seconds=seconds)
+        for meter, outcome in choose(seconds, at, list(upstreams)):
+            requests += 1
+            if outcome is None:
+                failures += 1
+            else:
+                samples[meter].append((at, outcome))
+        seconds += tick
+    return samples, requests, failures
+
+
+def quality(truth, samples, low_balance):
+    """小时覆盖率、日用电误差（元）、低余额时的平均抓取间隔（秒）"""
+    covered = expected = 0
+    errors, low_gaps = [], []
+    for meter, points in samples.items():
+        true_points = [(ts, remain) for _, remain, ts, _ in truth[meter]]
+        true_hours = {ts.replace(minute=0) for ts, _ in true_points}
+        sampled_hours = {ts.replace(minute=0, second=0) for ts, _ in points}
+        expected += len(true_hours)
+        covered += len(true_hours & sampled_hours)
+
+        true_daily = dict(usage_engine.summarize_by(usage_engine.Series.from_points(true_points), "day"))
+        sampled_daily = dict(usage_engine.summarize_by(usage_engine.Series.from_points(points), "day")) if points else {}
+        for day, summary in true_daily.items():
+            got = sampled_daily.get(day)
+            errors.append(abs(summary["usage_cents"] - (got["usage_cents"] if got else 0)) / 100)
+
+        for (prev_at, prev_remain), (at, _) in zip(points, points[1:]):
+            if prev_remain <= low_balance:
+                low_gaps.append((at - prev_at).total_seconds())
+    return {
+        "hour_coverage": covered / expected if expected else 1.0,
+        "daily_error_mean": statistics.fmean(errors) if errors else 0.0,
+        "daily_error_max": max(errors) if errors else 0.0,
+        "low_balance_interval": statistics.fmean(low_gaps) if low_gaps else None,
+    }
+
+
+def main():
+    args = parse_args()
+    start, end = fleet.fleet_window(args.days / 365)
+    meters = fleet.meter_ids(args.meters)
+    truth = {meter: list(fleet.generate_meter(meter, start, end, args.seed)) for meter in meters}
+    upstreams = {meter: Upstream(readings) for meter, readings in truth.items()}
+
+    def fixed(seconds, at, device_ids):
+        return [(meter, upstreams[meter].read(at)) for meter in device_ids]
+
+    clock = [0.0]
+    schedule = scrape_schedule.AdaptiveSchedule(
+        args.interval, args.min_interval, args.max_interval,
+        max_backoff=args.max_backoff, low_balance=args.low_balance, clock=lambda: clock[0],
+    )
+    tick = min(args.min_interval, args.interval)
+
+    def adaptive(seconds, at, device_ids):
+        clock[0] = seconds
+        results = []
+        for meter in schedule.due(device_ids, slack=tick / 2):
+            remain = upstreams[meter].read(at)
+            if remain is None:
+                schedule.record_failure(meter, "no_data")
+            else:
+                schedule.record_success(meter, remain, at)
+            results.append((meter, remain))
+        return results
+
+    rows = []
+    for name, choose, step in (("fixed", fixed, args.interval), ("adaptive", adaptive, tick)):
+        samples, requests, failures = simulate(upstreams, start, end, step, choose)
+        rows.append((name, requests, failures, sum(len(points) for points in samples.values()),
+                     quality(truth, samples, args.low_balance)))
+
+    print(f"{args.meters} 块表 × {args.days} 天，基础间隔 {args.interval}s，自适应 {args.min_interval}~{args.max_interval}s")
+    print(f"{'schedule':<10}{'requests':>10}{'failed':>8}{'rows':>9}{'hours %':>9}{'day err':>9}{'max err':>9}{'low gap s':>11}")
+    for name, requests, failures, row_count, q in rows:
+        low = f"{q['low_balance_interval']:.0f}" if q["low_balance_interval"] is not None else "-"
+        print(
+            f"{name:<10}{requests:>10}{failures:>8}{row_count:>9}{q['hour_coverage'] * 100:>9.1f}"
+            f"{q['daily_error_mean']:>9.3f}{q['daily_error_max']:>9.2f}{low:>11}"
+        )
+    base, adapt = rows[0], rows[1]
+    print(f"请求数 {adapt[1] / base[1]:.0%}，失败请求 {adapt[2] / max(base[2], 1):.0%}，写入行数 {adapt[3] / base[3]:.0%}（相对固定间隔）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+跨进程的入库通知：写入读数的进程在 electricity_ingest_log 追加一行（每批每个表号一行），
+其他进程的 ChangeFollower 按自增 id 增量读取，据此让本进程的结果缓存失效并推送实时读数。
+
+抓取与写入放到独立的 worker 进程、Web 层有多个进程时，各进程的缓存只能靠它得知其他进程写入的新读数。
+每次轮询只是主键上的一次范围查询，没有新读数时不返回任何行。
+MySQL 的自增 id 可能晚于更大的 id 提交，因此每次从 position - OVERLAP 开始读取，已处理过的 id 跳过。
+"""
+import logging
+import threading
+from collections import deque
+
+TABLE = "electricity_ingest_log"
+OVERLAP = 100
+# 数据保留任务只保留最近的这么多行（轮询间隔为秒级，远用不到这么多）
+KEEP_ROWS = 100000
+
+
+def append(cursor, source, readings, now):
+    """记录一批读数涉及的表号与时间范围"""
+    ranges = {}
+    for r in readings:
+        first, last = ranges.get(r["meter_no"], (r["collected_at"], r["collected_at"]))
+        ranges[r["meter_no"]] = (min(first, r["collected_at"]), max(last, r["collected_at"]))
+    if ranges:
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (meter_no, first_at, last_at, source, logged_at) VALUES (%s, %s, %s, %s, %s)",
+            [(meter_no, first, last, source, now) for meter_no, (first, last) in ranges.items()],
+        )
+
+
+def prune(conn, keep=KEEP_ROWS, dry_run=False):
+    """删除最近 keep 行之前的记录，返回操作说明（没有需要删除的行时为空列表）"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT MAX(id) FROM {TABLE}")
+        row = cursor.fetchone()
+        if not row or row[0] is None or row[0] <= keep:
+            return []
+        cutoff = row[0] - keep
+        if not dry_run:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE id <= %s", (cutoff,))
+    return [f"清理入库通知：id <= {cutoff}"]
+
+
+class ChangeFollower:
+    """
+    后台线程每 interval 秒读取其他进程（source 不同）写入的通知，合并为 {表号: 最早的读数时间}
+    后调用 on_changes；启动时从当前最大 id 开始，不处理历史记录。
+    """
+
+    def __init__(self, pool, source, on_changes, interval=5, batch_size=1000, logger=None):
+        self.pool = pool
+        self.source = source
+        self.on_changes = on_changes
+        self.interval = interval
+        self.batch_size = batch_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.position = None
+        self._seen = deque()
+        self._seen_ids = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters = {"polls": 0, "notifications": 0, "errors": 0}
+
+    def _remember(self, row_id):
+        self._seen.append(row_id)
+        self._seen_ids.add(row_id)
+        while self._seen and self._seen[0] <= self.position - OVERLAP:
+            self._seen_ids.discard(self._seen.popleft())
+
+    def poll(self):
+        """读取一次，返回处理的其他进程通知数"""
+        changes = {}
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            if self.position is None:
+                cursor.execute(f"SELECT MAX(id) FROM {TABLE}")
+                self.position = cursor.fetchone()[0] or 0
+                return 0
+            while True:
+                cursor.execute(
+                    f"SELECT id, meter_no, first_at, source FROM {TABLE} WHERE id > %s ORDER BY id LIMIT %s",
+                    (max(self.position - OVERLAP, 0), self.batch_size),
+                )
+                rows = cursor.fetchall()
+                fresh = [row for row in rows if row[0] not in self._seen_ids]
+                for row_id, meter_no, first_at, source in fresh:
+                    self.position = max(self.position, row_id)
+                    self._remember(row_id)
+                    if source != self.source:
+                        changes[meter_no] = min(changes.get(meter_no, first_at), first_at)
+                if len(rows) < self.batch_size or not fresh:
+                    break
+        self._counters["polls"] += 1
+        if changes:
+            self._counters["notifications"] += len(changes)
+            self.on_changes(changes)
+        return len(changes)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as exc:
+                self._counters["errors"] += 1
+                self.logger.warning("读取入库通知失败: %s", exc)
+
+    def start(self):
+        if self._thread is None:
+            try:
+                self.poll()
+            except Exception as exc:
+                self._counters["errors"] += 1
+                self.logger.warning("读取入库通知失败: %s", exc)
+            self._thread = threading.Thread(target=self._run, name="change-follower", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and not self._stop.is_set()
+
+    def stats(self):
+        return {"interval": self.interval, "position": self.position, "running": self.running, **self._counters}
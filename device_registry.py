@@ -0,0 +1,152 @@
+"""
+设备登记表：电表列表保存在 electricity_device 表中，各进程定期重新读取，增删设备无需重启。
+
+- 启动时把环境变量（DEVICES_JSON / DEFAULT_DEVICE_ID）中、表里还没有的设备写入表中，
+  已有的设备以表中内容为准（环境变量只用于首次导入）；
+- Server酱 SendKey 可以只保存环境变量名（server_chan_key_env），每次读取时再解析，密钥不落库；
+- DeviceRegistry 每隔 interval 秒读取一次启用的设备，列表有变化时调用 on_change(devices)。
+"""
+import logging
+import os
+import threading
+
+TABLE = "electricity_device"
+COLUMNS = ("id", "name", "server_chan_key", "server_chan_key_env", "enabled", "updated_at")
+
+
+def _device(row):
+    device_id, name, server_key, key_env = row
+    return {
+        "id": device_id,
+        "name": name or device_id,
+        "server_chan_key": os.getenv(key_env, "") if key_env else (server_key or ""),
+        "server_chan_key_env": key_env or "",
+    }
+
+
+def load(conn):
+    """读取启用的设备，按表号排序"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id, name, server_chan_key, server_chan_key_env FROM {TABLE} WHERE enabled = 1 ORDER BY id"
+        )
+        return [_device(row) for row in cursor.fetchall()]
+
+
+def list_all(conn):
+    """全部设备（含停用的）：[(表号, 名称, 是否启用, 更新时间), ...]"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT id, name, enabled, updated_at FROM {TABLE} ORDER BY id")
+        return cursor.fetchall()
+
+
+def upsert(cursor, backend, device, now, enabled=True):
+    """新增或覆盖一台设备"""
+    cursor.execute(
+        backend.upsert_sql(TABLE, COLUMNS, ("id",)),
+        (device["id"], device["name"], device.get("server_chan_key") or "",
+         device.get("server_chan_key_env") or "", 1 if enabled else 0, now),
+    )
+
+
+def seed(conn, backend, devices, now):
+    """把表中还没有的设备写入（已有的保持不变），返回新增的表号"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT id FROM {TABLE}")
+        existing = {row[0] for row in cursor.fetchall()}
+        added = []
+        for device in devices:
+            if device["id"] in existing:
+                continue
+            # 密钥来自环境变量时只保存变量名
+            row = dict(device, server_chan_key="") if device.get("server_chan_key_env") else device
+            # 多个进程同时导入时按主键覆盖为相同内容
+            upsert(cursor, backend, row, now)
+            added.append(device["id"])
+    return added
+
+
+def set_enabled(conn, device_id, enabled, now):
+    """启用或停用设备，返回是否找到该设备"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {TABLE} SET enabled = %s, updated_at = %s WHERE id = %s", (1 if enabled else 0, now, device_id)
+        )
+        return cursor.rowcount > 0
+
+
+def remove(conn, device_id):
+    """从登记表删除设备（历史读数保留），返回是否找到该设备"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE id = %s", (device_id,))
+        return cursor.rowcount > 0
+
+
+class DeviceRegistry:
+    """
+    后台线程定期读取设备登记表。seed_devices 为首次导入的设备（环境变量配置），
+    导入成功一次后不再执行；读取失败时保留当前列表。
+    """
+
+    def __init__(self, pool, backend, seed_devices, on_change, interval=30, clock=None, logger=None):
+        self.pool = pool
+        self.backend = backend
+        self.seed_devices = list(seed_devices)
+        self.on_change = on_change
+        self.interval = interval
+        self.clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self.devices = None
+        self._seeded = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = False
+        self._counters = {"reloads": 0, "changes": 0, "errors": 0}
+
+    def reload(self):
+        """读取一次；列表有变化时调用 on_change，返回是否有变化"""
+        with self.pool.connection() as conn:
+            if not self._seeded:
+                added = seed(conn, self.backend, self.seed_devices, self.clock())
+                if added:
+                    self.logger.info("设备登记表导入 %s 台设备: %s", len(added), ", ".join(added))
+                self._seeded = True
+            devices = load(conn)
+        self._counters["reloads"] += 1
+        if devices == self.devices:
+            return False
+        self.devices = devices
+        self._counters["changes"] += 1
+        self.on_change(devices)
+        return True
+
+    def _reload_logged(self):
+        try:
+            self.reload()
+        except Exception as exc:
+            self._counters["errors"] += 1
+            self.logger.warning("读取设备登记表失败: %s", exc)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._reload_logged()
+
+    def start(self):
+        """立即读取一次；interval 为 0 时只在启动时读取"""
+        if not self._started:
+            self._started = True
+            self._reload_logged()
+            if self.interval:
+                self._thread = threading.Thread(target=self._run, name="device-registry", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "devices": len(self.devices) if self.devices is not None else None,
+            **self._counters,
+        }
@@ -0,0 +1,39 @@
+"""
+曲线降采样（Largest-Triangle-Three-Buckets）。
+
+把 n 个点分成 threshold 个连续分组：首、末点各自成组，其余点均分为 threshold - 2 组；
+每组选出与前一个已选点、下一组平均点构成三角形面积最大的点，保留曲线的峰谷形状。
+返回每组的 (选中下标, 组起点, 组终点)，调用方可以用分组区间对用电量等可加字段求和，
+使降采样后各点的合计与原始数据一致。
+"""
+
+
+def lttb(xs, ys, threshold):
+    """
+    xs、ys 为等长数值序列（xs 升序）。threshold >= n 或 threshold < 3 时不降采样，每个点单独成组。
+    返回 [(selected, lo, hi), ...]，组覆盖下标 [lo, hi)，按顺序首尾相接覆盖全部点。
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return [(i, i, i + 1) for i in range(n)]
+
+    every = (n - 2) / (threshold - 2)
+    bounds = [0, 1] + [int(1 + k * every) for k in range(1, threshold - 2)] + [n - 1, n]
+    groups = [(0, 0, 1)]
+    selected = 0
+    for k in range(1, threshold - 1):
+        lo, hi = bounds[k], bounds[k + 1]
+        next_lo, next_hi = bounds[k + 1], bounds[k + 2]
+        avg_x = sum(xs[next_lo:next_hi]) / (next_hi - next_lo)
+        avg_y = sum(ys[next_lo:next_hi]) / (next_hi - next_lo)
+        ax, ay = xs[selected], ys[selected]
+        best, best_area = lo, -1.0
+        for i in range(lo, hi):
+            # 三角形面积的两倍（比较大小时常数因子无关）
+            area = abs((ax - avg_x) * (ys[i] - ay) - (ax - xs[i]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = i, area
+        groups.append((best, lo, hi))
+        selected = best
+    groups.append((n - 1, n - 1, n))
+    return groups
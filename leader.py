@@ -0,0 +1,102 @@
+"""
+后台任务选主：多个进程（worker.py、RUN_JOBS=true 的 main.py）同时运行时，只有持有数据库锁的一个执行定时任务。
+
+每个实例的守护线程每隔 interval 秒：
+- 未持有锁：尝试不等待地获取（storage 后端的 acquire_lock），成功后调用 on_elected；
+- 已持有锁：确认锁仍然有效（MySQL 会话断开、连接被服务端关闭都会丢锁），失效时调用 on_demoted，
+  之后与其他实例一样重新竞争。
+持有锁的进程退出或崩溃后锁由数据库（或操作系统）释放，待命实例最迟 interval 秒后接替。
+"""
+import logging
+import threading
+import time
+
+
+class LeaderElection:
+    def __init__(self, backend, name, on_elected, on_demoted, interval=10, logger=None):
+        self.backend = backend
+        self.logger = logger or logging.getLogger(__name__)
+        self.name = name
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.interval = interval
+        self._lock = None
+        self._mutex = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters = {"elections": 0, "demotions": 0, "errors": 0}
+        self.leader_since = None
+
+    @property
+    def is_leader(self):
+        return self._lock is not None
+
+    def check(self):
+        """执行一次竞争或确认（线程外也可直接调用，如启动时立即竞争一次）"""
+        with self._mutex:
+            return self._check()
+
+    def _check(self):
+        if self._stop.is_set():
+            return False
+        if self._lock is not None:
+            if self._lock.held():
+                return True
+            self.logger.warning("已失去后台任务锁 %s，暂停定时任务", self.name)
+            self._drop()
+            return False
+        try:
+            lock = self.backend.acquire_lock(self.name)
+        except Exception as exc:
+            self._counters["errors"] += 1
+            self.logger.warning("获取后台任务锁 %s 失败: %s", self.name, exc)
+            return False
+        if lock is None:
+            return False
+        self._lock = lock
+        self.leader_since = time.time()
+        self._counters["elections"] += 1
+        self.logger.info("获得后台任务锁 %s，开始执行定时任务", self.name)
+        self.on_elected()
+        return True
+
+    def _drop(self):
+        lock, self._lock = self._lock, None
+        self.leader_since = None
+        self._counters["demotions"] += 1
+        try:
+            self.on_demoted()
+        finally:
+            lock.release()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as exc:
+                self._counters["errors"] += 1
+                self.logger.warning("后台任务选主出错: %s", exc)
+
+    def start(self):
+        """立即竞争一次，然后在守护线程中定期确认"""
+        self.check()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """停止竞争并释放锁（进程正常退出时调用，其他实例无需等到连接超时即可接替）"""
+        self._stop.set()
+        with self._mutex:
+            if self._lock is not None:
+                self._drop()
+
+    def stats(self):
+        return {
+            "lock": self.name,
+            "leader": self.is_leader,
+            "leader_since": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.leader_since))
+            if self.leader_since else None,
+            **self._counters,
+        }
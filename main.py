@@ -1,16 +1,39 @@
-from flask import Flask, render_template, render_template_string, request, jsonify, g
+from flask import Flask, Response, redirect, render_template, render_template_string, request, jsonify, g
+import argparse
+import glob
+import hashlib
 import json
 import os
+import socket
+import sys
 from dotenv import load_dotenv
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
 from apscheduler.schedulers.background import BackgroundScheduler
 import requests
-import re
-import pymysql
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from meter_parser import parse_meter_page
+import change_feed
+import device_registry
+import downsample
+import leader
+import metrics
+import profiler
+import queries
+import retention
+import scrape_schedule
+import shard
+import storage
+import stream
+import usage_engine
 from datetime import datetime, timedelta, timezone
 import threading
 import time
-from functools import lru_cache
-from html import unescape
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from werkzeug.http import is_resource_modified
 
 load_dotenv()
 
@@ -35,7 +58,7 @@ def _require_env(key, *, cast=None, allow_empty=False, default=None):
 
 def _load_device_list():
     """
-    从环境变量加载设备配置。
+    从环境变量加载设备配置（启动时导入设备登记表，见 device_registry.py）。
     支持两种模式：
       1. DEVICES_JSON：JSON 数组，每个对象可包含 server_chan_key 或 server_chan_key_env 字段
       2. DEFAULT_DEVICE_ID / DEFAULT_DEVICE_NAME / DEFAULT_DEVICE_SERVER_CHAN_KEY：兼容旧配置
@@ -71,6 +94,7 @@ def _load_device_list():
                 "id": str(device_id),
                 "name": device_name,
                 "server_chan_key": server_key,
+                "server_chan_key_env": key_env or "",
             })
 
     default_device_id = os.getenv("DEFAULT_DEVICE_ID")
@@ -79,6 +103,7 @@ def _load_device_list():
             "id": default_device_id,
             "name": os.getenv("DEFAULT_DEVICE_NAME", default_device_id),
             "server_chan_key": os.getenv("DEFAULT_DEVICE_SERVER_CHAN_KEY", ""),
+            "server_chan_key_env": "DEFAULT_DEVICE_SERVER_CHAN_KEY" if os.getenv("DEFAULT_DEVICE_SERVER_CHAN_KEY") else "",
         })
 
     return devices
@@ -94,18 +119,8 @@ def _cast_int_env(raw_value):
     return int(cleaned)
 
 
-DB_CONFIG = {
-    "host": _require_env("DB_HOST"),
-    "port": _require_env("DB_PORT", cast=_cast_int_env),
-    "user": _require_env("DB_USER"),
-    "password": _require_env("DB_PASSWORD"),
-    "database": _require_env("DB_NAME"),
-    "charset": _require_env("DB_CHARSET"),
-    "autocommit": True,
-    "connect_timeout": _cast_int_env(os.getenv("DB_CONNECT_TIMEOUT", "5")),
-    "read_timeout": _cast_int_env(os.getenv("DB_READ_TIMEOUT", "10")),
-    "write_timeout": _cast_int_env(os.getenv("DB_WRITE_TIMEOUT", "10")),
-}
+# 存储后端：DB_BACKEND=mysql（默认，需要 DB_HOST 等连接参数）或 sqlite（单机嵌入式，只需 SQLITE_PATH）
+DB_BACKEND = storage.create_backend(_require_env, _cast_int_env)
 
 DEVICE_LIST = _load_device_list()
 
@@ -128,113 +143,530 @@ HTML_TEMPLATE = None
 # -----------------------
 # 数据库连接池优化
 # -----------------------
+class PoolTimeoutError(RuntimeError):
+    """等待空闲连接超时"""
+
+
+class ConnectionPool:
+    """
+    基于存储后端的有界、线程安全连接池，Flask 请求与 APScheduler 任务共享。
+    借出时做健康检查（ping），超过最大存活时间的连接在借出/归还时重建。
+    """
+
+    def __init__(self, backend, min_size=1, max_size=10, max_lifetime=1800, wait_timeout=5, ping_on_borrow=True):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise RuntimeError(f"连接池大小配置无效：min={min_size}, max={max_size}")
+        self._backend = backend
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.wait_timeout = wait_timeout
+        self.ping_on_borrow = ping_on_borrow
+        self._idle = deque()
+        self._born = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._counters = {
+            "created": 0, "closed": 0, "borrowed": 0, "waited": 0,
+            "timeouts": 0, "health_check_failures": 0, "expired": 0,
+        }
+
+    def _open(self):
+        # 借出的连接统一包装，执行的 SQL 按请求路由/任务计数、计时（/metrics）
+        conn = metrics.InstrumentedConnection(self._backend.connect())
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._counters["created"] += 1
+        return conn
+
+    def _close(self, conn, reason=None):
+        """关闭连接；reason 为关闭原因的计数项（expired / health_check_failures），与 closed 在同一把锁内累加"""
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._counters["closed"] += 1
+            if reason:
+                self._counters[reason] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, conn):
+        born = self._born.get(id(conn))
+        return born is not None and self.max_lifetime > 0 and time.monotonic() - born > self.max_lifetime
+
+    def prefill(self):
+        """预先建立 min_size 个连接，服务启动时调用"""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def acquire(self):
+        """借出连接；池满时最多等待 wait_timeout 秒，超时抛出 PoolTimeoutError"""
+        deadline = time.monotonic() + self.wait_timeout
+        conn = None
+        with self._cond:
+            waited = False
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeoutError(f"等待数据库连接超时（{self.wait_timeout}s，max_size={self.max_size}）")
+                if not waited:
+                    self._counters["waited"] += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._counters["borrowed"] += 1
+
+        try:
+            if conn is not None and self._expired(conn):
+                self._close(conn, "expired")
+                conn = None
+            if conn is not None and self.ping_on_borrow:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self._close(conn, "health_check_failures")
+                    conn = None
+            if conn is None:
+                conn = self._open()
+            return conn
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        """归还连接；discard=True 或连接已过期时直接关闭"""
+        if discard or self._expired(conn):
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """with DB_POOL.connection() as conn: ... 网络类异常时丢弃该连接"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except self._backend.disconnect_errors:
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                **self._counters,
+            }
+
+
+DB_POOL = ConnectionPool(
+    DB_BACKEND,
+    min_size=_cast_int_env(os.getenv("DB_POOL_MIN_SIZE", "1")),
+    max_size=_cast_int_env(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    max_lifetime=_cast_int_env(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+    wait_timeout=_cast_int_env(os.getenv("DB_POOL_WAIT_TIMEOUT", "5")),
+    ping_on_borrow=os.getenv("DB_POOL_PING_ON_BORROW", "true").lower() == "true",
+)
+
+
 def get_db():
-    """获取数据库连接，使用Flask的g对象实现连接复用"""
+    """获取数据库连接，使用Flask的g对象在同一请求内复用连接池中的连接"""
     if 'db_conn' not in g:
-        g.db_conn = pymysql.connect(**DB_CONFIG)
+        g.db_conn = DB_POOL.acquire()
     return g.db_conn
 
 @app.teardown_appcontext
 def close_db(error):
-    """请求结束时关闭数据库连接"""
+    """请求结束时将连接归还连接池"""
     db = g.pop('db_conn', None)
     if db is not None:
-        db.close()
+        discard = isinstance(error, DB_BACKEND.disconnect_errors)
+        DB_POOL.release(db, discard=discard)
+
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(error):
+    app.logger.warning("数据库连接池已满: %s", error)
+    return {"message": "数据库繁忙，请稍后重试"}, 503
 
 # -----------------------
-# 缓存机制优化
+# 运行指标（/metrics，Prometheus 文本格式）
 # -----------------------
-@lru_cache(maxsize=50)
-def get_cached_statistics(period, device_id, target_date, cache_key):
-    """缓存统计数据查询结果，cache_key用于缓存过期控制"""
-    return get_statistics_raw(period, device_id, target_date)
-
-@lru_cache(maxsize=20)
-def get_cached_kpi(device_id, target_date, cache_key):
-    """缓存KPI数据查询结果"""
-    return get_kpi_raw(device_id, target_date)
+HTTP_REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "electricity_http_request_duration_seconds", "HTTP 请求耗时（秒）", ("route", "method", "status")
+)
+SCRAPE_SECONDS = metrics.REGISTRY.histogram(
+    "electricity_scrape_duration_seconds", "单个设备页面抓取与解析耗时（秒）", ("device_id",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0),
+)
+SCRAPE_RESULTS = metrics.REGISTRY.counter(
+    "electricity_scrape_total", "设备页面抓取结果（ok / http_error / parse_error）", ("device_id", "outcome")
+)
+JOB_LAG_SECONDS = metrics.REGISTRY.histogram(
+    "electricity_job_lag_seconds", "定时任务实际开始时间相对计划时间的延迟（秒）", ("job",),
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0),
+)
+JOB_RUNS = metrics.REGISTRY.counter(
+    "electricity_job_runs_total", "定时任务执行结果（executed / error / missed）", ("job", "outcome")
+)
+
+# 请求剖析：开启后记录每条 SQL，并在响应中附加 Server-Timing / X-Query-Count 头（会暴露内部耗时，按需开启）
+PROFILE_QUERIES = os.getenv("PROFILE_QUERIES", "false").split("#", 1)[0].strip().lower() == "true"
+# 超过该耗时（毫秒）的请求写入慢请求日志（JSON），0 表示关闭
+SLOW_REQUEST_MS = _cast_int_env(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+
+@app.before_request
+def _start_request_metrics():
+    # 未匹配路由的请求（404）合并为一个标签，避免任意路径撑大指标数量
+    g.metrics_scope = metrics.set_scope(request.url_rule.rule if request.url_rule else "unmatched")
+    profiler.start(detailed=PROFILE_QUERIES)
+
+
+@app.after_request
+def _record_request_metrics(response):
+    profile = profiler.finish()
+    if profile is None:
+        return response
+    elapsed = profile.elapsed()
+    route = metrics.current_scope()
+    HTTP_REQUEST_SECONDS.observe(elapsed, route, request.method, str(response.status_code))
+    if PROFILE_QUERIES:
+        response.headers["Server-Timing"] = profiler.server_timing(profile, elapsed)
+        response.headers["X-Query-Count"] = str(profile.count)
+    if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+        entry = profiler.slow_entry(
+            profile, elapsed, route=route, method=request.method, path=request.full_path, status=response.status_code
+        )
+        app.logger.warning("慢请求 %s", json.dumps(entry, ensure_ascii=False))
+    return response
 
-def get_cache_key():
-    """生成缓存键，5分钟更新一次"""
-    return int(time.time() // 300)  # 5分钟缓存周期
 
+@app.teardown_request
+def _end_request_metrics(error):
+    profiler.finish()
+    metrics.set_scope(g.pop("metrics_scope", None))
 
-def _strip_tags(html_text):
-    """基础的 HTML 标签清理，用于宽松匹配文本内容"""
-    if not html_text:
-        return ""
-    return re.sub(r"<[^>]+>", " ", html_text)
 
+def _on_job_event(event):
+    """APScheduler 事件：提交时记录延迟，执行结束/出错/错过时计数"""
+    if event.code == EVENT_JOB_SUBMITTED:
+        scheduled = max(event.scheduled_run_times)
+        JOB_LAG_SECONDS.observe(max((datetime.now(scheduled.tzinfo) - scheduled).total_seconds(), 0), event.job_id)
+    elif event.code == EVENT_JOB_MISSED:
+        JOB_RUNS.inc(event.job_id, "missed")
+    else:
+        JOB_RUNS.inc(event.job_id, "error" if event.exception else "executed")
+
+
+def _collect_runtime_stats():
+    """连接池、批量写入、结果缓存、实时推送、抓取调度、设备与后台任务的已有统计，在抓取 /metrics 时读取"""
+    pool = DB_POOL.stats()
+    writer = READING_WRITER.stats()
+    cache = RESULT_CACHE.stats()
+    stream_stats = STREAM_HUB.stats()
+    schedule = sorted(SCRAPE_SCHEDULE.device_stats().items())
+    feed = CHANGE_FOLLOWER.stats()
+    return [
+        ("electricity_db_pool_connections", "gauge", "连接池连接数", ("state",),
+         [(("idle",), pool["idle"]), (("in_use",), pool["in_use"])]),
+        ("electricity_db_pool_events_total", "counter", "连接池事件计数", ("event",),
+         [((name,), pool[name]) for name in ("created", "closed", "borrowed", "waited", "timeouts",
+                                             "health_check_failures", "expired")]),
+        ("electricity_writer_pending", "gauge", "等待写入的缓冲读数", (), [((), writer["pending"])]),
+        ("electricity_writer_events_total", "counter", "批量写入事件计数", ("event",),
+         [((name,), writer[name]) for name in ("buffered", "written", "flushes", "retries", "failed_flushes", "dropped")]),
+        ("electricity_cache_requests_total", "counter", "结果缓存查找次数（按接口类型）", ("kind", "result"),
+         [((kind, result), count) for (kind, result), count in sorted(RESULT_CACHE.kind_stats().items())]),
+        ("electricity_cache_events_total", "counter", "结果缓存淘汰与失效次数", ("event",),
+         [(("evictions",), cache["evictions"]), (("invalidations",), cache["invalidations"])]),
+        ("electricity_cache_bytes", "gauge", "结果缓存估算占用（字节）", (), [((), cache["bytes"])]),
+        ("electricity_cache_entries", "gauge", "结果缓存条目数", (), [((), cache["entries"])]),
+        ("electricity_stream_clients", "gauge", "实时推送在线连接数", (), [((), stream_stats["clients"])]),
+        ("electricity_stream_events_total", "counter", "实时推送事件计数", ("event",),
+         [((name,), stream_stats[name]) for name in ("connected", "rejected", "published", "sent", "dropped_slow")]),
+        ("electricity_scrape_interval_seconds", "gauge", "设备当前的自适应抓取间隔（秒）", ("device_id",),
+         [((device_id,), interval) for device_id, (interval, _) in schedule]),
+        ("electricity_scrape_consecutive_failures", "gauge", "设备连续抓取失败次数（退避中）", ("device_id",),
+         [((device_id,), failures) for device_id, (_, failures) in schedule]),
+        ("electricity_devices", "gauge", "设备登记表中启用的设备数", (), [((), len(DEVICE_LIST))]),
+        ("electricity_scrape_leases", "gauge", "本实例持有的抓取租约数（分片抓取）", (),
+         [((), len(SCRAPE_SHARD.owned()) if SCRAPE_SHARDING else 0)]),
+        ("electricity_job_leader", "gauge", "本进程是否持有后台任务锁（1 为执行定时任务）", (),
+         [((), 1 if JOB_ELECTION and JOB_ELECTION.is_leader else 0)]),
+        ("electricity_change_feed_events_total", "counter", "跨进程入库通知的读取计数", ("event",),
+         [((name,), feed[name]) for name in ("polls", "notifications", "errors")]),
+    ]
+
+
+metrics.REGISTRY.add_collector(_collect_runtime_stats)
 
-def _extract_first_number(text):
-    """从文本中提取第一个数字（含小数）"""
-    if not text:
-        return None
-    match = re.search(r"([0-9]+(?:\.[0-9]+)?)", text.replace(",", ""))
-    if match:
-        try:
-            return float(match.group(1))
-        except ValueError:
-            return None
-    return None
+# -----------------------
+# 表结构（汇总表等派生数据）
+# -----------------------
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS electricity_daily_usage (
+      meter_no VARCHAR(64) NOT NULL,
+      day DATE NOT NULL,
+      first_balance DECIMAL(10,2) NOT NULL,
+      last_balance DECIMAL(10,2) NOT NULL,
+      min_balance DECIMAL(10,2) NOT NULL,
+      max_balance DECIMAL(10,2) NOT NULL,
+      usage_total DECIMAL(12,2) NOT NULL DEFAULT 0,
+      recharge_total DECIMAL(12,2) NOT NULL DEFAULT 0,
+      reading_count INT NOT NULL DEFAULT 0,
+      first_at DATETIME NOT NULL,
+      last_at DATETIME NOT NULL,
+      PRIMARY KEY (meter_no, day)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS electricity_hourly_usage (
+      meter_no VARCHAR(64) NOT NULL,
+      hour_start DATETIME NOT NULL,
+      first_balance DECIMAL(10,2) NOT NULL,
+      last_balance DECIMAL(10,2) NOT NULL,
+      min_balance DECIMAL(10,2) NOT NULL,
+      max_balance DECIMAL(10,2) NOT NULL,
+      usage_total DECIMAL(12,2) NOT NULL DEFAULT 0,
+      recharge_total DECIMAL(12,2) NOT NULL DEFAULT 0,
+      reading_count INT NOT NULL DEFAULT 0,
+      first_at DATETIME NOT NULL,
+      last_at DATETIME NOT NULL,
+      PRIMARY KEY (meter_no, hour_start)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS electricity_recharge (
+      meter_no VARCHAR(64) NOT NULL,
+      recharged_at DATETIME NOT NULL,
+      balance_before DECIMAL(10,2) NOT NULL,
+      balance_after DECIMAL(10,2) NOT NULL,
+      amount INT NOT NULL,
+      PRIMARY KEY (meter_no, recharged_at)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {change_feed.TABLE} (
+      id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+      meter_no VARCHAR(64) NOT NULL,
+      first_at DATETIME NOT NULL,
+      last_at DATETIME NOT NULL,
+      source VARCHAR(64) NOT NULL,
+      logged_at DATETIME NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {device_registry.TABLE} (
+      id VARCHAR(64) NOT NULL PRIMARY KEY,
+      name VARCHAR(128) NOT NULL,
+      server_chan_key VARCHAR(128) NOT NULL DEFAULT '',
+      server_chan_key_env VARCHAR(64) NOT NULL DEFAULT '',
+      enabled TINYINT NOT NULL DEFAULT 1,
+      updated_at DATETIME NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {shard.NODE_TABLE} (
+      node_id VARCHAR(64) NOT NULL PRIMARY KEY,
+      heartbeat_at DATETIME NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {shard.LEASE_TABLE} (
+      device_id VARCHAR(64) NOT NULL PRIMARY KEY,
+      owner VARCHAR(64) NOT NULL DEFAULT '',
+      expires_at DATETIME NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+]
+
+
+def ensure_schema():
+    """
+    创建缺失的派生表并补齐 electricity_balance 新增列（幂等）。
+    MySQL 的原始表仍按 README 手工创建；SQLite 后端连同原始表一起创建。
+    """
+    with DB_POOL.connection() as conn:
+        with conn.cursor() as cursor:
+            for statement in DB_BACKEND.schema(SCHEMA_STATEMENTS):
+                cursor.execute(statement)
+            DB_BACKEND.ensure_column(cursor, "electricity_balance", "confirmed_at", "DATETIME NULL AFTER collected_at")
 
+# -----------------------
+# 缓存机制优化
+# -----------------------
+class DeviceCache:
+    """
+    按表号分区的查询结果缓存，取代按 5 分钟时间片失效的 lru_cache：
+    - 某表号有新读数入库时只清除该表号的可变条目（今日/周/月视图、KPI）；
+    - 已结束日期的结果标记为 immutable，不随入库失效、也不过期，只会被 LRU 淘汰；
+    - 容量按结果的估算字节数限制，超出后淘汰最久未使用的条目。
+    """
 
-def _parse_meter_page(html_text):
-    """解析电表页面 HTML，提取表号与剩余电量"""
-    normalized = unescape(html_text or "")
-    plain_text = None
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (device_id, key) -> (value, size, immutable)
+        self._by_device = {}
+        self._generations = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self._kinds = {}  # (key[0], "hit" / "miss") -> 次数
+
+    @staticmethod
+    def _estimate_size(key, value):
+        return len(json.dumps(value, ensure_ascii=False, default=str)) + len(repr(key)) + 64
+
+    def get_or_compute(self, device_id, key, compute, immutable=False):
+        """命中直接返回；未命中时调用 compute() 并写入缓存"""
+        entry_key = (device_id, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            kind = (key[0] if isinstance(key, tuple) else key, "hit" if entry is not None else "miss")
+            self._kinds[kind] = self._kinds.get(kind, 0) + 1
+            if entry is not None:
+                self._entries.move_to_end(entry_key)
+                self._counters["hits"] += 1
+                return entry[0]
+            self._counters["misses"] += 1
+            generation = self._generations.get(device_id, 0)
+
+        value = compute()
+        size = self._estimate_size(entry_key, value)
+        with self._lock:
+            # 计算期间该表号有新读数入库：结果可能已过时，不写入缓存
+            if self._generations.get(device_id, 0) != generation or size > self.max_bytes:
+                return value
+            self._discard(entry_key)
+            self._entries[entry_key] = (value, size, immutable)
+            self._by_device.setdefault(device_id, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self._counters["evictions"] += 1
+        return value
+
+    def _discard(self, entry_key):
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[1]
+        keys = self._by_device.get(entry_key[0])
+        if keys is not None:
+            keys.discard(entry_key[1])
+            if not keys:
+                del self._by_device[entry_key[0]]
+
+    def invalidate(self, device_id, include_immutable=False):
+        """清除表号的可变条目；include_immutable=True 时（补录历史读数）连同历史日期一并清除"""
+        with self._lock:
+            self._generations[device_id] = self._generations.get(device_id, 0) + 1
+            for key in list(self._by_device.get(device_id, ())):
+                if include_immutable or not self._entries[(device_id, key)][2]:
+                    self._discard((device_id, key))
+                    self._counters["invalidations"] += 1
+
+    def kind_stats(self):
+        """按缓存键的第一项（接口类型）统计的命中/未命中次数"""
+        with self._lock:
+            return dict(self._kinds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                **self._counters,
+            }
+
+
+RESULT_CACHE = DeviceCache(max_bytes=_cast_int_env(os.getenv("CACHE_MAX_MB", "16")) * 1024 * 1024)
+
+
+class MeterScraper:
+    """
+    电表页面抓取客户端：复用 requests.Session 的长连接池，带失败重试与退避，
+    页面编码按主机探测一次后缓存，避免每次对整页做字符集检测。
+    """
 
-    # 先尝试通过 label id 精确匹配
-    meter_id_match = re.search(
-        r'id=["\']metid["\'][^>]*>([^<]+)', normalized, re.IGNORECASE | re.DOTALL
-    )
-    meter_id = meter_id_match.group(1).strip() if meter_id_match else None
-
-    # label 匹配可能失败，退回到纯文本匹配
-    if not meter_id:
-        plain_text = _strip_tags(normalized)
-        fallback_match = re.search(
-            r"(?:电表号|表号)\s*(?:[:：]|&#58;|&colon;)?\s*([0-9A-Za-z\-]+)",
-            plain_text,
+    def __init__(self, pool_size=10, retries=2, backoff_factor=0.5):
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": "Mozilla/5.0"})
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
         )
-        if fallback_match:
-            meter_id = fallback_match.group(1).strip()
-
-    # 匹配剩余电量，优先使用 label
-    power_match = re.search(
-        r"剩余电量(?:[:：]|&#58;|&colon;)?</span>\s*<label[^>]*>([^<]+)</label>",
-        normalized,
-        re.IGNORECASE | re.DOTALL,
-    )
-    raw_power = power_match.group(1).strip() if power_match else None
-
-    if raw_power is None:
-        if plain_text is None:
-            plain_text = _strip_tags(normalized)
-        fallback_power = re.search(
-            r"剩余电量(?:[:：]|&#58;|&colon;)?[^0-9]*([0-9]+(?:\.[0-9]+)?)",
-            plain_text,
-        )
-        raw_power = fallback_power.group(1) if fallback_power else None
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._encodings = {}
+
+    def get_text(self, url, timeout=10):
+        """GET 页面并按缓存的编码解码为文本"""
+        resp = self.session.get(url, timeout=timeout)
+        resp.raise_for_status()
+        host = urlsplit(url).netloc
+        encoding = self._encodings.get(host)
+        if encoding is None:
+            encoding = resp.apparent_encoding or resp.encoding or "utf-8"
+            self._encodings[host] = encoding
+        return resp.content.decode(encoding, errors="replace")
 
-    power = _extract_first_number(raw_power)
 
-    return meter_id, power
+# 电表页面地址模板，{device_id} 替换为表号；基准测试时指向本地模拟页面
+METER_PAGE_URL = os.getenv("METER_PAGE_URL", "http://www.wap.cnyiot.com/nat/pay.aspx?mid={device_id}").split("#", 1)[0].strip()
 
 
-def fetch_meter_data(device_id):
-    url = f"http://www.wap.cnyiot.com/nat/pay.aspx?mid={device_id}"
-    headers={"User-Agent":"Mozilla/5.0"}
+def fetch_meter_data(device_id, timeout=10):
+    url = METER_PAGE_URL.format(device_id=device_id)
+    started = time.perf_counter()
     try:
-        resp = requests.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
-        resp.encoding = resp.apparent_encoding or resp.encoding or "utf-8"
-        html_text = resp.text
+        html_text = METER_SCRAPER.get_text(url, timeout=timeout)
     except Exception as exc:
         app.logger.warning("抓取设备 %s 页面失败: %s", device_id, exc)
+        SCRAPE_SECONDS.observe(time.perf_counter() - started, device_id)
+        SCRAPE_RESULTS.inc(device_id, "http_error")
         return None
 
-    meter_id, power = _parse_meter_page(html_text)
+    meter_id, power = parse_meter_page(html_text)
+    SCRAPE_SECONDS.observe(time.perf_counter() - started, device_id)
 
     if not meter_id or power is None:
         app.logger.warning(
@@ -243,331 +675,1273 @@ def fetch_meter_data(device_id):
             meter_id,
             power,
         )
+        SCRAPE_RESULTS.inc(device_id, "parse_error")
         return None
 
+    SCRAPE_RESULTS.inc(device_id, "ok")
     return {"meter_no": meter_id, "remain": power, "collected_at": now_cn()}
 
-def save_to_db(data):
-    conn = pymysql.connect(**DB_CONFIG)
-    sql = "INSERT INTO electricity_balance (meter_no, remain, collected_at) VALUES (%s,%s,%s)"
+# -----------------------
+# 读数批量写入
+# -----------------------
+# 存储模式：all 每条读数一行；change_only 只在余额变化、超过心跳间隔或采样中断时新增一行，
+# 其余读数只把该行的 confirmed_at（该值最后一次被确认的时间）推后
+STORAGE_MODE = os.getenv("STORAGE_MODE", "all").split("#", 1)[0].strip().lower()
+if STORAGE_MODE not in ("all", "change_only"):
+    raise RuntimeError(f"Invalid value for STORAGE_MODE: {STORAGE_MODE}")
+# change_only 模式下同一行最长覆盖的时间（秒），到期后即使余额不变也新增一行
+STORAGE_HEARTBEAT_SECONDS = _cast_int_env(os.getenv("STORAGE_HEARTBEAT_SECONDS", "3600"))
+# 相邻读数间隔超过该值（秒）视为采样中断并新起一行；上限 3600，保证能还原每小时是否有读数
+STORAGE_MAX_GAP_SECONDS = min(_cast_int_env(os.getenv("STORAGE_MAX_GAP_SECONDS", "900")), 3600)
+
+_STORAGE_LOCK = threading.Lock()
+
+
+def _load_latest_rows(conn, meters):
+    """一次查询读取多个表号的最新一行，返回 {表号: [collected_at, confirmed_at, remain]}"""
+    cursor = conn.cursor()
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(sql, (data["meter_no"], data["remain"], data["collected_at"]))
+        cursor.execute(*queries.latest_rows(meters, DB_BACKEND.name))
+        return {
+            meter_no: [collected_at, confirmed_at, round(float(remain), 2)]
+            for meter_no, collected_at, confirmed_at, remain in cursor.fetchall()
+        }
     finally:
-        conn.close()
+        cursor.close()
+
+
+def _compact_readings(conn, readings):
+    """
+    change_only 模式下把读数折叠为待写入的行 [(表号, 余额, collected_at, confirmed_at), ...]：
+    余额与该表号最新一行相同、距该行起点不超过心跳间隔、距上次确认不超过 STORAGE_MAX_GAP_SECONDS 时，
+    只推后最新一行的 confirmed_at；否则新增一行。
+    不晚于最新确认时间的读数（补录、乱序、重复）先由 _write_late_reading 逐条写入。
+    """
+    meters = sorted({r["meter_no"] for r in readings})
+    latest = _load_latest_rows(conn, meters)
+    ordered = sorted(readings, key=lambda item: item["collected_at"])
+    late = [
+        r for r in ordered
+        if r["meter_no"] in latest and r["collected_at"] <= (latest[r["meter_no"]][1] or latest[r["meter_no"]][0])
+    ]
+    if late:
+        with conn.cursor() as cursor:
+            for r in late:
+                _write_late_reading(cursor, r)
+        latest = _load_latest_rows(conn, meters)
+        ordered = [r for r in ordered if r not in late]
+    rows = {}
+    for r in ordered:
+        meter_no, collected_at = r["meter_no"], r["collected_at"]
+        remain = round(float(r["remain"]), 2)
+        run = latest.get(meter_no)
+        if run is not None:
+            anchor_at, confirmed_at, run_remain = run
+            seen_at = confirmed_at or anchor_at
+            if collected_at <= seen_at:
+                rows[(meter_no, collected_at)] = (meter_no, remain, collected_at, None)
+                continue
+            if (
+                remain == run_remain
+                and (collected_at - seen_at).total_seconds() <= STORAGE_MAX_GAP_SECONDS
+                and (collected_at - anchor_at).total_seconds() < STORAGE_HEARTBEAT_SECONDS
+            ):
+                run[1] = collected_at
+                rows[(meter_no, anchor_at)] = (meter_no, run_remain, anchor_at, collected_at)
+                continue
+        latest[meter_no] = [collected_at, None, remain]
+        rows[(meter_no, collected_at)] = (meter_no, remain, collected_at, None)
+    return list(rows.values())
+
+
+def _write_late_reading(cursor, reading):
+    """
+    change_only 模式下写入早于最新确认时间的一条读数。读数落在某一行 collected_at ~ confirmed_at 的覆盖范围内时：
+    余额相同则该行已经代表它，不再写入；余额不同则拆分该行——原行只确认到读数前 1 秒，
+    读数后 1 秒起以原余额续接到原确认时间，使各行覆盖的时间互不重叠、展开后的序列仍与逐条存储时的顺序一致。
+    （逐条存储时原余额在下一次抓取时重新出现，这里无法得知该时间，近似为读数后 1 秒。）
+    """
+    meter_no, collected_at = reading["meter_no"], reading["collected_at"]
+    remain = round(float(reading["remain"]), 2)
+    cursor.execute(*queries.series_window(meter_no, collected_at, collected_at + timedelta(seconds=1)))
+    covering = sorted(row for row in cursor.fetchall() if row[0] <= collected_at)
+    if covering:
+        anchor_at, confirmed_at, run_remain = covering[-1]
+        if confirmed_at is not None and anchor_at < confirmed_at and collected_at <= confirmed_at:
+            run_remain = round(float(run_remain), 2)
+            if remain == run_remain:
+                return
+            before, after = collected_at - timedelta(seconds=1), collected_at + timedelta(seconds=1)
+            if anchor_at < collected_at:
+                cursor.execute(
+                    "UPDATE electricity_balance SET confirmed_at=%s WHERE meter_no=%s AND collected_at=%s",
+                    (before if before > anchor_at else None, meter_no, anchor_at),
+                )
+                rows = [(meter_no, remain, collected_at, None)]
+            else:
+                # 读数正好是该行的起点：起点改为新余额，其余时间由续接的行覆盖
+                cursor.execute(
+                    "UPDATE electricity_balance SET remain=%s, confirmed_at=NULL WHERE meter_no=%s AND collected_at=%s",
+                    (remain, meter_no, anchor_at),
+                )
+                rows = []
+            if after <= confirmed_at:
+                rows.append((meter_no, run_remain, after, confirmed_at if confirmed_at > after else None))
+            DB_BACKEND.insert_readings(cursor, rows)
+            return
+    DB_BACKEND.insert_readings(cursor, [(meter_no, remain, collected_at, None)])
+
+
+def _write_readings(conn, readings):
+    """
+    一次写入多条读数：MySQL 下 executemany 会合并为一条多行 INSERT，SQLite 下在同一事务中执行，
+    (meter_no, collected_at) 重复时按唯一键覆盖余额而不是报错。
+    汇总表与充值记录始终按全部读数更新，与存储模式无关。
+    """
+    with _STORAGE_LOCK:
+        if STORAGE_MODE == "change_only":
+            rows = _compact_readings(conn, readings)
+        else:
+            rows = [(r["meter_no"], r["remain"], r["collected_at"], None) for r in readings]
+        with conn.cursor() as cursor:
+            DB_BACKEND.insert_readings(cursor, rows)
+    # 原始读数是唯一数据源，汇总表更新失败只记录日志，不影响入库
+    try:
+        _update_rollups(conn, readings)
+    except Exception as exc:
+        app.logger.warning("更新用电汇总失败（%s 条读数）: %s", len(readings), exc)
+    try:
+        _update_recharges(conn, readings)
+    except Exception as exc:
+        app.logger.warning("更新充值记录失败（%s 条读数）: %s", len(readings), exc)
+    # 汇总表更新之后再通知其他进程，避免它们按旧的汇总重新计算并缓存
+    try:
+        with conn.cursor() as cursor:
+            change_feed.append(cursor, PROCESS_ID, readings, now_cn())
+    except Exception as exc:
+        app.logger.warning("记录入库通知失败: %s", exc)
+    today = now_cn().date()
+    backdated = {}
+    for r in readings:
+        backdated[r["meter_no"]] = backdated.get(r["meter_no"], False) or r["collected_at"].date() < today
+    for meter_no, include_immutable in backdated.items():
+        RESULT_CACHE.invalidate(meter_no, include_immutable=include_immutable)
+    if STREAM_HUB.running:
+        try:
+            _publish_readings(conn, readings)
+        except Exception as exc:
+            app.logger.warning("推送实时读数失败: %s", exc)
+
+
+def save_to_db(data):
+    """立即写入单条读数（手动抓取等需要同步落库的场景）"""
+    with DB_POOL.connection() as conn:
+        _write_readings(conn, [data])
+
+
+class ReadingWriter:
+    """
+    读数缓冲写入器：抓取线程只把读数放进缓冲区，攒够 batch_size 条或最早一条已等待
+    flush_interval 秒时，由后台线程批量 upsert；失败按指数退避重试 max_retries 次，
+    仍失败的读数放回缓冲区等待下次刷新（缓冲区超过 max_buffer 时丢弃最旧的读数）。
+    """
+
+    def __init__(self, pool, batch_size=200, flush_interval=5, max_retries=3, retry_backoff=0.5, max_buffer=10000):
+        self.pool = pool
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_buffer = max(max_buffer, self.batch_size)
+        self._buffer = deque()
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._counters = {
+            "buffered": 0, "written": 0, "flushes": 0,
+            "retries": 0, "failed_flushes": 0, "dropped": 0,
+        }
+
+    def add(self, data):
+        """缓冲一条读数；后台线程未启动时（命令行、单次调用）达到批量大小即同步刷新"""
+        with self._cond:
+            self._buffer.append(data)
+            self._counters["buffered"] += 1
+            first = self._oldest is None
+            if first:
+                self._oldest = time.monotonic()
+            full = len(self._buffer) >= self.batch_size
+            if first or full:
+                # 首条读数开始计时，缓冲区满则立即刷新
+                self._cond.notify()
+        if full and self._thread is None:
+            self.flush()
+
+    def flush(self):
+        """写出当前缓冲的全部读数，返回写入条数；多个调用方同时刷新时串行执行"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    if not self._buffer:
+                        self._oldest = None
+                        return written
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                    self._oldest = time.monotonic() if self._buffer else None
+                if not self._write_with_retry(batch):
+                    self._requeue(batch)
+                    return written
+                written += len(batch)
+
+    def _write_with_retry(self, batch):
+        # 同一批次内重复的 (表号, 采集时间) 只保留最后一条
+        readings = list({(r["meter_no"], r["collected_at"]): r for r in batch}.values())
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.pool.connection() as conn:
+                    _write_readings(conn, readings)
+                with self._cond:
+                    self._counters["written"] += len(readings)
+                    self._counters["flushes"] += 1
+                return True
+            except Exception as exc:
+                if attempt >= self.max_retries:
+                    app.logger.error("批量写入 %s 条读数失败，已重试 %s 次: %s", len(readings), attempt, exc)
+                    with self._cond:
+                        self._counters["failed_flushes"] += 1
+                    return False
+                with self._cond:
+                    self._counters["retries"] += 1
+                app.logger.warning("批量写入失败，%.1fs 后重试: %s", self.retry_backoff * 2 ** attempt, exc)
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._buffer.extendleft(reversed(batch))
+            overflow = len(self._buffer) - self.max_buffer
+            for _ in range(max(overflow, 0)):
+                self._buffer.popleft()
+            if overflow > 0:
+                self._counters["dropped"] += overflow
+                app.logger.error("读数缓冲区已满，丢弃最旧的 %s 条读数", overflow)
+            if self._buffer and self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if len(self._buffer) >= self.batch_size:
+                        break
+                    if self._oldest is not None:
+                        remaining = self._oldest + self.flush_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+            if self._buffer and self._oldest is not None:
+                # 刷新失败：等待一个刷新间隔后再试，避免数据库不可用时空转
+                time.sleep(self.flush_interval)
+
+    def start(self):
+        """启动后台刷新线程（守护线程）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reading-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """停止后台线程并写出剩余读数"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "batch_size": self.batch_size,
+                "flush_interval": self.flush_interval,
+                "pending": len(self._buffer),
+                **self._counters,
+            }
+
+
+READING_WRITER = ReadingWriter(
+    DB_POOL,
+    batch_size=_cast_int_env(os.getenv("WRITE_BATCH_SIZE", "200")),
+    flush_interval=_cast_int_env(os.getenv("WRITE_FLUSH_INTERVAL", "5")),
+    max_retries=_cast_int_env(os.getenv("WRITE_MAX_RETRIES", "3")),
+)
+
+# -----------------------
+# 实时推送（SSE，见 stream.py）
+# -----------------------
+# 推送服务监听的端口（0 为关闭）；页面请求 /stream 时重定向到该端口
+STREAM_PORT = _cast_int_env(os.getenv("STREAM_PORT", "5001"))
+# 浏览器访问推送服务使用的端口（端口映射时与 STREAM_PORT 不同），0 为与实际监听端口相同
+STREAM_PUBLIC_PORT = _cast_int_env(os.getenv("STREAM_PUBLIC_PORT", "0"))
+# 浏览器访问推送服务的完整地址（如 https://example.com/sse），设置后优先于 STREAM_PUBLIC_PORT
+STREAM_PUBLIC_URL = os.getenv("STREAM_PUBLIC_URL", "").split("#", 1)[0].strip().rstrip("/")
+STREAM_MAX_CLIENTS = _cast_int_env(os.getenv("STREAM_MAX_CLIENTS", "1000"))
+# 允许跨域读取推送的页面来源（逗号分隔，如 https://example.com；* 为任意来源），
+# 为空时只允许与推送服务主机名相同的页面
+STREAM_ALLOW_ORIGINS = tuple(
+    origin.strip() for origin in os.getenv("STREAM_ALLOW_ORIGINS", "").split("#", 1)[0].split(",") if origin.strip()
+)
+
+STREAM_HUB = stream.StreamHub(
+    os.getenv("HOST", "0.0.0.0"),
+    STREAM_PORT,
+    is_known=lambda device_id: any(d["id"] == device_id for d in DEVICE_LIST),
+    max_clients=STREAM_MAX_CLIENTS,
+    allow_origins=STREAM_ALLOW_ORIGINS,
+)
+
+
+def _stream_payload(conn, meter_no, reading, now):
+    """一条读数的推送内容：读数本身、今日 KPI（余额、今日用电、今日充值）与所在小时的汇总（日视图图表用）"""
+    today = now.date()
+    current_hour = reading["collected_at"].replace(minute=0, second=0, microsecond=0)
+    daily = _load_daily_rollups(conn, meter_no, today, today).get(str(today))
+    hour = None
+    if current_hour.date() == today:
+        row = _load_rollups(conn, "hourly", meter_no, current_hour, current_hour + timedelta(hours=1)).get(current_hour)
+        if row is not None:
+            hour = {
+                "date": str(today),
+                "index": current_hour.hour,
+                "label": f"{current_hour.hour:02d}点",
+                # 与日视图相同：00点使用第一条余额，其他小时使用最后一条余额
+                "balance": row["first_balance"] if current_hour.hour == 0 else row["last_balance"],
+                "usage": row["usage_total"],
+            }
+    return {
+        "device_id": meter_no,
+        "collected_at": reading["collected_at"].strftime("%Y-%m-%d %H:%M:%S"),
+        "remain": round(float(reading["remain"]), 2),
+        "kpi": {
+            "current_balance": _get_latest_balance(conn, meter_no),
+            "usage_today": daily["usage_total"] if daily else 0.0,
+            "recharge_today": _kpi_recharge_today(conn, meter_no, None, now),
+        },
+        "hour": hour,
+    }
+
+
+def _publish_readings(conn, readings):
+    """把每个有订阅者的表号在本批中的最新读数推送出去（没有打开的页面时不做任何查询）"""
+    latest = {}
+    for r in readings:
+        if STREAM_HUB.has_subscribers(r["meter_no"]):
+            current = latest.get(r["meter_no"])
+            if current is None or r["collected_at"] > current["collected_at"]:
+                latest[r["meter_no"]] = r
+    now = now_cn()
+    for meter_no, reading in latest.items():
+        payload = _stream_payload(conn, meter_no, reading, now)
+        STREAM_HUB.publish(meter_no, "reading", payload, event_id=payload["collected_at"])
+
+# -----------------------
+# 跨进程缓存同步（见 change_feed.py）
+# -----------------------
+# 写入读数的进程在入库通知表中留下记录，其他进程据此失效缓存、推送实时读数
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"[:64]
+# 读取其他进程入库通知的间隔（秒），0 为关闭（单进程部署不需要）
+CACHE_SYNC_SECONDS = _cast_int_env(os.getenv("CACHE_SYNC_SECONDS", "5"))
+
+
+def _on_remote_ingest(changes):
+    """其他进程写入了新读数：失效对应表号的缓存，有订阅者的表号推送最新读数"""
+    today = now_cn().date()
+    for meter_no, first_at in changes.items():
+        RESULT_CACHE.invalidate(meter_no, include_immutable=first_at.date() < today)
+    meters = [meter_no for meter_no in changes if STREAM_HUB.has_subscribers(meter_no)]
+    if not meters:
+        return
+    with DB_POOL.connection() as conn:
+        readings = [
+            {"meter_no": meter_no, "collected_at": confirmed_at or collected_at, "remain": remain}
+            for meter_no, (collected_at, confirmed_at, remain) in _load_latest_rows(conn, meters).items()
+        ]
+        _publish_readings(conn, readings)
+
+
+CHANGE_FOLLOWER = change_feed.ChangeFollower(
+    DB_POOL, PROCESS_ID, _on_remote_ingest, interval=max(CACHE_SYNC_SECONDS, 1), logger=app.logger
+)
+
+# -----------------------
+# 设备登记表（见 device_registry.py）
+# -----------------------
+# 各进程重新读取设备登记表的间隔（秒），0 为只在启动时读取
+DEVICE_RELOAD_SECONDS = _cast_int_env(os.getenv("DEVICE_RELOAD_SECONDS", "30"))
+
+
+def _on_devices_changed(devices):
+    """登记表有变化：原地替换 DEVICE_LIST，页面、推送、抓取与报告随之使用新的列表"""
+    before = {device["id"] for device in DEVICE_LIST}
+    after = {device["id"] for device in devices}
+    DEVICE_LIST[:] = devices
+    if before != after:
+        app.logger.info(
+            "设备列表已更新：%s 台（新增 %s，移除 %s）",
+            len(devices), ", ".join(sorted(after - before)) or "无", ", ".join(sorted(before - after)) or "无",
+        )
+
+
+DEVICE_REGISTRY = device_registry.DeviceRegistry(
+    DB_POOL, DB_BACKEND, DEVICE_LIST, _on_devices_changed,
+    interval=DEVICE_RELOAD_SECONDS, clock=now_cn, logger=app.logger,
+)
 
 # -----------------------
 # 数据统计（原始版本，供缓存调用）
 # -----------------------
+def _hourly_series(conn, device_id, start_time, now):
+    """日视图：start_time 当天 24 小时的余额与用电量"""
+    labels, balances, usage = [], [], []
+    end_time = start_time + timedelta(days=1)
+
+    # 已结束的小时直接读小时汇总表，仍在进行中的当前小时按原始读数实时计算
+    hourly = {}
+    if device_id:
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        closed_end = min(end_time, max(current_hour, start_time))
+        hourly = _load_rollups(conn, "hourly", device_id, start_time, closed_end)
+        if start_time <= current_hour < end_time:
+            live = _rebuild_rollup(conn, "hourly", device_id, current_hour)
+            if live:
+                hourly[current_hour] = live
+
+    for h in range(24):
+        labels.append(f"{h:02d}点")
+        row = hourly.get(start_time + timedelta(hours=h))
+        # 00点使用第一条余额，其他小时使用最后一条余额
+        if row is None:
+            balances.append(None)
+        else:
+            balances.append(row["first_balance"] if h == 0 else row["last_balance"])
+        # 与每日汇总同一规则：各小时用电之和等于当日用电
+        usage.append(row["usage_total"] if row is not None else 0.0)
+
+    return labels, balances, usage
+
+
+def _daily_series(rollups, start_date, end_date):
+    """周/月视图：由每日汇总（已按充值规则累计）生成 [start_date, end_date] 的连续日期序列"""
+    labels, balances, usage = [], [], []
+    cur_date = start_date
+    while cur_date <= end_date:
+        row = rollups.get(str(cur_date))
+        labels.append(str(cur_date))
+        balances.append(row["last_balance"] if row else None)
+        usage.append(row["usage_total"] if row else 0.0)
+        cur_date = cur_date + timedelta(days=1)
+    return labels, balances, usage
+
+
 def get_statistics_raw(period="day", device_id=None, target_date=None):
     """原始统计数据查询函数，使用连接池"""
     conn = get_db()
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    now = now_cn()
+
+    if period == "day":
+        start_time = datetime.combine(_resolve_date(target_date, now), datetime.min.time())
+        return _hourly_series(conn, device_id, start_time, now)
+
+    days = 7 if period == "week" else 30
+    start_date = (now - timedelta(days=days - 1)).date()
+    end_date = now.date()
+    rollups = _load_daily_rollups(conn, device_id, start_date, end_date) if device_id else {}
+    return _daily_series(rollups, start_date, end_date)
+
+def _resolve_date(target_date, now):
+    """解析 YYYY-MM-DD，缺省或格式错误时返回今天"""
+    if target_date:
+        try:
+            return datetime.strptime(target_date, "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    return now.date()
+
+
+# 统计数据接口（使用缓存）
+def get_statistics(period="day", device_id=None, target_date=None):
+    """缓存版本的统计数据接口：已结束日期的日视图永久缓存，其余随入库失效"""
+    now = now_cn()
+    today = now.date()
+    if period == "day":
+        day = _resolve_date(target_date, now)
+        key = ("statistics", "day", str(day))
+        immutable = day < today
+        target_date = str(day)
+    else:
+        key = ("statistics", period, str(today))
+        immutable = False
+    return RESULT_CACHE.get_or_compute(
+        device_id, key, lambda: get_statistics_raw(period, device_id, target_date), immutable=immutable
+    )
+
+
+# -----------------------
+# 序列计算引擎（单次范围扫描）
+# -----------------------
+def _ceil_time(ts, step):
+    """向上取整到 step 的整数倍（按当天 0 点对齐）"""
+    floor = usage_engine.floor_time(ts, step)
+    return floor if floor == ts else floor + step
+
+
+def _expand_run(collected_at, confirmed_at, remain, start_time, end_time, step=timedelta(hours=1)):
+    """
+    将一行读数展开为 [start_time, end_time) 内的读数点。change_only 模式下一行代表
+    collected_at ~ confirmed_at 之间余额不变的连续读数，展开为段首、段内每个 step 边界和段尾，
+    使宽度不小于 step 的各时段的首末余额、用电量以及“该时段是否有读数”与逐条存储（且采样间隔不超过 step）时一致。
+    """
+    points = []
+    if start_time <= collected_at < end_time:
+        points.append((collected_at, remain))
+    if confirmed_at is None or confirmed_at <= collected_at:
+        return points
+    edge = max(_ceil_time(collected_at + timedelta(seconds=1), step), _ceil_time(start_time, step))
+    stop = min(confirmed_at, end_time - timedelta(microseconds=1))
+    while edge <= stop:
+        points.append((edge, remain))
+        edge += step
+    if start_time <= confirmed_at < end_time and points[-1:] != [(confirmed_at, remain)]:
+        points.append((confirmed_at, remain))
+    return points
+
+
+def _fetch_series_window(conn, device_id, start_time, end_time, step=timedelta(hours=1)):
+    """
+    一次查询取回 [start_time 之前最后一条读数, end_time) 的有序读数（change_only 的行按 step 展开）。
+    返回 (prev_remain, rows)，rows 为 [(collected_at, remain_float), ...]。
+    """
+    cursor = conn.cursor()
     try:
-        now = now_cn()
-        labels, balances, usage = [], [], []
+        cursor.execute(*queries.series_window(device_id, start_time, end_time))
+        prev_remain = None
+        rows = []
+        for collected_at, confirmed_at, remain in sorted(cursor.fetchall(), key=lambda row: row[0]):
+            if remain is None:
+                continue
+            if collected_at < start_time:
+                prev_remain = float(remain)
+            rows.extend(_expand_run(collected_at, confirmed_at, float(remain), start_time, end_time, step))
+        # 拆分之前写入的乱序读数可能落在其他行的覆盖范围内，按时间重新排序（已有序时为线性时间）
+        rows.sort(key=lambda point: point[0])
+        return prev_remain, rows
+    finally:
+        cursor.close()
 
-        where_clause = ""
-        params = []
-        if device_id:
-            where_clause = " AND meter_no=%s"
-            params.append(device_id)
+# -----------------------
+# 用电汇总表（每日 electricity_daily_usage / 每小时 electricity_hourly_usage）
+# -----------------------
+_ROLLUP_LOCK = threading.Lock()
+
+ROLLUP_COLUMNS = (
+    "first_balance", "last_balance", "min_balance", "max_balance",
+    "usage_total", "recharge_total", "reading_count", "first_at", "last_at",
+)
+
+ROLLUP_SPECS = {
+    "daily": {
+        "table": "electricity_daily_usage",
+        "key_column": "day",
+        "width": timedelta(days=1),
+        "bucket": lambda ts: ts.date(),
+    },
+    "hourly": {
+        "table": "electricity_hourly_usage",
+        "key_column": "hour_start",
+        "width": timedelta(hours=1),
+        "bucket": lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    },
+}
 
-        if period == "day":
-            if target_date:
-                try:
-                    base = datetime.strptime(target_date, "%Y-%m-%d")
-                except Exception:
-                    base = now
-                start_time = base.replace(hour=0, minute=0, second=0, microsecond=0)
-            else:
-                start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_time = start_time + timedelta(days=1)
 
-            # 使用统一的每日用电计算方法（带充值处理）
-            if device_id:
-                daily_usage = _calculate_daily_usage_with_recharge(conn, device_id, start_time)
-            else:
-                daily_usage = 0.0
-
-            # 1) 当天所有读数
-            sql_day = f"""
-                SELECT collected_at, remain
-                FROM electricity_balance
-                WHERE collected_at >= %s AND collected_at < %s {where_clause}
-                ORDER BY collected_at
-            """
-            cursor.execute(sql_day, tuple([start_time, end_time] + params))
-            rows = cursor.fetchall()
-
-            # 2) start_time 之前最近一条读数（用于 0 点的用电计算）
-            sql_prev = f"""
-                SELECT collected_at, remain
-                FROM electricity_balance
-                WHERE collected_at < %s {where_clause}
-                ORDER BY collected_at DESC
-                LIMIT 1
-            """
-            cursor.execute(sql_prev, tuple([start_time] + params))
-            prev_row = cursor.fetchone()
-            prev_remain = float(prev_row['remain']) if prev_row and prev_row['remain'] is not None else None
-
-            # 取每小时余额：00点取第一条，其他小时取最后一条
-            last_by_hour = {}
-            first_by_hour = {}
-            for r in rows:
-                if r['remain'] is None:
-                    continue
-                h = r['collected_at'].hour
-                # 记录每小时的最后一条
-                last_by_hour[h] = float(r['remain'])
-                # 记录每小时的第一条（只在第一次遇到时记录）
-                if h not in first_by_hour:
-                    first_by_hour[h] = float(r['remain'])
-
-            # labels / balances（00点到23点）
-            for h in range(24):
-                labels.append(f"{h:02d}点")
-                # 00点使用第一条余额，其他小时使用最后一条余额
-                if h == 0:
-                    balances.append(first_by_hour.get(h, None))
-                else:
-                    balances.append(last_by_hour.get(h, None))
+def _bucket_start(key):
+    """汇总键（date 或整点 datetime）对应的起始时间"""
+    if isinstance(key, datetime):
+        return key
+    return datetime.combine(key, datetime.min.time())
 
-            # 使用改进的每小时用电计算逻辑，处理充值情况
-            hourly_usage = _calculate_hourly_usage_with_recharge(rows, prev_remain)
-            for h in range(24):
-                usage.append(hourly_usage.get(h, 0.0))
 
-        else:
-            # week / month 使用改进的算法
-            days = 7 if period == "week" else 30
-            start_time = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
-            end_time = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-            # 使用逐日计算的方法，确保充值处理的一致性
-            last_by_day = {}
-            usage_by_day = {}
-            
-            # 构建连续日期序列
-            cur_date = start_time.date()
-            end_date = now.date()
-            ordered_days = []
-            while cur_date <= end_date:
-                ordered_days.append(str(cur_date))
-                cur_date = cur_date + timedelta(days=1)
-            
-            # 为每一天计算用电量
-            if device_id:
-                for day_str in ordered_days:
-                    day_date = datetime.strptime(day_str, "%Y-%m-%d")
-                    # 获取当日最后余额
-                    last_balance = _get_last_balance_for_date(conn, device_id, day_date)
-                    if last_balance is not None:
-                        last_by_day[day_str] = last_balance
-                    
-                    # 计算当日真实用电量（处理充值）
-                    daily_usage = _calculate_daily_usage_with_recharge(conn, device_id, day_date)
-                    usage_by_day[day_str] = daily_usage
-
-            for d in ordered_days:
-                labels.append(d)
-                balances.append(last_by_day.get(d, None))
-                usage.append(float(usage_by_day.get(d, 0.0)))
-
-        return labels, balances, usage
+def _summary_to_rollup(summary):
+    """用电引擎的桶汇总（分）转换为汇总行（元/度，float）"""
+    return {
+        "first_balance": summary["first_cents"] / 100,
+        "last_balance": summary["last_cents"] / 100,
+        "min_balance": summary["min_cents"] / 100,
+        "max_balance": summary["max_cents"] / 100,
+        "usage_total": summary["usage_cents"] / 100,
+        "recharge_total": summary["recharge_cents"] / 100,
+        "reading_count": summary["count"],
+        "first_at": summary["first_at"],
+        "last_at": summary["last_at"],
+    }
+
+
+def _accumulate_rollup(summary, prev_balance, points):
+    """
+    将有序读数 [(collected_at, balance), ...] 累加进汇总行，summary 为 None 时新建。
+    起点为该时间段之前的最后一条读数，用电/充值按 usage_engine 的统一规则计算。
+    """
+    prev_cents = usage_engine.to_cents(prev_balance) if prev_balance is not None else None
+    series = usage_engine.Series.from_points(points)
+    edges = [points[0][0], points[-1][0] + timedelta(microseconds=1)]
+    added = usage_engine.summarize(series, edges, prev_cents)[0]
+    if added is None:
+        return summary
+    if summary is None:
+        return _summary_to_rollup(added)
+    summary = dict(summary)
+    summary["last_balance"] = added["last_cents"] / 100
+    summary["min_balance"] = min(summary["min_balance"], added["min_cents"] / 100)
+    summary["max_balance"] = max(summary["max_balance"], added["max_cents"] / 100)
+    summary["usage_total"] = round(summary["usage_total"] + added["usage_cents"] / 100, 2)
+    summary["recharge_total"] = round(summary["recharge_total"] + added["recharge_cents"] / 100, 2)
+    summary["reading_count"] += added["count"]
+    summary["last_at"] = added["last_at"]
+    return summary
+
+
+def _build_rollups(kind, prev_remain, rows):
+    """一次汇总有序读数，生成 {汇总键: 汇总行}"""
+    spec = ROLLUP_SPECS[kind]
+    prev_cents = usage_engine.to_cents(prev_remain) if prev_remain is not None else None
+    series = usage_engine.Series.from_points(rows)
+    return {
+        spec["bucket"](edge): _summary_to_rollup(summary)
+        for edge, summary in usage_engine.summarize_by(series, spec["width"], prev_cents)
+    }
+
+
+def _upsert_rollups(cursor, kind, meter_no, rollups):
+    """批量写入单个表号的汇总行"""
+    _upsert_rollup_rows(cursor, kind, [(meter_no, key, summary) for key, summary in sorted(rollups.items())])
+
+
+def _upsert_rollup_rows(cursor, kind, items):
+    """批量写入汇总行 [(表号, 汇总键, 汇总行), ...]（按主键覆盖的批量 INSERT）"""
+    if not items:
+        return
+    spec = ROLLUP_SPECS[kind]
+    key_columns = ("meter_no", spec["key_column"])
+    sql = DB_BACKEND.upsert_sql(spec["table"], key_columns + ROLLUP_COLUMNS, key_columns)
+    values = []
+    for meter_no, key, summary in items:
+        row = [meter_no, key]
+        for c in ROLLUP_COLUMNS:
+            v = summary[c]
+            row.append(round(v, 2) if isinstance(v, float) else v)
+        values.append(tuple(row))
+    cursor.executemany(sql, values)
+
+
+def _row_to_rollup(row):
+    """数据库行（DictCursor）转换为汇总行，金额统一为 float"""
+    summary = {c: row[c] for c in ROLLUP_COLUMNS}
+    for c in ("first_balance", "last_balance", "min_balance", "max_balance", "usage_total", "recharge_total"):
+        summary[c] = float(summary[c])
+    return summary
+
+
+def _load_rollups(conn, kind, device_id, start_key, end_key):
+    """读取 [start_key, end_key) 的汇总行，返回 {汇总键: 汇总行}"""
+    spec = ROLLUP_SPECS[kind]
+    key_column = spec["key_column"]
+    cursor = DB_BACKEND.dict_cursor(conn)
+    try:
+        sql = f"""
+            SELECT {key_column}, {', '.join(ROLLUP_COLUMNS)}
+            FROM {spec['table']}
+            WHERE meter_no=%s AND {key_column} >= %s AND {key_column} < %s
+            ORDER BY {key_column}
+        """
+        cursor.execute(sql, (device_id, start_key, end_key))
+        return {row[key_column]: _row_to_rollup(row) for row in cursor.fetchall()}
     finally:
         cursor.close()
 
-# 统计数据接口（使用缓存）
-def get_statistics(period="day", device_id=None, target_date=None):
-    """缓存版本的统计数据接口"""
-    cache_key = get_cache_key()
-    return get_cached_statistics(period, device_id, target_date, cache_key)
 
+def _load_daily_rollups(conn, device_id, start_date, end_date):
+    """读取 [start_date, end_date] 的每日汇总，返回 {'YYYY-MM-DD': 汇总行}"""
+    rollups = _load_rollups(conn, "daily", device_id, start_date, end_date + timedelta(days=1))
+    return {str(day): summary for day, summary in rollups.items()}
+
+
+def _rebuild_rollup(conn, kind, meter_no, key):
+    """从原始读数重算单个表号的单个汇总键（如当前进行中的小时）"""
+    start = _bucket_start(key)
+    prev_remain, rows = _fetch_series_window(conn, meter_no, start, start + ROLLUP_SPECS[kind]["width"])
+    return _build_rollups(kind, prev_remain, rows).get(key)
 
-def _compute_total_usage(conn, device_id, start_time, end_time):
+
+def _load_rollups_for_keys(conn, kind, pairs):
+    """一次查询读取多个 (表号, 汇总键) 的汇总行，返回 {(表号, 汇总键): 汇总行}"""
+    spec = ROLLUP_SPECS[kind]
+    key_column = spec["key_column"]
+    meters = sorted({meter_no for meter_no, _ in pairs})
+    keys = sorted({key for _, key in pairs})
+    cursor = DB_BACKEND.dict_cursor(conn)
+    try:
+        sql = f"""
+            SELECT meter_no, {key_column}, {', '.join(ROLLUP_COLUMNS)}
+            FROM {spec['table']}
+            WHERE meter_no IN ({', '.join(['%s'] * len(meters))})
+              AND {key_column} IN ({', '.join(['%s'] * len(keys))})
+        """
+        cursor.execute(sql, meters + keys)
+        found = {}
+        for row in cursor.fetchall():
+            pair = (row["meter_no"], row[key_column])
+            if pair in pairs:
+                found[pair] = _row_to_rollup(row)
+        return found
+    finally:
+        cursor.close()
+
+
+def _rebuild_rollups_for_key(conn, kind, key, meters):
+    """
+    一次查询为多个表号重算同一汇总键（整点/整天切换时所有设备同时进入新时间段），
+    读取各表号在该时间段之前的最后一条读数及时间段内的全部读数，返回 {表号: 汇总行}。
+    """
+    start = _bucket_start(key)
+    end = start + ROLLUP_SPECS[kind]["width"]
     cursor = conn.cursor()
     try:
-        sql = "SELECT collected_at, remain FROM electricity_balance WHERE meter_no=%s AND collected_at >= %s AND collected_at < %s ORDER BY collected_at"
-        cursor.execute(sql, (device_id, start_time, end_time))
-        total = 0.0
-        prev = None
-        for _, rem in cursor.fetchall():
-            try:
-                rem_f = float(rem)
-            except Exception:
-                continue
-            if prev is not None:
-                # 只计算余额下降，避免充值被算作负用电
-                drop = prev - rem_f
-                if drop > 0:
-                    total += drop
-            prev = rem_f
-        return total
+        cursor.execute(*queries.series_window_for_meters(meters, start, end, DB_BACKEND.name))
+        prev_remain, series = {}, {}
+        for meter_no, collected_at, confirmed_at, remain in sorted(cursor.fetchall(), key=lambda row: (row[0], row[1])):
+            if collected_at < start:
+                prev_remain[meter_no] = float(remain)
+            points = _expand_run(collected_at, confirmed_at, float(remain), start, end)
+            if points:
+                series.setdefault(meter_no, []).extend(points)
+    finally:
+        cursor.close()
+
+    rebuilt = {}
+    for meter_no, rows in series.items():
+        rows.sort(key=lambda point: point[0])
+        summary = _build_rollups(kind, prev_remain.get(meter_no), rows).get(key)
+        if summary:
+            rebuilt[meter_no] = summary
+    return rebuilt
+
+
+def _update_rollups(conn, readings):
+    """
+    入库后增量维护每日、每小时汇总。readings 为一批读数字典（可跨多个表号）。
+    每种汇总一次查询读出已有行、一次批量写回；读数时间在已有汇总之后时直接累加，
+    否则（时间段首条、乱序或重复读数）按原始读数重算该时间段。
+    """
+    ordered = sorted(readings, key=lambda item: item["collected_at"])
+    with _ROLLUP_LOCK:
+        cursor = conn.cursor()
+        try:
+            for kind, spec in ROLLUP_SPECS.items():
+                by_key = {}
+                for r in ordered:
+                    key = (r["meter_no"], spec["bucket"](r["collected_at"]))
+                    by_key.setdefault(key, []).append((r["collected_at"], float(r["remain"])))
+
+                existing_rows = _load_rollups_for_keys(conn, kind, by_key)
+                items, rebuild = [], {}
+                for (meter_no, key), points in by_key.items():
+                    existing = existing_rows.get((meter_no, key))
+                    if existing and points[0][0] > existing["last_at"]:
+                        items.append((meter_no, key, _accumulate_rollup(existing, existing["last_balance"], points)))
+                    else:
+                        rebuild.setdefault(key, []).append(meter_no)
+                for key, meters in rebuild.items():
+                    for meter_no, summary in _rebuild_rollups_for_key(conn, kind, key, meters).items():
+                        items.append((meter_no, key, summary))
+                _upsert_rollup_rows(cursor, kind, items)
+        finally:
+            cursor.close()
+
+
+# -----------------------
+# 充值记录表（electricity_recharge，入库时识别）
+# -----------------------
+_RECHARGE_LOCK = threading.Lock()
+
+UPSERT_RECHARGE_SQL = DB_BACKEND.upsert_sql(
+    "electricity_recharge",
+    ("meter_no", "recharged_at", "balance_before", "balance_after", "amount"),
+    ("meter_no", "recharged_at"),
+)
+
+
+def _estimate_recharge_amount(balance_increase):
+    """
+    充值验证：余额增加≥8元时，四舍五入到最近的10的整数倍；
+    估算的充值金额需≥10元且与实际增加值的差异不超过5元，否则返回 None（视为读数波动）
+    """
+    if balance_increase < 8:
+        return None
+    estimated_recharge = round(balance_increase / 10) * 10
+    if estimated_recharge >= 10 and abs(estimated_recharge - balance_increase) <= 5:
+        return int(estimated_recharge)
+    return None
+
+
+def _detect_recharges(meter_no, prev_remain, points):
+    """在有序读数 [(collected_at, remain), ...] 中识别充值，返回待写入的行"""
+    if not points:
+        return []
+    prev_cents = usage_engine.to_cents(prev_remain) if prev_remain is not None else None
+    series = usage_engine.Series.from_points(points)
+    detected = []
+    for recharged_at, before_cents, after_cents in usage_engine.recharge_events(series, prev_cents):
+        amount = _estimate_recharge_amount((after_cents - before_cents) / 100)
+        if amount is not None:
+            detected.append((meter_no, recharged_at, before_cents / 100, after_cents / 100, amount))
+    return detected
+
+
+def _update_recharges(conn, readings):
+    """
+    入库后重新识别受影响区间内的充值：每个表号从本批最早一条读数起（以之前最后一条读数为比较起点）
+    重新识别，并替换该时间之后的充值记录，乱序、重复读数也能得到与回填一致的结果。
+    表号按最早读数所在的小时分组，正常一轮抓取只需一次查询、一次删除和一次批量写入。
+    """
+    starts = {}
+    for r in readings:
+        meter_no, collected_at = r["meter_no"], r["collected_at"]
+        starts[meter_no] = min(starts.get(meter_no, collected_at), collected_at)
+    groups = {}
+    for meter_no, start in starts.items():
+        groups.setdefault(start.replace(minute=0, second=0, microsecond=0), []).append(meter_no)
+
+    with _RECHARGE_LOCK:
+        with conn.cursor() as cursor:
+            for meters in groups.values():
+                start = min(starts[meter_no] for meter_no in meters)
+                cursor.execute(*queries.series_since_for_meters(meters, start, DB_BACKEND.name))
+                prev_remain, points = {}, {}
+                for meter_no, collected_at, _, remain in sorted(cursor.fetchall(), key=lambda row: (row[0], row[1])):
+                    if remain is None:
+                        continue
+                    if collected_at < start:
+                        prev_remain[meter_no] = float(remain)
+                    else:
+                        points.setdefault(meter_no, []).append((collected_at, float(remain)))
+                detected = []
+                for meter_no, meter_points in points.items():
+                    detected.extend(_detect_recharges(meter_no, prev_remain.get(meter_no), meter_points))
+                cursor.execute(
+                    f"DELETE FROM electricity_recharge WHERE meter_no IN ({', '.join(['%s'] * len(meters))}) "
+                    "AND recharged_at >= %s",
+                    list(meters) + [start],
+                )
+                if detected:
+                    cursor.executemany(UPSERT_RECHARGE_SQL, detected)
+
+
+def _load_recharges(conn, device_id, start_time, limit=None):
+    """按时间倒序读取 start_time 之后的充值记录（主键范围查找）"""
+    cursor = DB_BACKEND.dict_cursor(conn)
+    try:
+        sql = (
+            "SELECT recharged_at, balance_before, balance_after, amount FROM electricity_recharge "
+            "WHERE meter_no=%s AND recharged_at >= %s ORDER BY recharged_at DESC"
+        )
+        params = [device_id, start_time]
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
     finally:
         cursor.close()
 
+
+def _recharge_total(conn, device_id, start_time, end_time):
+    """[start_time, end_time) 内充值带来的余额增加总和"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(SUM(balance_after - balance_before), 0) FROM electricity_recharge "
+            "WHERE meter_no=%s AND recharged_at >= %s AND recharged_at < %s",
+            (device_id, start_time, end_time),
+        )
+        return float(cursor.fetchone()[0])
+
+
+def backfill_rollups(meter_no=None, since=None, chunk_days=31):
+    """
+    根据 electricity_balance 历史数据重建每日、每小时汇总与充值记录（可重复执行）。
+    按 chunk_days 分段扫描，避免一次性载入多年读数。
+    """
+    with DB_POOL.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if meter_no:
+                meters = [meter_no]
+            else:
+                cursor.execute(*queries.distinct_meters())
+                meters = [row[0] for row in cursor.fetchall()]
+
+            for meter in meters:
+                cursor.execute(*queries.first_reading_time(meter))
+                row = cursor.fetchone()
+                if row is None:
+                    continue
+                first_at = row[0]
+                cursor.execute(*queries.last_reading(meter))
+                collected_at, confirmed_at = cursor.fetchone()
+                last_at = max(collected_at, confirmed_at or collected_at)
+                start = datetime.combine(since or first_at.date(), datetime.min.time())
+                # 启用原始读数保留期且最早一天已有汇总时，该日之前的读数可能已被清理（缺少前一条读数），
+                # 不重建该日及更早的汇总，保留清理前入库时算出的结果
+                if RETENTION_RAW_DAYS > 0 and _load_daily_rollups(conn, meter, first_at.date(), first_at.date()):
+                    start = max(start, datetime.combine(first_at.date() + timedelta(days=1), datetime.min.time()))
+                end = datetime.combine(last_at.date(), datetime.min.time()) + timedelta(days=1)
+                written = {kind: 0 for kind in ROLLUP_SPECS}
+                recharges = 0
+                with _RECHARGE_LOCK:
+                    cursor.execute(
+                        "DELETE FROM electricity_recharge WHERE meter_no=%s AND recharged_at >= %s", (meter, start)
+                    )
+                    while start < end:
+                        chunk_end = min(start + timedelta(days=chunk_days), end)
+                        prev_remain, rows = _fetch_series_window(conn, meter, start, chunk_end)
+                        for kind in ROLLUP_SPECS:
+                            rollups = _build_rollups(kind, prev_remain, rows)
+                            _upsert_rollups(cursor, kind, meter, rollups)
+                            written[kind] += len(rollups)
+                        detected = _detect_recharges(meter, prev_remain, rows)
+                        if detected:
+                            cursor.executemany(UPSERT_RECHARGE_SQL, detected)
+                            recharges += len(detected)
+                        start = chunk_end
+                print(
+                    f"设备 {meter}：已回填 {written['daily']} 天、{written['hourly']} 小时的用电汇总，"
+                    f"{recharges} 条充值记录"
+                )
+        finally:
+            cursor.close()
+
+# -----------------------
+# 数据保留（原始读数 -> 小时汇总 -> 每日汇总）
+# -----------------------
+# 原始读数保留天数（0 表示永久保留）；更早的数据由汇总表提供
+RETENTION_RAW_DAYS = _cast_int_env(os.getenv("RETENTION_RAW_DAYS", "0"))
+# 每小时汇总保留天数（0 表示永久保留）；每日汇总与充值记录始终永久保留
+RETENTION_HOURLY_DAYS = _cast_int_env(os.getenv("RETENTION_HOURLY_DAYS", "0"))
+# 分区表过期分区先归档为独立表 electricity_balance_YYYYMM 再删除
+RETENTION_ARCHIVE = os.getenv("RETENTION_ARCHIVE", "false").split("#", 1)[0].strip().lower() == "true"
+# 未分区表分批删除时每批的行数
+RETENTION_DELETE_CHUNK = _cast_int_env(os.getenv("RETENTION_DELETE_CHUNK", "5000"))
+# 分区表提前创建的月份数
+RETENTION_PARTITION_MONTHS_AHEAD = 3
+
+
+def _retention_cutoff(days, now=None):
+    """保留期的起点（当天 00:00）；days 为 0 时返回 None（永久保留）"""
+    if days <= 0:
+        return None
+    now = now or now_cn()
+    return datetime.combine(now.date() - timedelta(days=days), datetime.min.time())
+
+
+def _tier_available_from(source, now=None):
+    """某一层数据（raw / hourly / daily）最早可用的时间，None 表示没有下限"""
+    days = {"raw": RETENTION_RAW_DAYS, "hourly": RETENTION_HOURLY_DAYS}.get(source, 0)
+    return _retention_cutoff(days, now)
+
+
+def run_retention(dry_run=False):
+    """
+    每日执行的数据保留任务：维护未来月份的分区，清理过期的原始读数与小时汇总。
+    表号列表取自永久保留的每日汇总表，原始读数清空后的表号也能继续清理小时汇总。
+    """
+    now = now_cn()
+    actions = []
+    with DB_POOL.connection() as conn:
+        actions += retention.ensure_future_partitions(
+            conn, DB_BACKEND, now.date(), RETENTION_PARTITION_MONTHS_AHEAD, dry_run=dry_run
+        )
+        raw_cutoff = _retention_cutoff(RETENTION_RAW_DAYS, now)
+        hourly_cutoff = _retention_cutoff(RETENTION_HOURLY_DAYS, now)
+        if raw_cutoff or hourly_cutoff:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT DISTINCT meter_no FROM electricity_daily_usage")
+                meters = [row[0] for row in cursor.fetchall()]
+        if raw_cutoff:
+            actions += retention.expire_raw_readings(
+                conn, DB_BACKEND, meters, raw_cutoff, RETENTION_DELETE_CHUNK, archive=RETENTION_ARCHIVE, dry_run=dry_run
+            )
+        if hourly_cutoff:
+            actions += retention.delete_expired_rows(
+                conn, DB_BACKEND, "electricity_hourly_usage", "hour_start", meters, hourly_cutoff, RETENTION_DELETE_CHUNK,
+                dry_run=dry_run,
+            )
+        actions += change_feed.prune(conn, dry_run=dry_run)
+    for action in actions:
+        print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] 数据保留：{action}")
+    return actions
+
+
+@metrics.scoped("job:retention")
+def scheduled_retention():
+    try:
+        run_retention()
+    except Exception as exc:
+        app.logger.warning("数据保留任务失败: %s", exc)
+
+# -----------------------
+# 任意区间序列（/series，服务端聚合与降采样）
+# -----------------------
+# 单次响应的最大点数（请求的 max_points 不能超过该值）
+SERIES_MAX_POINTS = _cast_int_env(os.getenv("SERIES_MAX_POINTS", "1000"))
+
+# 桶参数 -> (usage_engine 桶宽, 数据来源, 估算桶数用的宽度, 标签格式)
+# 5 分钟桶由原始读数实时聚合，小时/日/月桶直接读取汇总表，不再扫描原始读数
+SERIES_BUCKETS = {
+    "5m": ("5min", "raw", timedelta(minutes=5), "%Y-%m-%d %H:%M"),
+    "1h": ("hour", "hourly", timedelta(hours=1), "%Y-%m-%d %H:%M"),
+    "1d": ("day", "daily", timedelta(days=1), "%Y-%m-%d"),
+    "1mo": ("month", "daily", timedelta(days=30.44), "%Y-%m"),
+}
+
+
+def _parse_series_time(raw, *, is_end=False):
+    """
+    解析 YYYY-MM-DD 或 YYYY-MM-DD HH:MM[:SS]；结束时间只给日期时包含当天。
+    带时区偏移（如 +08:00、Z）的时间换算为中国标准时间后去掉 tzinfo，与库中的 DATETIME 一致。
+    """
+    text = raw.strip()
+    # Python 3.11 之前 fromisoformat 不接受结尾的 Z
+    if text.endswith(("Z", "z")):
+        text = text[:-1] + "+00:00"
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is not None:
+        value = value.astimezone(CHINA_TZ).replace(tzinfo=None)
+    if is_end and len(text) == 10:
+        value += timedelta(days=1)
+    return value
+
+
+def _choose_series_bucket(bucket, start_time, end_time, max_points, now=None):
+    """
+    auto 选择桶数不超过 max_points 的最细桶宽，跨度过长时退回按月（再由 LTTB 降采样）。
+    区间起点早于某层数据的保留期时（原始读数或小时汇总已清理）改用更粗的一层。
+    """
+    names = list(SERIES_BUCKETS)
+    for name in names[0 if bucket == "auto" else names.index(bucket):]:
+        _, source, width, _ = SERIES_BUCKETS[name]
+        available_from = _tier_available_from(source, now)
+        if available_from is not None and start_time < available_from:
+            continue
+        if bucket == "auto" and (end_time - start_time) / width > max_points:
+            continue
+        return name
+    return "1mo"
+
+
+def _merge_rollups(rows):
+    """按时间顺序合并多个汇总行（日汇总合并为月汇总等）"""
+    return {
+        "first_balance": rows[0]["first_balance"],
+        "last_balance": rows[-1]["last_balance"],
+        "min_balance": min(r["min_balance"] for r in rows),
+        "max_balance": max(r["max_balance"] for r in rows),
+        "usage_total": sum(r["usage_total"] for r in rows),
+        "recharge_total": sum(r["recharge_total"] for r in rows),
+        "reading_count": sum(r["reading_count"] for r in rows),
+        "first_at": rows[0]["first_at"],
+        "last_at": rows[-1]["last_at"],
+    }
+
+
+def _series_buckets(conn, device_id, bucket, start_time, end_time):
+    """[start_time, end_time) 内有读数的桶，返回 [(桶起点, 汇总行), ...]"""
+    width, source, _, _ = SERIES_BUCKETS[bucket]
+    if source == "raw":
+        prev_remain, rows = _fetch_series_window(
+            conn, device_id, start_time, end_time, usage_engine.BUCKET_WIDTHS[width]
+        )
+        prev_cents = usage_engine.to_cents(prev_remain) if prev_remain is not None else None
+        series = usage_engine.Series.from_points(rows)
+        return [
+            (edge, _summary_to_rollup(summary))
+            for edge, summary in usage_engine.summarize_by(series, width, prev_cents)
+        ]
+
+    if source == "hourly":
+        rollups = _load_rollups(conn, "hourly", device_id, start_time, end_time)
+    else:
+        last_day = (end_time - timedelta(microseconds=1)).date()
+        rollups = _load_rollups(conn, "daily", device_id, start_time.date(), last_day + timedelta(days=1))
+    items = sorted((_bucket_start(key), summary) for key, summary in rollups.items())
+    if width != "month":
+        return items
+    months = {}
+    for day_start, summary in items:
+        months.setdefault(usage_engine.floor_time(day_start, "month"), []).append(summary)
+    return [(month, _merge_rollups(rows)) for month, rows in sorted(months.items())]
+
+
+def get_series_raw(device_id, start_time, end_time, bucket, max_points):
+    """
+    任意区间的余额/用电序列：按桶聚合（返回的 bucket 为实际使用的桶宽，可能因数据保留期而变粗），
+    桶数仍超过 max_points 时用 LTTB 选出保留曲线形状的点，
+    每个输出点的用电、充值为其所在分组之和，最低/最高余额取分组内极值。
+    """
+    bucket = _choose_series_bucket(bucket, start_time, end_time, max_points)
+    width, _, _, label_format = SERIES_BUCKETS[bucket]
+    start_time = usage_engine.floor_time(start_time, usage_engine.BUCKET_WIDTHS[width])
+    items = _series_buckets(get_db(), device_id, bucket, start_time, end_time) if device_id else []
+
+    groups = downsample.lttb(
+        [edge.timestamp() for edge, _ in items], [summary["last_balance"] for _, summary in items], max_points
+    )
+    result = {"labels": [], "balances": [], "min": [], "max": [], "usage": [], "recharge": []}
+    for selected, lo, hi in groups:
+        edge, summary = items[selected]
+        group = [s for _, s in items[lo:hi]]
+        result["labels"].append(edge.strftime(label_format))
+        result["balances"].append(summary["last_balance"])
+        result["min"].append(min(s["min_balance"] for s in group))
+        result["max"].append(max(s["max_balance"] for s in group))
+        result["usage"].append(round(sum(s["usage_total"] for s in group), 2))
+        result["recharge"].append(round(sum(s["recharge_total"] for s in group), 2))
+
+    return {
+        "device_id": device_id,
+        "start": start_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "end": end_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "bucket": bucket,
+        "downsampled": len(groups) < len(items),
+        **result,
+    }
+
+# -----------------------
+# 条件请求（ETag / Last-Modified）
+# -----------------------
+# 响应格式随代码变化：校验值混入各模块的修改时间，部署新版本后旧的 ETag 自然失效（同一部署的多个进程一致）
+_ETAG_SALT = repr(sorted(
+    (os.path.basename(path), os.path.getmtime(path))
+    for path in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))
+))
+# 已结束日期的响应允许共享缓存一天，之后按 ETag 重新验证（补录历史读数后校验值随之变化）
+CLOSED_DAY_CACHE_CONTROL = "public, max-age=86400"
+
+
+def _data_version(device_id):
+    """
+    表号最新读数时间（change_only 模式下取最后确认时间），作为接口响应的数据版本；没有读数时为 None。
+    结果放在 RESULT_CACHE 中，随该表号的新读数入库失效，条件请求命中时不访问数据库。
+    """
+    if not device_id:
+        return None
+
+    def load():
+        with get_db().cursor() as cursor:
+            cursor.execute(*queries.last_reading(device_id))
+            row = cursor.fetchone()
+        return max(row[0], row[1] or row[0]) if row else None
+
+    return RESULT_CACHE.get_or_compute(device_id, ("data_version",), load)
+
+
+def _closed_day_version(device_id, day):
+    """
+    已结束日期的内容校验：该日的每日汇总行（补录该日读数时随之更新）。
+    与历史日期的结果一同缓存，补录历史读数时失效。
+    """
+
+    def load():
+        rollups = _load_rollups(get_db(), "daily", device_id, day, day + timedelta(days=1))
+        return repr(sorted(next(iter(rollups.values()), {}).items()))
+
+    return RESULT_CACHE.get_or_compute(device_id, ("day_version", str(day)), load, immutable=True)
+
+
+def _http_date(local_time):
+    """北京时间（naive）转换为 HTTP 日期使用的 UTC 时间"""
+    return (local_time - timedelta(hours=8)).replace(tzinfo=timezone.utc)
+
+
+def _conditional_json(device_id, compute, closed_day=None):
+    """
+    带校验值的 JSON 响应：ETag 由请求参数、当天日期与数据版本决定，Last-Modified 为数据版本
+    （可变响应不早于今天 0 点，日期切换后按日期计算的结果随之更新）。
+    请求携带的 If-None-Match / If-Modified-Since 仍然有效时直接返回 304，不调用 compute()。
+    closed_day 为已结束的日期且该表号已有之后的读数时，响应只在补录历史读数时变化：
+    校验值改由该日的汇总决定（不随之后的读数与日期变化），并允许缓存一天（CLOSED_DAY_CACHE_CONTROL）。
+    """
+    version = _data_version(device_id)
+    now = now_cn()
+    midnight = datetime.combine(now.date(), datetime.min.time())
+    day_end = datetime.combine(closed_day + timedelta(days=1), datetime.min.time()) if closed_day else None
+    closed = day_end is not None and version is not None and version >= day_end
+    args = sorted(request.args.items(multi=True))
+    if closed:
+        # 不随日期与之后的读数变化
+        identity = (_ETAG_SALT, request.path, args, device_id, _closed_day_version(device_id, closed_day))
+        last_modified = day_end
+    else:
+        identity = (_ETAG_SALT, request.path, args, device_id, str(now.date()), version)
+        last_modified = max(version or midnight, midnight)
+    etag = hashlib.sha1(repr(identity).encode()).hexdigest()[:24]
+    last_modified = _http_date(last_modified)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(compute())
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Cache-Control"] = CLOSED_DAY_CACHE_CONTROL if closed else "no-cache"
+    return response
+
+
 # -----------------------
 # Flask 路由
 # -----------------------
 @app.route("/")
 def index(): 
-    return render_template("index.html", devices=DEVICE_LIST)
+    return render_template("index.html", devices=DEVICE_LIST, stream_enabled=STREAM_HUB.running)
 
 @app.route("/data")
 def data():
     period = request.args.get("period","day")
     device_id = request.args.get("device_id")
     target_date = request.args.get("date")
-    labels, balances, usage = get_statistics(period, device_id, target_date)
-    return {"labels":labels, "balances":balances, "usage":usage}
+    today = now_cn().date()
+    day = _resolve_date(target_date, now_cn()) if period == "day" else None
 
-def _get_last_balance_for_date(conn, device_id, date_obj):
-    cursor = conn.cursor()
-    try:
-        sql = "SELECT remain FROM electricity_balance WHERE meter_no=%s AND DATE(collected_at)=%s ORDER BY collected_at DESC LIMIT 1"
-        cursor.execute(sql, (device_id, date_obj.date()))
-        row = cursor.fetchone()
-        return float(row[0]) if row else None
-    finally:
-        cursor.close()
+    def compute():
+        labels, balances, usage = get_statistics(period, device_id, target_date)
+        return {"labels":labels, "balances":balances, "usage":usage}
+
+    return _conditional_json(device_id, compute, closed_day=day if day and day < today else None)
 
 def _get_latest_balance(conn, device_id):
     cursor = conn.cursor()
     try:
-        sql = "SELECT remain FROM electricity_balance WHERE meter_no=%s ORDER BY collected_at DESC LIMIT 1"
-        cursor.execute(sql, (device_id,))
+        cursor.execute(*queries.latest_balance(device_id))
         row = cursor.fetchone()
         return float(row[0]) if row else None
     finally:
         cursor.close()
 
-def _calculate_hourly_usage_with_recharge(rows, prev_remain):
-    """计算每小时用电量，正确处理充值情况"""
-    hourly_usage = {}
-    
-    # 按小时分组数据
-    hourly_data = {}
-    for r in rows:
-        if r['remain'] is None:
-            continue
-        h = r['collected_at'].hour
-        if h not in hourly_data:
-            hourly_data[h] = []
-        hourly_data[h].append({
-            'time': r['collected_at'],
-            'remain': float(r['remain'])
-        })
-    
-    # 对每小时的数据按时间排序
-    for h in hourly_data:
-        hourly_data[h].sort(key=lambda x: x['time'])
-    
-    # 计算每小时用电量
-    for h in range(24):
-        if h == 0:
-            # 00点：从前一天最后余额开始计算
-            if prev_remain is not None and h in hourly_data:
-                usage = _calculate_period_usage_with_recharge(hourly_data[h], prev_remain)
-                hourly_usage[h] = usage
-            else:
-                hourly_usage[h] = 0.0
-        else:
-            # 其他小时：从上一小时的最后余额开始计算
-            prev_hour = h - 1
-            if prev_hour in hourly_data and h in hourly_data:
-                # 上一小时的最后余额作为起始点
-                prev_hour_last = hourly_data[prev_hour][-1]['remain']
-                usage = _calculate_period_usage_with_recharge(hourly_data[h], prev_hour_last)
-                hourly_usage[h] = usage
-            else:
-                hourly_usage[h] = 0.0
-    
-    return hourly_usage
-
-def _calculate_period_usage_with_recharge(period_data, start_balance):
-    """计算某个时间段内的用电量，处理充值情况"""
-    if not period_data or start_balance is None:
-        return 0.0
-    
-    total_usage = 0.0
-    last_balance = start_balance
-    
-    for data_point in period_data:
-        current_balance = data_point['remain']
-        
-        # 如果余额增加，说明充值了
-        if current_balance > last_balance:
-            # 充值：更新基准为充值后的余额，但不计算"用电"
-            last_balance = current_balance
-        else:
-            # 正常用电：累加消耗
-            usage = last_balance - current_balance
-            if usage > 0:
-                total_usage += usage
-            last_balance = current_balance
-    
-    return total_usage
-
-def _calculate_daily_usage_with_recharge(conn, device_id, target_date):
-    """计算指定日期的真实用电量，处理充值情况"""
-    cursor = conn.cursor()
-    try:
-        start_time = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_time = start_time + timedelta(days=1)
-        
-        # 获取当天所有读数
-        sql = """
-            SELECT collected_at, remain
-            FROM electricity_balance
-            WHERE meter_no=%s AND collected_at >= %s AND collected_at < %s
-            ORDER BY collected_at
-        """
-        cursor.execute(sql, (device_id, start_time, end_time))
-        today_records = cursor.fetchall()
-        
-        if not today_records:
-            return 0.0
-            
-        # 获取昨天最后一条读数作为起始点
-        prev_sql = """
-            SELECT remain FROM electricity_balance
-            WHERE meter_no=%s AND collected_at < %s
-            ORDER BY collected_at DESC LIMIT 1
-        """
-        cursor.execute(prev_sql, (device_id, start_time))
-        
-        prev_row = cursor.fetchone()
-        prev_balance = float(prev_row[0]) if prev_row else None
-        
-        total_usage = 0.0
-        last_balance = prev_balance
-        
-        for _, remain in today_records:
-            current_balance = float(remain) if remain is not None else None
-            if current_balance is None:
-                continue
-                
-            if last_balance is None:
-                last_balance = current_balance
-                continue
-                
-            # 如果余额增加，说明充值了
-            if current_balance > last_balance:
-                # 充值：更新基准为充值后的余额，但不计算"用电"
-                last_balance = current_balance
-            else:
-                # 正常用电：累加消耗
-                usage = last_balance - current_balance
-                if usage > 0:
-                    total_usage += usage
-                last_balance = current_balance
-            
-        return total_usage
-    finally:
-        cursor.close()
-
 # -----------------------
 # Server酱微信通知功能
 # -----------------------
@@ -597,20 +1971,17 @@ def send_server_chan_notification(send_key, title, desp=""):
 def get_yesterday_report(device_id, device_name):
     """获取昨日用电报告"""
     try:
-        conn = pymysql.connect(**DB_CONFIG)
         yesterday = (now_cn() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
         
-        # 获取昨日用电量
-        yesterday_usage = _calculate_daily_usage_with_recharge(conn, device_id, yesterday)
-        
-        # 获取昨日结束时的余额
-        yesterday_last_balance = _get_last_balance_for_date(conn, device_id, yesterday)
-        
-        # 获取前天结束时的余额
+        # 昨日与前天的汇总行：昨日用电量、昨日/前天结束时的余额
         day_before_yesterday = yesterday - timedelta(days=1)
-        day_before_last_balance = _get_last_balance_for_date(conn, device_id, day_before_yesterday)
-        
-        conn.close()
+        with DB_POOL.connection() as conn:
+            rollups = _load_daily_rollups(conn, device_id, day_before_yesterday.date(), yesterday.date())
+        yesterday_row = rollups.get(str(yesterday.date()))
+        day_before_row = rollups.get(str(day_before_yesterday.date()))
+        yesterday_usage = yesterday_row["usage_total"] if yesterday_row else 0.0
+        yesterday_last_balance = yesterday_row["last_balance"] if yesterday_row else None
+        day_before_last_balance = day_before_row["last_balance"] if day_before_row else None
         
         return {
             "device_name": device_name,
@@ -630,6 +2001,7 @@ def get_yesterday_report(device_id, device_name):
             "error": str(e)
         }
 
+@metrics.scoped("job:daily_report")
 def send_daily_reports():
     """发送每日用电报告"""
     print(f"[{now_cn().strftime('%Y-%m-%d %H:%M:%S')}] 开始发送每日用电报告...")
@@ -704,6 +2076,123 @@ def send_daily_reports():
         else:
             print(f"❌ {device_name} 用电报告发送失败: {result['message']}")
 
+def _kpi_window(target_date, now):
+    """KPI 的目标日期（00:00）及其需要的每日汇总范围 [前两天, 目标日期]"""
+    base_date = datetime.combine(_resolve_date(target_date, now), datetime.min.time())
+    return base_date, (base_date - timedelta(days=2)).date(), base_date.date()
+
+
+def _kpi_recharge_today(conn, device_id, target_date, now):
+    """今日充值（只在查询今日时计算）：充值记录表中今日各次充值的余额增加之和"""
+    if not device_id or (target_date is not None and target_date != now.strftime("%Y-%m-%d")):
+        return None
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return _recharge_total(conn, device_id, today, today + timedelta(days=1))
+
+
+def _kpi_from_rollups(device_id, target_date, now, current_balance, rollups, recharge_today=None):
+    """由最新余额与每日汇总计算 KPI（余额、目标日期与前一天用电），今日充值由调用方查出后传入"""
+    base_date, _, _ = _kpi_window(target_date, now)
+
+    # 计算目标日期和前一天
+    yesterday = base_date - timedelta(days=1)
+    day_before = base_date - timedelta(days=2)
+
+    # 各日期的最后余额与真实用电量（已处理充值）
+    base_row = rollups.get(str(base_date.date()))
+    y_row = rollups.get(str(yesterday.date()))
+    db_row = rollups.get(str(day_before.date()))
+
+    base_last = base_row["last_balance"] if base_row else None
+    y_last = y_row["last_balance"] if y_row else None
+    db_last = db_row["last_balance"] if db_row else None
+
+    usage_target = (base_row["usage_total"] if base_row else 0.0) if device_id else None
+    usage_yesterday = (y_row["usage_total"] if y_row else 0.0) if device_id else None
+
+    return {
+        "current_balance": current_balance,
+        "target_date_last_balance": base_last,  # 目标日期最后余额
+        "yesterday_last_balance": y_last,
+        "day_before_yesterday_last_balance": db_last,
+        "usage_target": usage_target,  # 目标日期用电量
+        "usage_yesterday": usage_yesterday,
+        "recharge_today": recharge_today,
+        # 保持向后兼容
+        "usage_today": usage_target,
+    }
+
+def get_kpi_raw(device_id, target_date=None):
+    """KPI 计算：最新余额 + 一次读取三天的每日汇总 + 今日充值记录"""
+    conn = get_db()
+    now = now_cn()
+    current_balance = _get_latest_balance(conn, device_id) if device_id else None
+    _, start_date, end_date = _kpi_window(target_date, now)
+    rollups = _load_daily_rollups(conn, device_id, start_date, end_date) if device_id else {}
+    recharge_today = _kpi_recharge_today(conn, device_id, target_date, now)
+    return _kpi_from_rollups(device_id, target_date, now, current_balance, rollups, recharge_today)
+
+def _period_window(period, now):
+    """本周期起点与上一周期起点（均为 00:00）"""
+    days = {"day": 1, "week": 7}.get(period, 30)
+    start_cur = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return start_cur, start_cur - timedelta(days=days)
+
+def _period_kpi_from_rollups(period, now, rollups):
+    """按日汇总求和：本周期 [start_cur, 今天]，上一周期 [start_prev, start_cur)"""
+    start_cur, start_prev = _period_window(period, now)
+    cur_total = sum((r["usage_total"] for d, r in rollups.items() if str(start_cur.date()) <= d <= str(now.date())), 0.0)
+    prev_total = sum((r["usage_total"] for d, r in rollups.items() if str(start_prev.date()) <= d < str(start_cur.date())), 0.0)
+    return {"period": period, "current_usage": cur_total, "previous_usage": prev_total}
+
+def get_period_kpi_raw(device_id, period="day"):
+    """本周期与上一周期的用电量对比，一次读取上周期起点到今天的汇总行"""
+    conn = get_db()
+    now = now_cn()
+    _, start_prev = _period_window(period, now)
+    rollups = _load_daily_rollups(conn, device_id, start_prev.date(), now.date()) if device_id else {}
+    return _period_kpi_from_rollups(period, now, rollups)
+
+def get_dashboard_raw(device_id, period="day", target_date=None):
+    """
+    页面一次加载所需的全部数据：当前周期图表、近 7 天用电（预计可用天数）、KPI 与周期对比。
+    每日汇总只读取一次（覆盖上一周期起点到今天以及 KPI 目标日期的前两天），
+    日视图另读一次小时汇总，最新余额一次查询。
+    """
+    conn = get_db()
+    now = now_cn()
+    today = now.date()
+    kpi_date = target_date if period == "day" and target_date and _resolve_date(target_date, now) != today else None
+
+    week_start = today - timedelta(days=6)
+    _, kpi_start, kpi_end = _kpi_window(kpi_date, now)
+    start_dates = [week_start, kpi_start]
+    if period != "day":
+        start_dates.append(_period_window(period, now)[1].date())
+    start_date, end_date = min(start_dates), max(today, kpi_end)
+
+    rollups = _load_daily_rollups(conn, device_id, start_date, end_date) if device_id else {}
+    current_balance = _get_latest_balance(conn, device_id) if device_id else None
+
+    if period == "day":
+        day_start = datetime.combine(_resolve_date(target_date, now), datetime.min.time())
+        chart = _hourly_series(conn, device_id, day_start, now)
+    else:
+        chart = _daily_series(rollups, today - timedelta(days=(6 if period == "week" else 29)), today)
+    week = _daily_series(rollups, week_start, today)
+
+    return {
+        "device_id": device_id,
+        "period": period,
+        "date": str(_resolve_date(target_date, now)) if period == "day" else str(today),
+        "chart": dict(zip(("labels", "balances", "usage"), chart)),
+        "week": dict(zip(("labels", "balances", "usage"), week)),
+        "kpi": _kpi_from_rollups(
+            device_id, kpi_date, now, current_balance, rollups, _kpi_recharge_today(conn, device_id, kpi_date, now)
+        ),
+        "period_kpi": _period_kpi_from_rollups(period, now, rollups) if period != "day" else None,
+    }
+
 @app.route("/kpi")
 def kpi():
     device_id = request.args.get("device_id")
@@ -711,55 +2200,12 @@ def kpi():
     
     if not device_id:
         device_id = DEVICE_LIST[0]["id"] if DEVICE_LIST else None
-    
-    conn = pymysql.connect(**DB_CONFIG)
-    try:
-        now = now_cn()
-        
-        # 如果指定了日期，使用指定日期；否则使用今天
-        if target_date:
-            try:
-                base_date = datetime.strptime(target_date, "%Y-%m-%d")
-            except ValueError:
-                base_date = now
-        else:
-            base_date = now
-            
-        current_balance = _get_latest_balance(conn, device_id) if device_id else None
-        
-        # 计算目标日期和前一天
-        yesterday = base_date - timedelta(days=1)
-        day_before = base_date - timedelta(days=2)
-        
-        # 获取各日期的最后余额
-        base_last = _get_last_balance_for_date(conn, device_id, base_date) if device_id else None
-        y_last = _get_last_balance_for_date(conn, device_id, yesterday) if device_id else None
-        db_last = _get_last_balance_for_date(conn, device_id, day_before) if device_id else None
-        
-        # 使用新的算法计算真实用电量（处理充值）
-        usage_target = _calculate_daily_usage_with_recharge(conn, device_id, base_date) if device_id else None
-        usage_yesterday = _calculate_daily_usage_with_recharge(conn, device_id, yesterday) if device_id else None
-        
-        # 充值检测：只在查询今日时计算
-        recharge_today = None
-        if target_date is None or target_date == now.strftime("%Y-%m-%d"):
-            # 查询今日：计算充值
-            if current_balance is not None and y_last is not None:
-                recharge_today = max(current_balance - y_last + (usage_target or 0), 0.0)
 
-        return {
-            "current_balance": current_balance,
-            "target_date_last_balance": base_last,  # 目标日期最后余额
-            "yesterday_last_balance": y_last,
-            "day_before_yesterday_last_balance": db_last,
-            "usage_target": usage_target,  # 目标日期用电量
-            "usage_yesterday": usage_yesterday,
-            "recharge_today": recharge_today,
-            # 保持向后兼容
-            "usage_today": usage_target,
-        }
-    finally:
-        conn.close()
+    # 响应包含当前余额，任何日期的 KPI 都随新读数失效
+    key = ("kpi", target_date, str(now_cn().date()))
+    return _conditional_json(
+        device_id, lambda: RESULT_CACHE.get_or_compute(device_id, key, lambda: get_kpi_raw(device_id, target_date))
+    )
 
 @app.route("/period_kpi")
 def period_kpi():
@@ -767,30 +2213,57 @@ def period_kpi():
     period = request.args.get("period", "day")
     if not device_id:
         device_id = DEVICE_LIST[0]["id"] if DEVICE_LIST else None
-    conn = pymysql.connect(**DB_CONFIG)
+    key = ("period_kpi", period, str(now_cn().date()))
+    return _conditional_json(
+        device_id, lambda: RESULT_CACHE.get_or_compute(device_id, key, lambda: get_period_kpi_raw(device_id, period))
+    )
+
+@app.route("/dashboard")
+def dashboard():
+    """页面首屏/切换周期时的一次性数据接口，取代并行请求 /data、/kpi、/period_kpi"""
+    device_id = request.args.get("device_id")
+    period = request.args.get("period", "day")
+    target_date = request.args.get("date")
+    if period not in ("day", "week", "month"):
+        period = "day"
+    if not device_id:
+        device_id = DEVICE_LIST[0]["id"] if DEVICE_LIST else None
+
+    key = ("dashboard", period, target_date if period == "day" else None, str(now_cn().date()))
+    return _conditional_json(
+        device_id, lambda: RESULT_CACHE.get_or_compute(device_id, key, lambda: get_dashboard_raw(device_id, period, target_date))
+    )
+
+@app.route("/series")
+def series():
+    """
+    任意区间序列：start/end 为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM[:SS]（默认最近 30 天），
+    bucket 为 5m/1h/1d/1mo/auto（默认 auto），max_points 为返回点数上限（默认 500）。
+    """
+    device_id = request.args.get("device_id")
+    if not device_id:
+        device_id = DEVICE_LIST[0]["id"] if DEVICE_LIST else None
+    bucket = request.args.get("bucket", "auto")
+    if bucket != "auto" and bucket not in SERIES_BUCKETS:
+        return {"message": f"bucket 仅支持 auto、{'、'.join(SERIES_BUCKETS)}"}, 400
+    now = now_cn()
     try:
-        now = now_cn()
-        if period == "day":
-            start_cur = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_cur = now
-            start_prev = start_cur - timedelta(days=1)
-            end_prev = start_cur
-        elif period == "week":
-            start_cur = (now - timedelta(days=6)).replace(hour=0, minute=0, second=0, microsecond=0)
-            end_cur = now
-            start_prev = start_cur - timedelta(days=7)
-            end_prev = start_cur
-        else:
-            start_cur = (now - timedelta(days=29)).replace(hour=0, minute=0, second=0, microsecond=0)
-            end_cur = now
-            start_prev = start_cur - timedelta(days=30)
-            end_prev = start_cur
-
-        cur_total = _compute_total_usage(conn, device_id, start_cur, end_cur)
-        prev_total = _compute_total_usage(conn, device_id, start_prev, end_prev)
-        return {"period": period, "current_usage": cur_total, "previous_usage": prev_total}
-    finally:
-        conn.close()
+        end_time = _parse_series_time(request.args["end"], is_end=True) if request.args.get("end") else now
+        start_time = _parse_series_time(request.args["start"]) if request.args.get("start") else end_time - timedelta(days=30)
+        max_points = int(request.args.get("max_points", min(500, SERIES_MAX_POINTS)))
+    except ValueError:
+        return {"message": "start/end 需为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS，max_points 需为整数"}, 400
+    if start_time >= end_time:
+        return {"message": "start 必须早于 end"}, 400
+    max_points = min(max(max_points, 3), SERIES_MAX_POINTS)
+
+    # 结束于今天 00:00 之前的区间不会再变化（补录的历史读数会同时清除）；
+    # 未指定 end 时区间随当前时间滑动，按原始参数与日期缓存，由新读数入库触发失效
+    key = ("series", request.args.get("start"), request.args.get("end"), bucket, max_points, str(now.date()))
+    immutable = end_time <= datetime.combine(now.date(), datetime.min.time())
+    return RESULT_CACHE.get_or_compute(
+        device_id, key, lambda: get_series_raw(device_id, start_time, end_time, bucket, max_points), immutable=immutable
+    )
 
 @app.route("/recharge_history")
 def recharge_history():
@@ -805,76 +2278,63 @@ def recharge_history():
     if not device_id:
         return {"recharges": [], "message": "没有可用的设备"}
     
-    conn = get_db()
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
-    try:
-        now = now_cn()
-        start_time = (now - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # 查询指定时间范围内的所有余额记录
-        sql = """
-            SELECT collected_at, remain
-            FROM electricity_balance
-            WHERE meter_no=%s AND collected_at >= %s
-            ORDER BY collected_at ASC
-        """
-        cursor.execute(sql, (device_id, start_time))
-        records = cursor.fetchall()
-        
-        if not records:
-            return {"recharges": [], "message": "暂无充值记录"}
-        
-        recharges = []
-        prev_record = None
-        
-        for record in records:
-            current_time = record['collected_at']
-            current_remain = float(record['remain']) if record['remain'] is not None else None
-            
-            if current_remain is None:
-                continue
-                
-            if prev_record is not None:
-                prev_remain = float(prev_record['remain']) if prev_record['remain'] is not None else None
-                
-                if prev_remain is not None and current_remain > prev_remain:
-                    # 检测到可能的充值
-                    balance_increase = current_remain - prev_remain
-                    
-                    # 充值验证：余额增加≥8元时，四舍五入到最近的10的整数倍
-                    if balance_increase >= 8:
-                        # 四舍五入到最近的10的整数倍
-                        estimated_recharge = round(balance_increase / 10) * 10
-                        
-                        # 确保估算的充值金额与实际增加值的差异不超过5元，且≥10元
-                        if estimated_recharge >= 10 and abs(estimated_recharge - balance_increase) <= 5:
-                            recharges.append({
-                                "recharge_time": current_time.strftime("%Y-%m-%d %H:%M:%S"),
-                                "recharge_date": current_time.strftime("%Y-%m-%d"),
-                                "recharge_amount": int(estimated_recharge),  # 估算的充值金额
-                                "balance_before": round(prev_remain, 2),
-                                "balance_after": round(current_remain, 2),
-                                "device_id": device_id
-                            })
-            
-            prev_record = record
-        
-        # 按时间倒序排列，最新的充值在前
-        recharges.reverse()
-        
-        # 限制返回数量
-        if limit > 0:
-            recharges = recharges[:limit]
-        
+    # 充值在入库时已识别并写入 electricity_recharge，这里只是一次主键范围查找
+    def compute():
+        start_time = (now_cn() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = _load_recharges(get_db(), device_id, start_time, limit if limit > 0 else None)
+        recharges = [
+            {
+                "recharge_time": row["recharged_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                "recharge_date": row["recharged_at"].strftime("%Y-%m-%d"),
+                "recharge_amount": row["amount"],  # 估算的充值金额
+                "balance_before": float(row["balance_before"]),
+                "balance_after": float(row["balance_after"]),
+                "device_id": device_id,
+            }
+            for row in rows
+        ]
         return {
             "recharges": recharges,
             "total_count": len(recharges),
             "query_days": days,
             "device_id": device_id
         }
-        
-    finally:
-        cursor.close()
+
+    return _conditional_json(device_id, compute)
+
+@app.route("/stats")
+def stats():
+    """运行状态统计（连接池、批量写入、结果缓存、最近一轮抓取等）"""
+    return {
+        "db_pool": DB_POOL.stats(),
+        "writer": READING_WRITER.stats(),
+        "cache": RESULT_CACHE.stats(),
+        "last_scrape": LAST_SCRAPE_SUMMARY,
+        "scrape_schedule": SCRAPE_SCHEDULE.stats() if SCRAPE_ADAPTIVE else None,
+        "process": PROCESS_ID,
+        "devices": DEVICE_REGISTRY.stats(),
+        "jobs": JOB_ELECTION.stats() if JOB_ELECTION else None,
+        "shard": SCRAPE_SHARD.stats() if SCRAPE_SHARDING and JOB_SCHEDULER else None,
+        "change_feed": CHANGE_FOLLOWER.stats(),
+        "stream": STREAM_HUB.stats(),
+    }
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/stream")
+def stream_redirect():
+    """SSE 由独立端口上的推送服务提供，这里重定向过去（EventSource 会跟随重定向）"""
+    if not STREAM_HUB.running:
+        return jsonify({"error": "实时推送未启用"}), 503
+    if STREAM_PUBLIC_URL:
+        base = STREAM_PUBLIC_URL
+    else:
+        base = f"{request.scheme}://{request.host.rsplit(':', 1)[0]}:{STREAM_PUBLIC_PORT or STREAM_HUB.port}"
+    query = request.query_string.decode("latin-1")
+    return redirect(f"{base}/stream" + (f"?{query}" if query else ""), code=307)
 
 @app.route("/fetch")
 def fetch():
@@ -887,6 +2347,7 @@ def fetch():
     data = fetch_meter_data(device_id)
     if data:
         save_to_db(data)
+        SCRAPE_SCHEDULE.record_success(device_id, data["remain"], data["collected_at"])
         return {"message":f"✅ 抓取成功：{data}"}
     return {"message":"❌ 抓取失败"}
 
@@ -947,34 +2408,387 @@ def test_notification():
 # -----------------------
 # 后台定时抓取
 # -----------------------
+FETCH_INTERVAL_SECONDS = _require_env("FETCH_INTERVAL_SECONDS", cast=_cast_int_env, default="300")
+# 并发抓取的线程数，1 表示逐个抓取
+SCRAPE_CONCURRENCY = _cast_int_env(os.getenv("SCRAPE_CONCURRENCY", "8"))
+# 单个设备请求的超时时间（秒）
+SCRAPE_DEVICE_TIMEOUT = _cast_int_env(os.getenv("SCRAPE_DEVICE_TIMEOUT", "10"))
+# 一轮抓取的总预算（秒），默认为抓取间隔的 90%，保证不会拖到下一轮
+SCRAPE_CYCLE_BUDGET = _cast_int_env(os.getenv("SCRAPE_CYCLE_BUDGET", str(max(int(FETCH_INTERVAL_SECONDS * 0.9), 1))))
+
+# 抓取失败（连接错误、5xx）时的重试次数
+SCRAPE_RETRIES = _cast_int_env(os.getenv("SCRAPE_RETRIES", "2"))
+
+METER_SCRAPER = MeterScraper(pool_size=max(SCRAPE_CONCURRENCY, 1), retries=SCRAPE_RETRIES)
+
+# 自适应抓取：每块表按余额变化决定自己的抓取间隔，失败时指数退避；false 时每轮抓取全部设备
+SCRAPE_ADAPTIVE = os.getenv("SCRAPE_ADAPTIVE", "true").split("#", 1)[0].strip().lower() == "true"
+# 余额下降快或接近 0 时的最短间隔（秒），也是检查到期设备的周期
+SCRAPE_MIN_INTERVAL = _cast_int_env(os.getenv("SCRAPE_MIN_INTERVAL", "60"))
+# 余额长时间不变时的最长间隔（秒）；上限 3600，保证每小时至少一条读数
+SCRAPE_MAX_INTERVAL = min(_cast_int_env(os.getenv("SCRAPE_MAX_INTERVAL", "1800")), 3600)
+# 连续失败时退避的最长等待（秒）
+SCRAPE_MAX_BACKOFF = _cast_int_env(os.getenv("SCRAPE_MAX_BACKOFF", "3600"))
+# 余额不高于该值（元）时按最短间隔抓取
+SCRAPE_LOW_BALANCE = _cast_int_env(os.getenv("SCRAPE_LOW_BALANCE", "5"))
+
+SCRAPE_SCHEDULE = scrape_schedule.AdaptiveSchedule(
+    FETCH_INTERVAL_SECONDS,
+    SCRAPE_MIN_INTERVAL,
+    SCRAPE_MAX_INTERVAL,
+    max_backoff=SCRAPE_MAX_BACKOFF,
+    low_balance=SCRAPE_LOW_BALANCE,
+)
+SCRAPE_TICK_SECONDS = min(SCRAPE_MIN_INTERVAL, FETCH_INTERVAL_SECONDS) if SCRAPE_ADAPTIVE else FETCH_INTERVAL_SECONDS
+
+# 多节点分片抓取：每个运行定时任务的实例（worker.py 等）通过数据库租约平分设备并各自抓取（见 shard.py）；
+# false 时只有持有后台任务锁的实例抓取全部设备
+SCRAPE_SHARDING = os.getenv("SCRAPE_SHARDING", "false").split("#", 1)[0].strip().lower() == "true"
+# 抓取租约时长（秒），每 1/3 续期一次；其 1/3 应大于单个设备抓取的最长耗时（含重试）
+SCRAPE_LEASE_SECONDS = _cast_int_env(os.getenv("SCRAPE_LEASE_SECONDS", "120"))
+
+SCRAPE_SHARD = shard.LeaseCoordinator(
+    DB_POOL, DB_BACKEND, PROCESS_ID, lambda: [device["id"] for device in DEVICE_LIST],
+    lease_seconds=SCRAPE_LEASE_SECONDS, clock=now_cn, logger=app.logger,
+)
+
+LAST_SCRAPE_SUMMARY = None
+
+def _scrape_device(device_id):
+    """
+    抓取并保存单个设备，返回 (结果, 耗时秒)；结果为 ok / no_data / error，同时决定该设备下一次的抓取时间。
+    分片抓取时，排队期间租约已转给其他节点的设备不再抓取，结果为 skipped。
+    """
+    if SCRAPE_SHARDING and not SCRAPE_SHARD.owns(device_id):
+        return "skipped", None
+    started = time.monotonic()
+    try:
+        data = fetch_meter_data(device_id, timeout=SCRAPE_DEVICE_TIMEOUT)
+        if not data:
+            SCRAPE_SCHEDULE.record_failure(device_id, "no_data")
+            return "no_data", time.monotonic() - started
+        READING_WRITER.add(data)
+        SCRAPE_SCHEDULE.record_success(device_id, data["remain"], data["collected_at"])
+        return "ok", time.monotonic() - started
+    except Exception as exc:
+        app.logger.warning("设备 %s 抓取入库失败: %s", device_id, exc)
+        SCRAPE_SCHEDULE.record_failure(device_id, "error")
+        return "error", time.monotonic() - started
+
+
+def _summarize_scrape(started_at, elapsed, outcomes, durations):
+    """汇总一轮抓取的成功/失败数量与耗时"""
+    ordered = sorted(durations)
+    failed = [device_id for device_id, outcome in outcomes.items() if outcome != "ok"]
+    return {
+        "started_at": started_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "devices": len(outcomes),
+        "succeeded": len(outcomes) - len(failed),
+        "failed": sum(1 for o in outcomes.values() if o in ("no_data", "error")),
+        "timed_out": sum(1 for o in outcomes.values() if o == "timeout"),
+        "duration": round(elapsed, 3),
+        "device_p50": round(ordered[len(ordered) // 2], 3) if ordered else None,
+        "device_max": round(ordered[-1], 3) if ordered else None,
+        "failed_devices": failed[:20],
+    }
+
+
+@metrics.scoped("job:fetch")
 def scheduled_fetch():
-    for device in DEVICE_LIST:
-        data = fetch_meter_data(device["id"])
-        if data: save_to_db(data)
+    """
+    抓取已到期的设备（SCRAPE_ADAPTIVE=false 时为全部设备）。SCRAPE_CONCURRENCY > 1 时使用线程池并发抓取：
+    每个设备的请求受 SCRAPE_DEVICE_TIMEOUT 限制，整轮受 SCRAPE_CYCLE_BUDGET 限制，
+    超出预算仍未完成的设备记为 timeout，不阻塞下一轮（调度状态不变，下一轮优先抓取）。
+    """
+    global LAST_SCRAPE_SUMMARY
+    started_at = now_cn()
+    started = time.monotonic()
+    device_ids = [device["id"] for device in DEVICE_LIST]
+    if SCRAPE_SHARDING:
+        device_ids = [device_id for device_id in device_ids if SCRAPE_SHARD.owns(device_id)]
+    if SCRAPE_ADAPTIVE:
+        # 允许提前半个检查周期，避免刚好晚到一点的设备多等一整个周期
+        device_ids = SCRAPE_SCHEDULE.due(device_ids, slack=SCRAPE_TICK_SECONDS / 2)
+        if not device_ids:
+            return _summarize_scrape(started_at, 0.0, {}, [])
+    outcomes = {device_id: "timeout" for device_id in device_ids}
+    durations = []
+
+    if SCRAPE_CONCURRENCY <= 1 or len(device_ids) <= 1:
+        for device_id in device_ids:
+            if time.monotonic() - started > SCRAPE_CYCLE_BUDGET:
+                break
+            outcomes[device_id], duration = _scrape_device(device_id)
+            durations.append(duration)
+    else:
+        executor = ThreadPoolExecutor(
+            max_workers=min(SCRAPE_CONCURRENCY, len(device_ids)), thread_name_prefix="scrape"
+        )
+        futures = {executor.submit(_scrape_device, device_id): device_id for device_id in device_ids}
+        try:
+            for future in as_completed(futures, timeout=SCRAPE_CYCLE_BUDGET):
+                outcomes[futures[future]], duration = future.result()
+                durations.append(duration)
+        except FuturesTimeoutError:
+            app.logger.warning("本轮抓取超出预算 %ss，未完成的设备将在下一轮重试", SCRAPE_CYCLE_BUDGET)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # 本轮读数立即落库，不等待刷新间隔
+    READING_WRITER.flush()
+    outcomes = {device_id: outcome for device_id, outcome in outcomes.items() if outcome != "skipped"}
+    durations = [duration for duration in durations if duration is not None]
+    summary = _summarize_scrape(started_at, time.monotonic() - started, outcomes, durations)
+    LAST_SCRAPE_SUMMARY = summary
+    app.logger.info(
+        "抓取完成：%s 台，成功 %s，失败 %s，超时 %s，耗时 %.1fs",
+        summary["devices"], summary["succeeded"], summary["failed"], summary["timed_out"], summary["duration"],
+    )
+    return summary
 
-if __name__=="__main__":
+# -----------------------
+# 后台任务与选主（见 leader.py、worker.py）
+# -----------------------
+# python main.py 是否同时运行定时任务；Web 层多进程部署时设为 false，由 worker.py 运行
+RUN_JOBS = os.getenv("RUN_JOBS", "true").split("#", 1)[0].strip().lower() == "true"
+# 待命实例尝试获取任务锁、持有者确认锁仍有效的间隔（秒）
+LEADER_CHECK_SECONDS = _cast_int_env(os.getenv("LEADER_CHECK_SECONDS", "10"))
+JOB_LOCK_NAME = "electricity-jobs"
+
+JOB_SCHEDULER = None
+JOB_ELECTION = None
+
+
+# 只在持有后台任务锁的实例上执行的任务；分片抓取时 fetch_job 在每个实例上执行
+LEADER_JOBS = ('daily_report_job', 'retention_job') if SCRAPE_SHARDING else ('fetch_job', 'daily_report_job', 'retention_job')
+
+
+def build_scheduler():
+    """创建带全部定时任务的调度器（未启动），LEADER_JOBS 中的任务以暂停状态添加"""
     scheduler = BackgroundScheduler(timezone="Asia/Shanghai")
-    interval_seconds = _require_env("FETCH_INTERVAL_SECONDS", cast=_cast_int_env, default="300")
-    
-    # 数据抓取任务
-    scheduler.add_job(scheduled_fetch, 'interval', seconds=interval_seconds, id='fetch_job', max_instances=1, coalesce=True)
-    
+    scheduler.add_listener(_on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+    def add_job(func, trigger, job_id, **trigger_args):
+        paused = {"next_run_time": None} if job_id in LEADER_JOBS else {}
+        scheduler.add_job(func, trigger, id=job_id, max_instances=1, coalesce=True, **paused, **trigger_args)
+
+    # 数据抓取任务（自适应时每个检查周期只抓取到期的设备，分片时只抓取本实例持有租约的设备）
+    add_job(scheduled_fetch, 'interval', 'fetch_job', seconds=SCRAPE_TICK_SECONDS)
+
     # 每日9点发送用电报告
-    scheduler.add_job(send_daily_reports, 'cron', hour=9, minute=0, id='daily_report_job', max_instances=1, coalesce=True)
-    
-    # 首次启动时，立即触发一次抓取，避免页面空白
-    scheduler.add_job(scheduled_fetch, 'date', run_date=datetime.now() + timedelta(seconds=1), id='bootstrap_fetch', misfire_grace_time=60, coalesce=True)
-    
+    add_job(send_daily_reports, 'cron', 'daily_report_job', hour=9, minute=0)
+
+    # 每日凌晨维护分区、清理过期数据
+    add_job(scheduled_retention, 'cron', 'retention_job', hour=3, minute=30)
+    return scheduler
+
+
+def _bootstrap_fetch(scheduler):
+    # 立即抓取一次，避免页面空白或接替期间的数据缺口
+    scheduler.add_job(
+        scheduled_fetch, 'date', run_date=now_cn() + timedelta(seconds=1), id='bootstrap_fetch',
+        misfire_grace_time=60, coalesce=True, replace_existing=True,
+    )
+
+
+def start_job_runner():
+    """
+    启动定时任务：LEADER_JOBS 以暂停状态添加，只有通过数据库锁当选的实例恢复执行；
+    失去锁时暂停（正在执行的任务会执行完），重新当选后继续。
+    分片抓取时各实例先认领抓取租约，再各自抓取自己的设备。
+    """
+    global JOB_SCHEDULER, JOB_ELECTION
+    DEVICE_REGISTRY.start()
+    scheduler = build_scheduler()
     scheduler.start()
-    
+
+    def elected():
+        for job_id in LEADER_JOBS:
+            scheduler.resume_job(job_id)
+        if not SCRAPE_SHARDING:
+            _bootstrap_fetch(scheduler)
+
+    def demoted():
+        for job_id in LEADER_JOBS:
+            scheduler.pause_job(job_id)
+
+    JOB_SCHEDULER = scheduler
+    if SCRAPE_SHARDING:
+        SCRAPE_SHARD.start()
+        _bootstrap_fetch(scheduler)
+    JOB_ELECTION = leader.LeaderElection(
+        DB_BACKEND, JOB_LOCK_NAME, elected, demoted, interval=LEADER_CHECK_SECONDS, logger=app.logger
+    ).start()
+    return JOB_ELECTION
+
+
+def stop_job_runner():
+    if JOB_ELECTION is not None:
+        JOB_ELECTION.stop()
+    if JOB_SCHEDULER is not None:
+        JOB_SCHEDULER.shutdown(wait=False)
+    if SCRAPE_SHARDING:
+        # 停止调度后再释放租约，其他实例在正在进行的抓取结束后接管
+        SCRAPE_SHARD.stop()
+
+
+_WEB_SERVICES_LOCK = threading.Lock()
+_WEB_SERVICES_STARTED = False
+
+
+def start_web_services(shared_port=False):
+    """
+    Web 进程的后台服务：设备登记表、跨进程缓存同步与实时推送。python main.py 启动时调用；
+    WSGI 服务器下由 wsgi.py 在每个工作进程中以 shared_port=True 调用，各进程以 SO_REUSEPORT 共用推送端口。
+    """
+    global _WEB_SERVICES_STARTED
+    with _WEB_SERVICES_LOCK:
+        if _WEB_SERVICES_STARTED:
+            return
+        _WEB_SERVICES_STARTED = True
+    DEVICE_REGISTRY.start()
+    if CACHE_SYNC_SECONDS:
+        CHANGE_FOLLOWER.start()
+    if STREAM_PORT:
+        STREAM_HUB.reuse_port = shared_port and hasattr(socket, "SO_REUSEPORT")
+        try:
+            STREAM_HUB.start()
+        except OSError as exc:
+            app.logger.error("实时推送端口 %s 不可用: %s", STREAM_PORT, exc)
+
+# -----------------------
+# 命令行维护工具
+# -----------------------
+def run_cli(argv):
+    """维护命令入口，例如：python main.py backfill-rollups --since 2024-01-01"""
+    parser = argparse.ArgumentParser(prog="main.py", description="电表监控系统维护命令")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill = sub.add_parser("backfill-rollups", help="根据历史读数回填每日、每小时用电汇总表")
+    backfill.add_argument("--meter", help="只回填指定表号，默认全部")
+    backfill.add_argument("--since", help="起始日期 YYYY-MM-DD，默认从最早读数开始")
+    check = sub.add_parser("check-queries", help="对全部读数查询执行 EXPLAIN，未走索引或出现 filesort 时以非 0 状态退出")
+    check.add_argument("--meter", help="用于 EXPLAIN 的表号，默认取第一个配置的设备")
+    retain = sub.add_parser("retention", help="立即执行一次数据保留任务（维护分区、清理过期原始读数与小时汇总）")
+    retain.add_argument("--dry-run", action="store_true", help="只列出将要执行的操作")
+    partition = sub.add_parser("partition-table", help="输出把 electricity_balance 转换为按月分区表的 DDL")
+    partition.add_argument("--execute", action="store_true", help="直接执行 DDL（会重建整张表，请在低峰期执行）")
+    devices = sub.add_parser("devices", help="查看或修改设备登记表（运行中的各进程在 DEVICE_RELOAD_SECONDS 秒内生效）")
+    devices.add_argument("action", choices=("list", "add", "remove", "enable", "disable"))
+    devices.add_argument("device_id", nargs="?", help="表号（list 以外的操作必填）")
+    devices.add_argument("--name", help="add：设备名称，默认为表号")
+    devices.add_argument("--server-chan-key-env", default="", help="add：Server酱 SendKey 所在的环境变量名")
+    args = parser.parse_args(argv)
+
+    ensure_schema()
+    if args.command == "backfill-rollups":
+        since = datetime.strptime(args.since, "%Y-%m-%d").date() if args.since else None
+        backfill_rollups(meter_no=args.meter, since=since)
+    elif args.command == "check-queries":
+        meter = args.meter or (DEVICE_LIST[0]["id"] if DEVICE_LIST else "")
+        end_time = now_cn().replace(minute=0, second=0, microsecond=0)
+        with DB_POOL.connection() as conn:
+            failures = queries.check_query_plans(conn, meter, end_time - timedelta(days=30), end_time, DB_BACKEND.name)
+        for name, problem in failures:
+            print(f"❌ {name}: {problem}")
+        if failures:
+            return 1
+        print("✅ 全部读数查询均使用索引范围查找，且没有 filesort")
+    elif args.command == "retention":
+        actions = run_retention(dry_run=args.dry_run)
+        if not actions:
+            print("没有需要执行的数据保留操作")
+    elif args.command == "devices":
+        return run_devices_command(args)
+    elif args.command == "partition-table":
+        if not DB_BACKEND.supports_partitions:
+            print(f"{DB_BACKEND.name} 后端不支持分区，数据保留任务会分批删除过期行")
+            return 1
+        with DB_POOL.connection() as conn:
+            if retention.list_partitions(conn) is not None:
+                print("electricity_balance 已是分区表")
+                return 0
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT MIN(collected_at) FROM electricity_balance")
+                first_at = cursor.fetchone()[0] or now_cn()
+            today = retention.month_start(now_cn().date())
+            sql = retention.partition_table_sql(
+                retention.month_start(first_at), retention.add_months(today, RETENTION_PARTITION_MONTHS_AHEAD)
+            )
+            print(sql)
+            if args.execute:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql)
+                print("✅ 已转换为按月分区表")
+    return 0
+
+def run_devices_command(args):
+    """devices 子命令；先导入环境变量中的设备，使其也可以在这里停用"""
+    if args.action != "list" and not args.device_id:
+        print(f"devices {args.action} 需要指定表号")
+        return 1
+    now = now_cn()
+    with DB_POOL.connection() as conn:
+        device_registry.seed(conn, DB_BACKEND, DEVICE_LIST, now)
+        if args.action == "list":
+            for device_id, name, enabled, updated_at in device_registry.list_all(conn):
+                print(f"{device_id}\t{name}\t{'启用' if enabled else '停用'}\t{updated_at}")
+            return 0
+        if args.action == "add":
+            with conn.cursor() as cursor:
+                device_registry.upsert(cursor, DB_BACKEND, {
+                    "id": args.device_id,
+                    "name": args.name or args.device_id,
+                    "server_chan_key_env": args.server_chan_key_env,
+                }, now)
+            print(f"✅ 已登记设备 {args.device_id}")
+            return 0
+        if args.action == "remove":
+            found = device_registry.remove(conn, args.device_id)
+        else:
+            found = device_registry.set_enabled(conn, args.device_id, args.action == "enable", now)
+    if not found:
+        print(f"❌ 设备 {args.device_id} 不在登记表中")
+        return 1
+    done = {"remove": "已删除", "enable": "已启用", "disable": "已停用"}[args.action]
+    print(f"✅ 设备 {args.device_id} {done}")
+    if args.action == "remove" and any(device["id"] == args.device_id for device in DEVICE_LIST):
+        print("该设备仍在 DEVICES_JSON / DEFAULT_DEVICE_ID 中，下次启动或执行 devices 命令时会重新导入；请同时从配置中删除，或改用 disable")
+    return 0
+
+if __name__=="__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+
+    DB_POOL.prefill()
+    ensure_schema()
+    READING_WRITER.start()
+    if RUN_JOBS:
+        start_job_runner()
+    start_web_services()
+    interval_seconds = FETCH_INTERVAL_SECONDS
+
     print(f"[{now_cn().strftime('%Y-%m-%d %H:%M:%S')}] 电表监控系统启动完成")
-    print(f"- 数据抓取间隔：{interval_seconds}秒")
-    print(f"- 每日报告时间：每天上午9:00")
+    if RUN_JOBS:
+        print(f"- 后台任务：{'本进程执行' if JOB_ELECTION.is_leader else '待命（其他实例持有任务锁）'}")
+        print(f"- 数据抓取间隔：{interval_seconds}秒（并发 {SCRAPE_CONCURRENCY}，单轮预算 {SCRAPE_CYCLE_BUDGET}秒）")
+        if SCRAPE_ADAPTIVE:
+            print(f"- 自适应抓取：{SCRAPE_MIN_INTERVAL}~{SCRAPE_MAX_INTERVAL}秒，失败退避最长 {SCRAPE_MAX_BACKOFF}秒")
+        if SCRAPE_SHARDING:
+            print(f"- 分片抓取：{SCRAPE_SHARD.nodes} 个节点，本节点持有 {len(SCRAPE_SHARD.owned())} 台设备")
+        print(f"- 每日报告时间：每天上午9:00")
+    else:
+        print("- 后台任务：未启用（RUN_JOBS=false，由 worker.py 执行）")
     print(f"- 配置的设备数量：{len(DEVICE_LIST)}")
-    
+    print(f"- 数据库连接池：{DB_POOL.min_size}~{DB_POOL.max_size}")
+    print(f"- 实时推送：{f'端口 {STREAM_HUB.port}（最多 {STREAM_MAX_CLIENTS} 个连接）' if STREAM_HUB.running else '未启用'}")
+
     try:
         port_env = os.getenv("PORT")
         port = _cast_int_env(port_env) if port_env else 5000
         app.run(host=os.getenv("HOST", "0.0.0.0"), port=port, debug=os.getenv("FLASK_DEBUG", "false").lower()=="true")
     finally:
-        scheduler.shutdown(wait=False)
+        stop_job_runner()
+        STREAM_HUB.stop()
+        CHANGE_FOLLOWER.stop()
+        DEVICE_REGISTRY.stop()
+        READING_WRITER.stop()
@@ -0,0 +1,103 @@
+"""
+电表页面（cnyiot pay.aspx）解析。
+
+快速路径：在原始 HTML 上用 str.find 定位 metid 与「剩余电量」锚点，再在锚点处做预编译正则的
+定点匹配，只对命中的片段做实体解码；两者都命中即返回，整页只扫描一遍、不做整页解码。
+回退路径：只为快速路径缺失的字段执行，对整页做实体解码、去标签后宽松匹配，
+与原先 main._parse_meter_page 的规则完全一致。
+"""
+import re
+from html import unescape
+
+_COLON = r"(?:[:：]|&#58;|&colon;)?"
+
+# 快速路径：在锚点位置定点匹配（re.match + pos），不做整页搜索
+_METID_ANCHOR = "metid"
+_METID_AT_RE = re.compile(r"""id=["']metid["'][^>]*>([^<]+)""")
+_POWER_ANCHOR = "剩余电量"
+_POWER_AT_RE = re.compile(r"剩余电量" + _COLON + r"</span>\s*<label[^>]*>([^<]+)</label>", re.IGNORECASE)
+
+# 回退路径（与原实现相同的匹配规则）
+_METID_RE = re.compile(r"""id=["']metid["'][^>]*>([^<]+)""", re.IGNORECASE)
+_METID_TEXT_RE = re.compile(r"(?:电表号|表号)\s*" + _COLON + r"\s*([0-9A-Za-z\-]+)")
+_POWER_LABEL_RE = re.compile(r"剩余电量" + _COLON + r"</span>\s*<label[^>]*>([^<]+)</label>", re.IGNORECASE)
+_POWER_TEXT_RE = re.compile(r"剩余电量" + _COLON + r"[^0-9]*([0-9]+(?:\.[0-9]+)?)")
+_TAG_RE = re.compile(r"<[^>]+>")
+_NUMBER_RE = re.compile(r"([0-9]+(?:\.[0-9]+)?)")
+
+
+def strip_tags(html_text):
+    """基础的 HTML 标签清理，用于宽松匹配文本内容"""
+    if not html_text:
+        return ""
+    return _TAG_RE.sub(" ", html_text)
+
+
+def extract_first_number(text):
+    """从文本中提取第一个数字（含小数）"""
+    if not text:
+        return None
+    match = _NUMBER_RE.search(text.replace(",", ""))
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            return None
+    return None
+
+
+def _match_at_anchor(html_text, anchor, pattern, offset):
+    """依次定位 anchor 出现的位置，在 pos - offset 处尝试定点匹配，返回第一个命中"""
+    pos = html_text.find(anchor)
+    while pos != -1:
+        if pos >= offset:
+            match = pattern.match(html_text, pos - offset)
+            if match:
+                return match.group(1)
+        pos = html_text.find(anchor, pos + len(anchor))
+    return None
+
+
+def _parse_fast(html_text):
+    meter_id = _match_at_anchor(html_text, _METID_ANCHOR, _METID_AT_RE, len('id="'))
+    if meter_id is not None:
+        meter_id = unescape(meter_id).strip() or None
+    raw_power = _match_at_anchor(html_text, _POWER_ANCHOR, _POWER_AT_RE, 0)
+    if raw_power is not None:
+        raw_power = unescape(raw_power).strip()
+    return meter_id, raw_power
+
+
+def _parse_fallback(html_text, meter_id=None, raw_power=None):
+    """整页解码后补齐快速路径缺失的字段；子串预检只用于跳过必然不匹配的正则，不改变匹配结果"""
+    normalized = unescape(html_text)
+    plain_text = None
+
+    if meter_id is None:
+        match = _METID_RE.search(normalized) if "metid" in normalized.lower() else None
+        meter_id = match.group(1).strip() if match else None
+        if not meter_id:
+            plain_text = strip_tags(normalized)
+            match = _METID_TEXT_RE.search(plain_text) if "表号" in plain_text else None
+            if match:
+                meter_id = match.group(1).strip()
+
+    if raw_power is None and "剩余电量" in normalized:
+        match = _POWER_LABEL_RE.search(normalized)
+        raw_power = match.group(1).strip() if match else None
+        if raw_power is None:
+            if plain_text is None:
+                plain_text = strip_tags(normalized)
+            match = _POWER_TEXT_RE.search(plain_text)
+            raw_power = match.group(1) if match else None
+
+    return meter_id, raw_power
+
+
+def parse_meter_page(html_text):
+    """解析电表页面 HTML，返回 (表号, 剩余电量)；无法解析的字段为 None"""
+    html_text = html_text or ""
+    meter_id, raw_power = _parse_fast(html_text)
+    if meter_id is None or raw_power is None:
+        meter_id, raw_power = _parse_fallback(html_text, meter_id, raw_power)
+    return meter_id, extract_first_number(raw_power)
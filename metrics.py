@@ -0,0 +1,256 @@
+"""
+轻量运行指标，按 Prometheus 文本格式（0.0.4）输出，不依赖 prometheus_client。
+
+- Counter / Gauge / Histogram：带标签的指标，每个指标一把锁，一次记录只做字典查找与整数累加；
+- 采集回调（add_collector）：连接池、缓存等已有统计在 /metrics 被抓取时才读取，平时没有额外开销；
+- 作用域（scope）：请求或定时任务的名称保存在线程局部变量中，数据库查询按作用域分别计数、计时；
+- InstrumentedConnection：连接池借出的连接包装，cursor 的 execute/executemany 计时后调用 observe_query。
+"""
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_SCOPE = "background"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """单调递增计数；标签值按 labelnames 顺序传入"""
+
+    type_name = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items
+        ]
+
+
+class Gauge(Counter):
+    """可增可减的当前值"""
+
+    type_name = "gauge"
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """累积分桶直方图（_bucket / _sum / _count）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = self._header()
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """
+        collect() 在抓取时调用，返回 [(name, type, help, labelnames, [(label_values, value), ...]), ...]，
+        用于把已有的统计字典直接暴露出来。
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, type_name, documentation, labelnames, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DB_QUERIES = REGISTRY.counter("electricity_db_queries_total", "执行的 SQL 语句数（按请求路由/任务）", ("scope",))
+DB_QUERY_SECONDS = REGISTRY.counter(
+    "electricity_db_query_seconds_total", "SQL 语句累计耗时（秒，按请求路由/任务）", ("scope",)
+)
+
+# -----------------------
+# 作用域与查询计时
+# -----------------------
+_local = threading.local()
+_query_listeners = []
+
+
+def current_scope():
+    return getattr(_local, "scope", None) or DEFAULT_SCOPE
+
+
+def set_scope(name):
+    """设置当前线程的作用域，返回之前的值（None 表示未设置）"""
+    previous = getattr(_local, "scope", None)
+    _local.scope = name
+    return previous
+
+
+def scoped(name):
+    """装饰器：函数执行期间的查询记在作用域 name 下（用于定时任务）"""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            previous = set_scope(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                set_scope(previous)
+
+        return wrapper
+
+    return decorator
+
+
+def add_query_listener(listener):
+    """listener(sql, params, seconds, many) 在每条语句执行后调用（在执行语句的线程中）"""
+    _query_listeners.append(listener)
+
+
+def observe_query(sql, params, seconds, many=False):
+    scope = current_scope()
+    DB_QUERIES.inc(scope)
+    DB_QUERY_SECONDS.inc(scope, amount=seconds)
+    for listener in _query_listeners:
+        listener(sql, params, seconds, many)
+
+
+class InstrumentedCursor:
+    """游标包装：execute/executemany 计时，其余属性与方法直接转发"""
+
+    __slots__ = ("_cursor",)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            observe_query(sql, params, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_params):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, seq_of_params)
+        finally:
+            observe_query(sql, seq_of_params, time.perf_counter() - started, many=True)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+
+class InstrumentedConnection:
+    """连接包装：cursor() 返回 InstrumentedCursor，其余转发给原连接"""
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @property
+    def wrapped(self):
+        return self._conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
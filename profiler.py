@@ -0,0 +1,112 @@
+"""
+单个请求的 SQL 剖析：记录请求内执行的每条语句（规范化后的 SQL、参数形状、耗时），
+用于 Server-Timing / X-Query-Count 响应头与慢请求日志。
+
+语句由 metrics.InstrumentedCursor 计时后通过查询监听器传入，只记录在当前线程开启的剖析上。
+未开启详细模式时只累计条数与耗时；详细模式额外保存每条语句，并找出重复执行的语句（N+1 查询）。
+参数只记录类型与数量，不记录取值。
+"""
+import re
+import threading
+import time
+
+import metrics
+
+MAX_SQL_CHARS = 300
+_WHITESPACE_RE = re.compile(r"\s+")
+_local = threading.local()
+
+
+class RequestProfile:
+    __slots__ = ("started", "count", "db_seconds", "statements")
+
+    def __init__(self, detailed):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.db_seconds = 0.0
+        self.statements = [] if detailed else None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def repeated(self, min_count=3):
+        """执行次数 >= min_count 的相同 SQL [(sql, 次数, 累计毫秒), ...]，按次数降序"""
+        groups = {}
+        for sql, _, seconds in self.statements or ():
+            count, total = groups.get(sql, (0, 0.0))
+            groups[sql] = (count + 1, total + seconds)
+        return sorted(
+            ((sql, count, round(total * 1000, 3)) for sql, (count, total) in groups.items() if count >= min_count),
+            key=lambda item: -item[1],
+        )
+
+
+def normalize_sql(sql):
+    """合并空白并截断，便于相同语句归组"""
+    sql = _WHITESPACE_RE.sub(" ", sql).strip()
+    return sql if len(sql) <= MAX_SQL_CHARS else sql[:MAX_SQL_CHARS] + "…"
+
+
+def params_shape(params, many=False):
+    """参数形状：单次执行为 "str,datetime"，executemany 为 "200×(str,float,datetime,NoneType)" """
+    if many:
+        rows = list(params or ())
+        return f"{len(rows)}×({params_shape(rows[0])})" if rows else "0×()"
+    if params is None:
+        return ""
+    if isinstance(params, dict):
+        return ",".join(f"{key}:{type(value).__name__}" for key, value in params.items())
+    return ",".join(type(value).__name__ for value in params)
+
+
+def start(detailed=False):
+    """在当前线程开启一次剖析（覆盖未结束的上一次）"""
+    _local.profile = RequestProfile(detailed)
+    return _local.profile
+
+
+def finish():
+    """结束当前线程的剖析并返回 RequestProfile（未开启时为 None）"""
+    profile = getattr(_local, "profile", None)
+    _local.profile = None
+    return profile
+
+
+def _on_query(sql, params, seconds, many):
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return
+    profile.count += 1
+    profile.db_seconds += seconds
+    if profile.statements is not None:
+        profile.statements.append((normalize_sql(sql), params_shape(params, many), seconds))
+
+
+metrics.add_query_listener(_on_query)
+
+
+def server_timing(profile, total_seconds):
+    """Server-Timing 响应头：db（SQL 累计耗时与条数）与 total"""
+    return (
+        f'db;dur={profile.db_seconds * 1000:.2f};desc="{profile.count} queries", '
+        f"total;dur={total_seconds * 1000:.2f}"
+    )
+
+
+def slow_entry(profile, total_seconds, **context):
+    """慢请求日志条目（可直接 JSON 序列化）；详细模式下附带最慢的语句与重复语句"""
+    entry = {
+        **context,
+        "duration_ms": round(total_seconds * 1000, 2),
+        "query_count": profile.count,
+        "db_ms": round(profile.db_seconds * 1000, 2),
+    }
+    if profile.statements is not None:
+        slowest = sorted(profile.statements, key=lambda item: -item[2])[:20]
+        entry["statements"] = [
+            {"sql": sql, "params": shape, "ms": round(seconds * 1000, 3)} for sql, shape, seconds in slowest
+        ]
+        entry["repeated"] = [
+            {"sql": sql, "count": count, "ms": ms} for sql, count, ms in profile.repeated()
+        ]
+    return entry
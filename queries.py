@@ -0,0 +1,205 @@
+"""
+electricity_balance 读数查询（所有读数 SQL 集中在此处）。
+
+约定：
+- 时间条件一律写成作用在原始列上的半开区间 collected_at >= start AND collected_at < end，
+  不对列套函数（DATE()、COALESCE() 等），保证能在 idx_meter_time (meter_no, collected_at) 上做范围查找；
+- 各查询只在单个分支内 ORDER BY 索引列，UNION ALL 之后不再整体排序（避免对合并结果 filesort），
+  需要整体有序的调用方在 Python 中排序（结果本身已近乎有序）；
+- 只使用 MySQL 与 SQLite 共有的语法，两种存储后端原样执行（写入语句由 storage.py 按方言生成）；
+- 每个函数返回 (sql, params)，由调用方在自己的连接上执行。
+
+check_query_plans() 对这里的每条查询执行 EXPLAIN（SQLite 为 EXPLAIN QUERY PLAN），发现未走索引或出现 filesort 时返回问题列表，
+供 python main.py check-queries 使用。
+"""
+
+READING_COLUMNS = "collected_at, confirmed_at, remain"
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def series_window(meter_no, start_time, end_time):
+    """start_time 之前的最后一行 + [start_time, end_time) 内的全部行（未整体排序）"""
+    sql = f"""
+        SELECT {READING_COLUMNS} FROM (
+            SELECT {READING_COLUMNS}
+            FROM electricity_balance
+            WHERE meter_no=%s AND collected_at < %s
+            ORDER BY collected_at DESC
+            LIMIT 1
+        ) AS prev_reading
+        UNION ALL
+        SELECT {READING_COLUMNS}
+        FROM electricity_balance
+        WHERE meter_no=%s AND collected_at >= %s AND collected_at < %s
+    """
+    return sql, (meter_no, start_time, meter_no, start_time, end_time)
+
+
+def _last_rows(meters, before=None, dialect="mysql"):
+    """
+    各表号（before 之前）最后一行的查询片段与参数。
+    MySQL：GROUP BY + MAX 在 (meter_no, collected_at) 上走松散索引扫描（Using index for group-by）；
+    SQLite 不做这种优化（会扫描表号的全部行），改为由表号列表驱动的相关子查询，每个表号一次主键查找。
+    """
+    bound = " AND collected_at < %s" if before is not None else ""
+    if dialect == "sqlite":
+        values = ", ".join(["(%s)"] * len(meters))
+        sql = f"""
+            SELECT b.meter_no, b.collected_at, b.confirmed_at, b.remain
+            FROM (VALUES {values}) AS m
+            JOIN electricity_balance b ON b.meter_no = m.column1 AND b.collected_at = (
+                SELECT MAX(collected_at) FROM electricity_balance
+                WHERE meter_no = m.column1{bound}
+            )
+        """
+    else:
+        sql = f"""
+            SELECT b.meter_no, b.collected_at, b.confirmed_at, b.remain
+            FROM electricity_balance b
+            JOIN (
+                SELECT meter_no, MAX(collected_at) AS collected_at
+                FROM electricity_balance
+                WHERE meter_no IN ({_placeholders(meters)}){bound}
+                GROUP BY meter_no
+            ) AS last_rows ON b.meter_no = last_rows.meter_no AND b.collected_at = last_rows.collected_at
+        """
+    return sql, list(meters) + ([before] if before is not None else [])
+
+
+def series_window_for_meters(meters, start_time, end_time, dialect="mysql"):
+    """多个表号的 series_window：各表号 start_time 之前的最后一行 + [start_time, end_time) 内的行"""
+    prev_sql, prev_params = _last_rows(meters, start_time, dialect)
+    sql = f"""
+        {prev_sql}
+        UNION ALL
+        SELECT meter_no, {READING_COLUMNS}
+        FROM electricity_balance
+        WHERE meter_no IN ({_placeholders(meters)}) AND collected_at >= %s AND collected_at < %s
+    """
+    return sql, prev_params + list(meters) + [start_time, end_time]
+
+
+def series_since_for_meters(meters, start_time, dialect="mysql"):
+    """多个表号各自 start_time 之前的最后一行 + start_time 之后的全部行（充值识别用，不设上界）"""
+    prev_sql, prev_params = _last_rows(meters, start_time, dialect)
+    sql = f"""
+        {prev_sql}
+        UNION ALL
+        SELECT meter_no, {READING_COLUMNS}
+        FROM electricity_balance
+        WHERE meter_no IN ({_placeholders(meters)}) AND collected_at >= %s
+    """
+    return sql, prev_params + list(meters) + [start_time]
+
+
+def latest_rows(meters, dialect="mysql"):
+    """多个表号各自的最新一行"""
+    return _last_rows(meters, None, dialect)
+
+
+def latest_balance(meter_no):
+    """单个表号的最新余额"""
+    sql = "SELECT remain FROM electricity_balance WHERE meter_no=%s ORDER BY collected_at DESC LIMIT 1"
+    return sql, (meter_no,)
+
+
+def first_reading_time(meter_no):
+    """单个表号最早的读数时间"""
+    sql = "SELECT collected_at FROM electricity_balance WHERE meter_no=%s ORDER BY collected_at LIMIT 1"
+    return sql, (meter_no,)
+
+
+def last_reading(meter_no):
+    """单个表号最新一行的起点与确认时间（最后一次读数时间取两者中较晚者）"""
+    sql = (
+        "SELECT collected_at, confirmed_at FROM electricity_balance "
+        "WHERE meter_no=%s ORDER BY collected_at DESC LIMIT 1"
+    )
+    return sql, (meter_no,)
+
+
+def distinct_meters():
+    """全部出现过的表号"""
+    return "SELECT DISTINCT meter_no FROM electricity_balance", ()
+
+
+# -----------------------
+# EXPLAIN 回归检查
+# -----------------------
+def _sample_plans(meter_no, start_time, end_time, dialect="mysql"):
+    return [
+        ("series_window", series_window(meter_no, start_time, end_time)),
+        ("series_window_for_meters", series_window_for_meters([meter_no], start_time, end_time, dialect)),
+        ("series_since_for_meters", series_since_for_meters([meter_no], start_time, dialect)),
+        ("latest_rows", latest_rows([meter_no], dialect)),
+        ("latest_balance", latest_balance(meter_no)),
+        ("first_reading_time", first_reading_time(meter_no)),
+        ("last_reading", last_reading(meter_no)),
+        ("distinct_meters", distinct_meters()),
+    ]
+
+
+def _plan_problems(rows):
+    """检查 EXPLAIN 结果：electricity_balance 的每次访问都必须用到索引且不能 filesort"""
+    problems = []
+    for row in rows:
+        table = row.get("table") or ""
+        extra = row.get("Extra") or ""
+        if "filesort" in extra:
+            problems.append(f"{table}: {extra}")
+        if table not in ("electricity_balance", "b"):
+            continue
+        if row.get("type") in ("ALL", "index") and "for group-by" not in extra:
+            problems.append(f"{table}: 全表/全索引扫描（type={row.get('type')}）")
+        elif not row.get("key") and "optimized away" not in extra and "no matching" not in extra.lower():
+            problems.append(f"{table}: 未使用索引（possible_keys={row.get('possible_keys')}）")
+    return problems
+
+
+def _sqlite_plan_problems(details, name):
+    """
+    检查 SQLite 的 EXPLAIN QUERY PLAN：electricity_balance 只允许主键/索引上的 SEARCH，
+    不允许为排序建临时 B 树（相当于 filesort）。distinct_meters 按主键顺序扫描是预期行为。
+    """
+    problems = []
+    for detail in details:
+        if "TEMP B-TREE FOR ORDER BY" in detail:
+            problems.append(detail)
+        words = detail.split()
+        if words[:1] == ["SCAN"] and len(words) > 1 and words[1] in ("electricity_balance", "b"):
+            if name != "distinct_meters":
+                problems.append(f"{detail}（全表扫描）")
+    return problems
+
+
+def check_query_plans(conn, meter_no, start_time, end_time, backend="mysql"):
+    """
+    对本模块的全部读数查询执行 EXPLAIN，返回 [(查询名, 问题描述), ...]，空列表表示全部通过。
+    MySQL/MariaDB 需要在有代表性数据量的库上运行：表很小时优化器可能直接选择全表扫描。
+    """
+    failures = []
+    if backend == "sqlite":
+        cursor = conn.cursor()
+        try:
+            for name, (sql, params) in _sample_plans(meter_no, start_time, end_time, backend):
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                for problem in _sqlite_plan_problems([row[-1] for row in cursor.fetchall()], name):
+                    failures.append((name, problem))
+        finally:
+            cursor.close()
+        return failures
+
+    import pymysql
+
+    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        for name, (sql, params) in _sample_plans(meter_no, start_time, end_time):
+            cursor.execute("EXPLAIN " + sql, params)
+            for problem in _plan_problems(cursor.fetchall()):
+                failures.append((name, problem))
+    finally:
+        cursor.close()
+    return failures
@@ -0,0 +1,216 @@
+"""
+electricity_balance 数据保留（分层存储）。
+
+原始读数只保留最近一段时间，更早的数据由汇总表承载：每小时汇总 electricity_hourly_usage
+可单独设置保留期，每日汇总 electricity_daily_usage 与充值记录 electricity_recharge 永久保留。
+
+两种清理方式：
+- 分区表（MySQL/MariaDB 按月 RANGE COLUMNS(collected_at) 分区）：提前创建未来几个月的分区，
+  过期月份整区 DROP PARTITION（或 EXCHANGE PARTITION 归档为独立表），不产生逐行删除；
+- 未分区的表（以及不支持分区的 SQLite 后端）：按表号在 (meter_no, 时间) 索引上分批删除，每批一个短事务。
+
+partition_table_sql() 生成把现有表转换为分区表的一次性 DDL（会重建整张表）。
+每个函数接收调用方的连接与存储后端（storage.StorageBackend），只有 dry_run=False 时才执行写操作；
+返回执行（或将要执行）的操作说明。
+"""
+import re
+from datetime import date, datetime
+
+TABLE = "electricity_balance"
+MAX_PARTITION = "pmax"
+_PARTITION_RE = re.compile(r"^p(\d{4})(\d{2})$")
+
+
+def month_start(value):
+    """所在月份的 1 日（date）"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    """month（某月 1 日）之后第 count 个月的 1 日"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def _partition_month(name):
+    match = _PARTITION_RE.match(name or "")
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def _partition_clause(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+
+
+def list_partitions(conn):
+    """electricity_balance 的按月分区 {月份: 分区名}；表未分区时返回 None"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT partition_name FROM information_schema.partitions "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL",
+            (TABLE,),
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    if not names:
+        return None
+    return {_partition_month(name): name for name in names if _partition_month(name)}
+
+
+def _table_exists(conn, table):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+            (table,),
+        )
+        return cursor.fetchone()[0] > 0
+
+
+def _table_has_rows(conn, table):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+        return cursor.fetchone() is not None
+
+
+def partition_table_sql(first_month, last_month):
+    """
+    把 electricity_balance 转换为按月分区表的 DDL：分区键必须包含在每个唯一键中，
+    因此主键改为 (id, collected_at)；[first_month, last_month] 每月一个分区，另加 pmax 兜底。
+    """
+    clauses = []
+    month = first_month
+    while month <= last_month:
+        clauses.append(_partition_clause(month))
+        month = add_months(month, 1)
+    clauses.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    return (
+        f"ALTER TABLE {TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (id, collected_at) "
+        f"PARTITION BY RANGE COLUMNS(collected_at) ({', '.join(clauses)})"
+    )
+
+
+def ensure_future_partitions(conn, backend, today, months_ahead, dry_run=False):
+    """从 pmax 中拆出到 today 之后 months_ahead 个月为止尚不存在的月份分区"""
+    partitions = list_partitions(conn) if backend.supports_partitions else None
+    if partitions is None:
+        return []
+    last = max(partitions) if partitions else add_months(month_start(today), -1)
+    target = add_months(month_start(today), months_ahead)
+    clauses = []
+    month = add_months(last, 1)
+    while month <= target:
+        clauses.append(_partition_clause(month))
+        month = add_months(month, 1)
+    if not clauses:
+        return []
+    sql = (
+        f"ALTER TABLE {TABLE} REORGANIZE PARTITION {MAX_PARTITION} INTO "
+        f"({', '.join(clauses)}, PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE))"
+    )
+    if not dry_run:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+    return [f"新建分区 {', '.join(clause.split()[1] for clause in clauses)}"]
+
+
+def _spanning_rows(conn, name, cutoff):
+    """分区中一直确认到 cutoff 之后的行（change_only 模式下跨越 cutoff 的一段读数）"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT meter_no, remain, confirmed_at FROM {TABLE} PARTITION ({name}) WHERE confirmed_at >= %s",
+            (cutoff,),
+        )
+        return cursor.fetchall()
+
+
+def drop_expired_partitions(conn, backend, cutoff, archive=False, dry_run=False):
+    """
+    删除数据全部早于 cutoff 的月份分区（分区上界 <= cutoff）。
+    与分批删除一致，一直确认到 cutoff 之后的行（change_only）不随分区丢失：删除前以分区上界为起点
+    复制到下一个分区（余额与 confirmed_at 不变），cutoff 处的余额仍可查到。
+    archive=True 时先用 EXCHANGE PARTITION 把该分区换出为独立表 electricity_balance_YYYYMM
+    （只交换元数据，不复制数据），再删除已清空的分区。
+    归档表已存在且有数据时（例如之前归档过、又补录了该月的读数）不能交换——交换会把归档表中的旧行换回分区，
+    随后被 DROP PARTITION 删除，改为把分区中的行 INSERT 追加到归档表后再删除分区。
+    """
+    partitions = list_partitions(conn) or {}
+    actions = []
+    for month in sorted(partitions):
+        boundary = datetime.combine(add_months(month, 1), datetime.min.time())
+        if boundary > cutoff:
+            break
+        name = partitions[month]
+        statements = []
+        if archive:
+            archive_table = f"{TABLE}_{month:%Y%m}"
+            exists = _table_exists(conn, archive_table)
+            if not exists:
+                statements += [
+                    f"CREATE TABLE {archive_table} LIKE {TABLE}",
+                    f"ALTER TABLE {archive_table} REMOVE PARTITIONING",
+                ]
+            if exists and _table_has_rows(conn, archive_table):
+                statements.append(f"INSERT INTO {archive_table} SELECT * FROM {TABLE} PARTITION ({name})")
+                actions.append(f"归档分区 {name} -> {archive_table}（归档表已有数据，追加写入）")
+            else:
+                statements.append(f"ALTER TABLE {TABLE} EXCHANGE PARTITION {name} WITH TABLE {archive_table}")
+                actions.append(f"归档分区 {name} -> {archive_table}")
+        else:
+            actions.append(f"删除分区 {name}")
+        statements.append(f"ALTER TABLE {TABLE} DROP PARTITION {name}")
+        carried = [
+            (meter_no, remain, boundary, confirmed_at)
+            for meter_no, remain, confirmed_at in _spanning_rows(conn, name, cutoff)
+        ]
+        if carried:
+            actions.append(
+                f"{name} 中 {len(carried)} 行确认到 {cutoff:%Y-%m-%d} 之后，以 {boundary:%Y-%m-%d} 为起点续接到下一个分区"
+            )
+        if not dry_run:
+            with conn.cursor() as cursor:
+                # 先写入下一个分区，再交换或删除本分区
+                backend.insert_readings(cursor, carried)
+                for sql in statements:
+                    cursor.execute(sql)
+    return actions
+
+
+def delete_expired_rows(conn, backend, table, key_column, meters, cutoff, chunk_size, dry_run=False, extra_condition=""):
+    """
+    未分区表的清理：逐个表号删除 key_column < cutoff 的行，每批至多 chunk_size 行，
+    走 (meter_no, key_column) 索引的范围扫描，避免长事务与全表扫描。返回删除（或将删除）的行数说明。
+    """
+    where = f"meter_no=%s AND {key_column} < %s{extra_condition}"
+    params_extra = (cutoff,) if extra_condition else ()
+    total = 0
+    with conn.cursor() as cursor:
+        for meter_no in meters:
+            if dry_run:
+                cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", (meter_no, cutoff) + params_extra)
+                total += cursor.fetchone()[0]
+                continue
+            sql = backend.delete_batch_sql(table, where, ("meter_no", key_column))
+            while True:
+                cursor.execute(sql, (meter_no, cutoff) + params_extra + (chunk_size,))
+                total += cursor.rowcount
+                if cursor.rowcount < chunk_size:
+                    break
+    if not total:
+        return []
+    return [f"{table}：{'将删除' if dry_run else '已删除'} {total} 行早于 {cutoff:%Y-%m-%d} 的数据"]
+
+
+def expire_raw_readings(conn, backend, meters, cutoff, chunk_size, archive=False, dry_run=False):
+    """清理早于 cutoff 的原始读数：分区表整区删除，未分区表分批 DELETE"""
+    if backend.supports_partitions and list_partitions(conn) is not None:
+        return drop_expired_partitions(conn, backend, cutoff, archive=archive, dry_run=dry_run)
+    actions = []
+    if archive:
+        actions.append("electricity_balance 未分区，RETENTION_ARCHIVE 仅对分区表生效，直接删除过期行")
+    # change_only 模式下一行可能一直确认到 cutoff 之后，这样的行保留
+    return actions + delete_expired_rows(
+        conn, backend, TABLE, "collected_at", meters, cutoff, chunk_size, dry_run=dry_run,
+        extra_condition=" AND (confirmed_at IS NULL OR confirmed_at < %s)",
+    )
@@ -0,0 +1,139 @@
+"""
+按设备自适应的抓取调度：每块表各自决定下一次抓取时间，定时任务每个 tick 只抓取已到期的设备。
+
+- 余额下降：按最近的耗电速度，使相邻两次读数之间约下降 target_step 元，限制在 [min_interval, max_interval]，
+  拉长时每次最多翻倍，缩短立即生效；
+- 余额接近 0（不高于 low_balance，或按当前速度一小时内用完）：使用 min_interval；
+- 余额持续不变（超过 base_interval 没有变化）：间隔逐次翻倍，最长 max_interval；
+- 抓取失败或页面无法解析：第 n 次连续失败后等待 base_interval × 2^(n-1)（最长 max_backoff），
+  在 [一半, 全部] 之间随机取值，避免故障设备同时重试；成功一次即恢复正常间隔。
+
+上游页面的余额每隔几分钟才更新一次，因此"不变"只在超过 base_interval 后才视为空闲，
+耗电速度按两次余额变化之间的时间计算，不受短间隔下重复读数的影响。
+正常间隔也加入 ±jitter 的随机比例，使各设备的抓取时间逐渐错开。
+"""
+import random
+import statistics
+import threading
+import time
+
+
+class DeviceState:
+    __slots__ = ("next_due", "interval", "failures", "remain", "changed_at", "rate", "last_outcome")
+
+    def __init__(self, next_due, interval):
+        self.next_due = next_due
+        self.interval = interval
+        self.failures = 0
+        self.remain = None       # 最近一次读数的余额
+        self.changed_at = None   # 余额最近一次变化（或首次读数）的采集时间
+        self.rate = None         # 耗电速度（元/小时），充值后重新估计
+        self.last_outcome = None
+
+
+class AdaptiveSchedule:
+    def __init__(self, base_interval, min_interval, max_interval, *, max_backoff=3600, low_balance=5.0,
+                 target_step=0.1, jitter=0.1, clock=time.monotonic, rng=None):
+        self.base_interval = base_interval
+        self.min_interval = min(min_interval, base_interval)
+        self.max_interval = max(max_interval, base_interval)
+        self.max_backoff = max(max_backoff, base_interval)
+        self.low_balance = low_balance
+        self.target_step = target_step
+        self.jitter = jitter
+        self.clock = clock
+        self._rng = rng or random.Random()
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, device_id, now):
+        state = self._states.get(device_id)
+        if state is None:
+            state = self._states[device_id] = DeviceState(now, self.base_interval)
+        return state
+
+    def due(self, device_ids, slack=0.0):
+        """device_ids 中已到期（next_due <= 当前时间 + slack）的设备，最早到期的排在前面；新设备立即到期"""
+        now = self.clock()
+        with self._lock:
+            for device_id in set(self._states) - set(device_ids):
+                del self._states[device_id]
+            states = [(self._state(device_id, now).next_due, device_id) for device_id in device_ids]
+        return [device_id for next_due, device_id in sorted(states) if next_due <= now + slack]
+
+    def _interval_after(self, state, remain, collected_at):
+        """由新读数更新耗电速度并返回下一次的间隔（秒）"""
+        previous, changed_at = state.remain, state.changed_at
+        state.remain = remain
+        if previous is None or changed_at is None or collected_at <= changed_at:
+            state.changed_at = collected_at
+            return self.min_interval if remain <= self.low_balance else self.base_interval
+
+        if remain > previous:
+            # 充值：之前的耗电速度不再适用
+            state.rate, state.changed_at = None, collected_at
+            interval = self.base_interval
+        elif remain < previous:
+            hours = (collected_at - changed_at).total_seconds() / 3600
+            rate = (previous - remain) / hours
+            # 速度上升立即采用，下降时与旧值平均
+            state.rate = rate if state.rate is None or rate > state.rate else (rate + state.rate) / 2
+            state.changed_at = collected_at
+            target = self.target_step / state.rate * 3600
+            interval = min(target, state.interval * 2, self.max_interval)
+        elif (collected_at - changed_at).total_seconds() >= self.base_interval:
+            # 超过一个基础间隔没有变化：视为空闲，逐次拉长
+            state.rate = None
+            interval = min(max(state.interval * 2, self.base_interval), self.max_interval)
+        else:
+            interval = state.interval
+
+        if remain <= self.low_balance or (state.rate and remain / state.rate < 1):
+            return self.min_interval
+        return max(interval, self.min_interval)
+
+    def record_success(self, device_id, remain, collected_at):
+        """记录一次成功的读数，返回下一次抓取前的等待秒数"""
+        now = self.clock()
+        with self._lock:
+            state = self._state(device_id, now)
+            state.failures = 0
+            state.last_outcome = "ok"
+            state.interval = self._interval_after(state, float(remain), collected_at)
+            # 加入抖动后仍不超过 max_interval（保证每小时至少一条读数）
+            delay = min(state.interval * self._rng.uniform(1 - self.jitter, 1 + self.jitter), self.max_interval)
+            state.next_due = now + delay
+            return delay
+
+    def record_failure(self, device_id, outcome="error"):
+        """记录一次失败（请求失败或无法解析），按连续失败次数指数退避，返回等待秒数"""
+        now = self.clock()
+        with self._lock:
+            state = self._state(device_id, now)
+            state.failures += 1
+            state.last_outcome = outcome
+            backoff = min(self.base_interval * 2 ** min(state.failures - 1, 20), self.max_backoff)
+            delay = self._rng.uniform(backoff / 2, backoff)
+            state.next_due = now + delay
+            return delay
+
+    def device_stats(self):
+        """{设备: (当前间隔秒, 连续失败次数)}"""
+        with self._lock:
+            return {device_id: (state.interval, state.failures) for device_id, state in self._states.items()}
+
+    def stats(self):
+        now = self.clock()
+        with self._lock:
+            states = list(self._states.values())
+        intervals = sorted(state.interval for state in states if not state.failures)
+        waits = [state.next_due - now for state in states]
+        return {
+            "devices": len(states),
+            "backing_off": sum(1 for state in states if state.failures),
+            "low_balance": sum(1 for state in states if state.remain is not None and state.remain <= self.low_balance),
+            "interval_min": round(intervals[0], 1) if intervals else None,
+            "interval_median": round(statistics.median(intervals), 1) if intervals else None,
+            "interval_max": round(intervals[-1], 1) if intervals else None,
+            "next_due_in": round(max(min(waits), 0), 1) if waits else None,
+        }
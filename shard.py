@@ -0,0 +1,221 @@
+"""
+多节点分片抓取：每块表的抓取权是数据库中的一条租约，各抓取节点按存活节点数平分设备。
+
+每个节点的后台线程每隔 lease_seconds / 3 秒执行一次 rebalance()：
+1. 在 electricity_scrape_node 写入心跳；心跳在 lease_seconds 内的节点视为存活，份额 = ceil(设备数 / 存活节点数)；
+2. 续期自己持有的租约（expires_at = 现在 + lease_seconds）；
+3. 持有超过份额时释放多出的租约（新节点加入后由它认领，释放的租约再保留 renew_interval 秒，等已开始的抓取完成）；
+   不足份额时认领无人持有或已过期的租约（节点停止心跳后，其租约最迟 lease_seconds 秒后过期，由其他节点接管）。
+
+认领是带条件的单条 UPDATE（WHERE 租约已过期），两个节点同时认领同一台设备时只有一个成功。
+节点只在本地确认的租约还剩至少 lease_seconds / 3 时才抓取该设备（owns()），
+即使续期失败，也会在租约在数据库中过期、被其他节点认领之前停止抓取，因此同一台设备不会被两个节点同时抓取。
+各节点的时钟需大致同步（误差应远小于 lease_seconds / 3）。
+"""
+import logging
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+NODE_TABLE = "electricity_scrape_node"
+LEASE_TABLE = "electricity_scrape_lease"
+# 新设备的租约以该时间为 expires_at，表示无人持有
+RELEASED_AT = datetime(2000, 1, 1)
+# 心跳超过 lease_seconds 的这么多倍后删除节点记录
+STALE_NODE_FACTOR = 10
+
+
+class LeaseCoordinator:
+    def __init__(self, pool, backend, node_id, device_ids, lease_seconds=90, clock=None, logger=None, rng=None):
+        self.pool = pool
+        self.backend = backend
+        self.node_id = node_id
+        self.device_ids = device_ids  # 返回当前设备表号列表的函数
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self._rng = rng or random.Random()
+        self._owned = {}  # 表号 -> 本地可抓取的截止时间（time.monotonic）
+        self._owned_lock = threading.Lock()
+        self._mutex = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.nodes = 0
+        self.share = 0
+        self._counters = {"rebalances": 0, "claimed": 0, "released": 0, "lost": 0, "errors": 0}
+
+    @property
+    def renew_interval(self):
+        return max(self.lease_seconds / 3, 1)
+
+    def owns(self, device_id):
+        """本节点是否可以抓取该设备（持有租约，且本地确认的剩余时间足够完成一次抓取）"""
+        with self._owned_lock:
+            deadline = self._owned.get(device_id)
+        return deadline is not None and time.monotonic() < deadline
+
+    def owned(self):
+        now = time.monotonic()
+        with self._owned_lock:
+            return sorted(device_id for device_id, deadline in self._owned.items() if now < deadline)
+
+    def rebalance(self):
+        """心跳、续期、按份额释放或认领租约，返回本节点持有的表号"""
+        with self._mutex:
+            if self._stop.is_set():
+                return []
+            return self._rebalance()
+
+    def _rebalance(self):
+        device_ids = set(self.device_ids())
+        # 先取本地时间：数据库中的租约不会早于本地截止时间过期
+        started = time.monotonic()
+        now = self.clock().replace(microsecond=0)
+        expires = now + timedelta(seconds=self.lease_seconds)
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                self.backend.upsert_sql(NODE_TABLE, ("node_id", "heartbeat_at"), ("node_id",)), (self.node_id, now)
+            )
+            cursor.execute(
+                f"DELETE FROM {NODE_TABLE} WHERE heartbeat_at < %s",
+                (now - timedelta(seconds=self.lease_seconds * STALE_NODE_FACTOR),),
+            )
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {NODE_TABLE} WHERE heartbeat_at >= %s",
+                (now - timedelta(seconds=self.lease_seconds),),
+            )
+            self.nodes = max(cursor.fetchone()[0], 1)
+            self.share = math.ceil(len(device_ids) / self.nodes)
+
+            cursor.execute(f"SELECT device_id, owner, expires_at FROM {LEASE_TABLE}")
+            leases = {device_id: (owner, expires_at) for device_id, owner, expires_at in cursor.fetchall()}
+            removed = [device_id for device_id, (_, expires_at) in leases.items()
+                       if device_id not in device_ids and expires_at < now]
+            if removed:
+                # 已从登记表删除的设备（其他节点的设备列表较新时会重新补齐，无害）
+                cursor.executemany(
+                    f"DELETE FROM {LEASE_TABLE} WHERE device_id = %s AND expires_at < %s",
+                    [(device_id, now) for device_id in removed],
+                )
+            missing = sorted(device_ids - set(leases))
+            if missing:
+                # 多个节点同时补齐时保持已有的租约不变
+                cursor.executemany(
+                    self.backend.upsert_sql(
+                        LEASE_TABLE, ("device_id", "owner", "expires_at"), ("device_id",),
+                        {"owner": "owner", "expires_at": "expires_at"},
+                    ),
+                    [(device_id, "", RELEASED_AT) for device_id in missing],
+                )
+
+            held = sorted(
+                device_id for device_id, (owner, expires_at) in leases.items()
+                if owner == self.node_id and expires_at > now
+            )
+            # 已删除的设备，以及超出份额的设备（保留表号靠前的，使各节点的分配尽量稳定）
+            keep = [device_id for device_id in held if device_id in device_ids][: self.share]
+            release = [device_id for device_id in held if device_id not in keep]
+            if keep:
+                cursor.executemany(
+                    f"UPDATE {LEASE_TABLE} SET expires_at = %s WHERE device_id = %s AND owner = %s",
+                    [(expires, device_id, self.node_id) for device_id in keep],
+                )
+            if release:
+                self._release(cursor, release, now)
+
+            wanted = self.share - len(keep)
+            if wanted > 0:
+                free = [
+                    device_id for device_id in device_ids - set(keep)
+                    if device_id not in leases or leases[device_id][1] < now
+                ]
+                # 随机顺序认领，减少多个节点争抢同一批设备
+                self._rng.shuffle(free)
+                for device_id in free:
+                    if wanted <= 0:
+                        break
+                    cursor.execute(
+                        f"UPDATE {LEASE_TABLE} SET owner = %s, expires_at = %s WHERE device_id = %s AND expires_at < %s",
+                        (self.node_id, expires, device_id, now),
+                    )
+                    if cursor.rowcount:
+                        wanted -= 1
+                        self._counters["claimed"] += 1
+
+            # 以本轮写入的 expires_at 确认实际持有的租约（续期前刚好过期并被其他节点认领的不算）
+            cursor.execute(f"SELECT device_id FROM {LEASE_TABLE} WHERE owner = %s AND expires_at = %s",
+                           (self.node_id, expires))
+            keep = sorted(row[0] for row in cursor.fetchall())
+
+        deadline = started + self.lease_seconds - self.renew_interval
+        with self._owned_lock:
+            lost = set(self._owned) - set(keep)
+            self._owned = {device_id: deadline for device_id in keep}
+        if lost:
+            self._counters["lost"] += len(lost)
+            self.logger.warning("抓取租约已被其他节点接管: %s", ", ".join(sorted(lost)))
+        self._counters["rebalances"] += 1
+        return keep
+
+    def _release(self, cursor, device_ids, now):
+        """
+        放弃租约：本地立即停止抓取，数据库中再保留 renew_interval 秒，
+        让已经开始的抓取在其他节点认领之前完成（renew_interval 应大于单个设备抓取的最长耗时）。
+        """
+        with self._owned_lock:
+            for device_id in device_ids:
+                self._owned.pop(device_id, None)
+        cursor.executemany(
+            f"UPDATE {LEASE_TABLE} SET owner = '', expires_at = %s WHERE device_id = %s AND owner = %s",
+            [(now + timedelta(seconds=self.renew_interval), device_id, self.node_id) for device_id in device_ids],
+        )
+        self._counters["released"] += len(device_ids)
+
+    def release_all(self):
+        """释放全部租约并删除心跳（正常退出时调用，其他节点最迟 renew_interval 秒后接管）"""
+        now = self.clock().replace(microsecond=0)
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"SELECT device_id FROM {LEASE_TABLE} WHERE owner = %s", (self.node_id,))
+            self._release(cursor, [row[0] for row in cursor.fetchall()], now)
+            cursor.execute(f"DELETE FROM {NODE_TABLE} WHERE node_id = %s", (self.node_id,))
+        with self._owned_lock:
+            self._owned = {}
+
+    def _rebalance_logged(self):
+        try:
+            self.rebalance()
+        except Exception as exc:
+            self._counters["errors"] += 1
+            self.logger.warning("抓取租约续期失败: %s", exc)
+
+    def _run(self):
+        while not self._stop.wait(self.renew_interval):
+            self._rebalance_logged()
+
+    def start(self):
+        """立即认领一次，然后在守护线程中定期续期与再平衡"""
+        if self._thread is None:
+            self._rebalance_logged()
+            self._thread = threading.Thread(target=self._run, name="scrape-shard", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._mutex:
+            try:
+                self.release_all()
+            except Exception as exc:
+                self.logger.warning("释放抓取租约失败: %s", exc)
+
+    def stats(self):
+        return {
+            "node": self.node_id,
+            "lease_seconds": self.lease_seconds,
+            "nodes": self.nodes,
+            "share": self.share,
+            "owned": len(self.owned()),
+            **self._counters,
+        }
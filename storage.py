@@ -0,0 +1,436 @@
+"""
+存储后端：MySQL（pymysql）与嵌入式 SQLite（WAL）。
+
+读数查询（queries.py）只使用两者共有的 SQL 子集（%s 占位符、UNION ALL、JOIN 子查询、LIMIT），
+在两种后端上原样执行；后端负责其余与方言相关的部分：
+- connect()：返回具备 pymysql 常用接口的连接（cursor()/execute/executemany/fetch*/ping/close），
+  dict_cursor(conn) 返回按列名取值的游标；
+- upsert_sql() / insert_readings()：按主键/唯一键覆盖写入（读数、汇总行、充值记录）；
+- delete_batch_sql()：分批删除（MySQL DELETE ... LIMIT，SQLite 按主键子查询）；
+- schema()：派生表 DDL 的方言转换，SQLite 还负责创建 electricity_balance 本身；
+- ensure_column()：补齐新增列；
+- acquire_lock()：进程间互斥锁（后台任务选主），MySQL 使用 GET_LOCK，SQLite 使用数据库旁的文件锁；
+- disconnect_errors：连接池据此丢弃失效连接。
+
+create_backend() 按 DB_BACKEND 环境变量选择后端，MySQL 的连接参数只在选择 MySQL 时才是必填项。
+"""
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+READING_COLUMNS = ("meter_no", "remain", "collected_at", "confirmed_at")
+READING_KEY = ("meter_no", "collected_at")
+# 重复写入同一读数时：余额覆盖；confirmed_at 取较晚者，新值为 NULL 时保留原值
+READING_UPDATES = {
+    "remain": "{new}",
+    "confirmed_at": "COALESCE({greatest}(confirmed_at, {new}), {new}, confirmed_at)",
+}
+
+
+class StorageBackend:
+    """存储后端接口，子类实现连接与方言相关的方法"""
+
+    name = None
+    supports_partitions = False
+    disconnect_errors = ()
+
+    def connect(self):
+        raise NotImplementedError
+
+    def dict_cursor(self, conn):
+        raise NotImplementedError
+
+    def describe(self):
+        """用于启动日志与 /stats 的简要说明（不含密码）"""
+        raise NotImplementedError
+
+    def schema(self, statements):
+        """把 MySQL 方言的建表语句转换为本后端可执行的语句列表"""
+        return list(statements)
+
+    def ensure_column(self, cursor, table, column, definition):
+        """列不存在时补齐（幂等）"""
+        raise NotImplementedError
+
+    # 方言片段
+    def _new_value(self, column):
+        raise NotImplementedError
+
+    _greatest = "GREATEST"
+
+    def _conflict_clause(self, key_columns):
+        raise NotImplementedError
+
+    def upsert_sql(self, table, columns, key_columns, updates=None):
+        """
+        按主键覆盖写入的 INSERT 语句。updates 为 {列: 表达式模板}，模板中 {new} 表示本次写入的值、
+        {greatest} 表示取较大值的函数；未列出的非键列直接用新值覆盖。
+        """
+        updates = updates or {}
+        assignments = []
+        for column in columns:
+            if column in key_columns:
+                continue
+            template = updates.get(column, "{new}")
+            expression = template.format(new=self._new_value(column), greatest=self._greatest)
+            assignments.append(f"{column}={expression}")
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"{self._conflict_clause(key_columns)} {', '.join(assignments)}"
+        )
+
+    def insert_readings(self, cursor, rows):
+        """批量写入读数 [(meter_no, remain, collected_at, confirmed_at), ...]"""
+        if rows:
+            cursor.executemany(self.upsert_sql("electricity_balance", READING_COLUMNS, READING_KEY, READING_UPDATES), rows)
+
+    def delete_batch_sql(self, table, where, key_columns):
+        """删除满足 where 的至多 %s 行（最后一个参数为行数上限）"""
+        raise NotImplementedError
+
+    def acquire_lock(self, name):
+        """
+        不等待地获取名为 name 的进程间锁：成功返回锁对象（held() 检查是否仍持有，release() 释放），
+        已被其他进程持有时返回 None。持有锁的进程退出或与数据库断开后，锁自动释放。
+        """
+        raise NotImplementedError
+
+
+# -----------------------
+# MySQL
+# -----------------------
+class MySQLLock:
+    """GET_LOCK 命名锁：绑定在一个独占连接的会话上，连接断开即释放"""
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+
+    def held(self):
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (self.name,))
+                row = cursor.fetchone()
+            return bool(row and row[0])
+        except Exception:
+            return False
+
+    def release(self):
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (self.name,))
+        except Exception:
+            pass
+        finally:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+
+
+class MySQLBackend(StorageBackend):
+    name = "mysql"
+    supports_partitions = True
+
+    def __init__(self, config):
+        import pymysql
+
+        self._pymysql = pymysql
+        self.config = dict(config)
+        self.disconnect_errors = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+    def connect(self):
+        return self._pymysql.connect(**self.config)
+
+    def dict_cursor(self, conn):
+        return conn.cursor(self._pymysql.cursors.DictCursor)
+
+    def describe(self):
+        return f"mysql://{self.config['user']}@{self.config['host']}:{self.config['port']}/{self.config['database']}"
+
+    def ensure_column(self, cursor, table, column, definition):
+        try:
+            cursor.execute(f"SELECT {column} FROM {table} LIMIT 0")
+        except self._pymysql.err.OperationalError:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _new_value(self, column):
+        return f"VALUES({column})"
+
+    def _conflict_clause(self, key_columns):
+        return "ON DUPLICATE KEY UPDATE"
+
+    def delete_batch_sql(self, table, where, key_columns):
+        return f"DELETE FROM {table} WHERE {where} LIMIT %s"
+
+    def acquire_lock(self, name):
+        # 锁名在整个 MySQL 实例内共享（最长 64 字符），加上库名区分同一实例上的多套部署
+        lock_name = f"{self.config['database']}.{name}"[:64]
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (lock_name,))
+                row = cursor.fetchone()
+        except Exception:
+            conn.close()
+            raise
+        if row and row[0] == 1:
+            return MySQLLock(conn, lock_name)
+        conn.close()
+        return None
+
+
+# -----------------------
+# SQLite（单机嵌入式）
+# -----------------------
+# 按列名把 TEXT 还原为 datetime/date，与 pymysql 返回的类型一致（聚合列通过别名命名即可）
+_DATETIME_COLUMNS = frozenset(("collected_at", "confirmed_at", "first_at", "last_at", "hour_start", "recharged_at",
+                               "heartbeat_at", "expires_at", "updated_at"))
+_DATE_COLUMNS = frozenset(("day",))
+
+sqlite3.register_adapter(datetime, lambda value: value.strftime("%Y-%m-%d %H:%M:%S"))
+sqlite3.register_adapter(date, lambda value: value.strftime("%Y-%m-%d"))
+sqlite3.register_adapter(Decimal, float)
+
+# 原始读数表以 (meter_no, collected_at) 为聚簇主键（WITHOUT ROWID），读数查询全部是主键上的范围查找，
+# 且主键即包含全部列，相当于覆盖索引
+SQLITE_BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS electricity_balance (
+      meter_no TEXT NOT NULL,
+      collected_at DATETIME NOT NULL,
+      confirmed_at DATETIME NULL,
+      remain DECIMAL(10,2) NOT NULL,
+      PRIMARY KEY (meter_no, collected_at)
+    ) WITHOUT ROWID
+"""
+
+
+@lru_cache(maxsize=256)
+def _to_qmark(sql):
+    """pymysql 风格的 %s 占位符转换为 sqlite3 的 ?"""
+    return sql.replace("%s", "?").replace("%%", "%")
+
+
+def _converter(name):
+    if name in _DATETIME_COLUMNS:
+        return lambda value: datetime.fromisoformat(value) if isinstance(value, str) else value
+    if name in _DATE_COLUMNS:
+        return lambda value: date.fromisoformat(value[:10]) if isinstance(value, str) else value
+    return None
+
+
+class SQLiteCursor:
+    """pymysql 游标接口的子集；executemany 在单个事务中执行（批量写入只提交一次）"""
+
+    def __init__(self, conn, dict_rows=False):
+        self._conn = conn
+        self._cursor = conn.raw.cursor()
+        self._dict = dict_rows
+        self._names = ()
+        self._converters = ()
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        self._cursor.execute(_to_qmark(sql), tuple(params or ()))
+        self.rowcount = self._cursor.rowcount
+        description = self._cursor.description or ()
+        self._names = tuple(column[0] for column in description)
+        self._converters = tuple(
+            (index, fn) for index, fn in ((i, _converter(name)) for i, name in enumerate(self._names)) if fn
+        )
+        return self.rowcount
+
+    def executemany(self, sql, seq_of_params):
+        raw = self._conn.raw
+        own_transaction = not raw.in_transaction
+        if own_transaction:
+            raw.execute("BEGIN IMMEDIATE")
+        try:
+            self._cursor.executemany(_to_qmark(sql), [tuple(params) for params in seq_of_params])
+            if own_transaction:
+                raw.execute("COMMIT")
+        except Exception:
+            if own_transaction and raw.in_transaction:
+                raw.execute("ROLLBACK")
+            raise
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def _row(self, row):
+        if row is None:
+            return None
+        if self._converters:
+            row = list(row)
+            for index, fn in self._converters:
+                row[index] = fn(row[index])
+        if self._dict:
+            return dict(zip(self._names, row))
+        return tuple(row)
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteConnection:
+    """单个 sqlite3 连接（自动提交模式），接口与连接池使用的 pymysql 连接一致"""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def cursor(self, dict_rows=False):
+        return SQLiteCursor(self, dict_rows=dict_rows)
+
+    def ping(self, reconnect=False):
+        self.raw.execute("SELECT 1")
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def close(self):
+        self.raw.close()
+
+
+class FileLock:
+    """flock 文件锁：持有文件描述符期间有效，进程退出时由操作系统释放"""
+
+    def __init__(self, fd, path):
+        self.fd = fd
+        self.path = path
+
+    def held(self):
+        return self.fd is not None
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    单文件嵌入式存储：WAL 日志（读写互不阻塞）、synchronous=NORMAL（WAL 下仍能保证崩溃一致性）、
+    内存临时表与 mmap 读取；写锁冲突时最多等待 busy_timeout 毫秒。
+    """
+
+    name = "sqlite"
+    disconnect_errors = (sqlite3.ProgrammingError, sqlite3.InterfaceError)
+
+    def __init__(self, path, busy_timeout=5000, cache_mb=16, mmap_mb=256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cache_mb = cache_mb
+        self.mmap_mb = mmap_mb
+        self._init_lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def connect(self):
+        raw = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, isolation_level=None, check_same_thread=False)
+        with self._init_lock:
+            # journal_mode 写入数据库文件头，多个连接同时切换时串行执行
+            raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+        raw.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        raw.execute(f"PRAGMA cache_size=-{int(self.cache_mb) * 1024}")
+        raw.execute(f"PRAGMA mmap_size={int(self.mmap_mb) * 1024 * 1024}")
+        raw.execute("PRAGMA temp_store=MEMORY")
+        return SQLiteConnection(raw)
+
+    def dict_cursor(self, conn):
+        return conn.cursor(dict_rows=True)
+
+    def describe(self):
+        return f"sqlite://{os.path.abspath(self.path)}"
+
+    def schema(self, statements):
+        converted = [SQLITE_BASE_SCHEMA]
+        for statement in statements:
+            body = statement.strip()
+            rowid = "AUTO_INCREMENT" in body
+            # 自增主键需要 rowid 表
+            body = body.replace("BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+            engine = body.rfind(") ENGINE=")
+            if engine != -1:
+                body = body[: engine + 1] + ("" if rowid else " WITHOUT ROWID")
+            converted.append(body)
+        return converted
+
+    def ensure_column(self, cursor, table, column, definition):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition.split(' AFTER ')[0]}")
+
+    _greatest = "MAX"
+
+    def _new_value(self, column):
+        return f"excluded.{column}"
+
+    def _conflict_clause(self, key_columns):
+        return f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET"
+
+    def delete_batch_sql(self, table, where, key_columns):
+        keys = ", ".join(key_columns)
+        return f"DELETE FROM {table} WHERE ({keys}) IN (SELECT {keys} FROM {table} WHERE {where} LIMIT %s)"
+
+    def acquire_lock(self, name):
+        # SQLite 只能被同一台机器上的进程共享，数据库文件旁的文件锁即可互斥
+        import fcntl
+
+        path = f"{os.path.abspath(self.path)}.{name}.lock"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return FileLock(fd, path)
+
+
+def create_backend(require_env, cast_int):
+    """
+    按环境变量创建后端：DB_BACKEND=mysql（默认）时 DB_HOST 等连接参数必填；
+    DB_BACKEND=sqlite 时只需 SQLITE_PATH（默认 data/electricity.db）。
+    """
+    backend = os.getenv("DB_BACKEND", "mysql").split("#", 1)[0].strip().lower()
+    if backend == "sqlite":
+        return SQLiteBackend(
+            os.getenv("SQLITE_PATH", "data/electricity.db").split("#", 1)[0].strip(),
+            busy_timeout=cast_int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        )
+    if backend != "mysql":
+        raise RuntimeError(f"Invalid value for DB_BACKEND: {backend}")
+    return MySQLBackend({
+        "host": require_env("DB_HOST"),
+        "port": require_env("DB_PORT", cast=cast_int),
+        "user": require_env("DB_USER"),
+        "password": require_env("DB_PASSWORD"),
+        "database": require_env("DB_NAME"),
+        "charset": require_env("DB_CHARSET"),
+        "autocommit": True,
+        "connect_timeout": cast_int(os.getenv("DB_CONNECT_TIMEOUT", "5")),
+        "read_timeout": cast_int(os.getenv("DB_READ_TIMEOUT", "10")),
+        "write_timeout": cast_int(os.getenv("DB_WRITE_TIMEOUT", "10")),
+    })
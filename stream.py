@@ -0,0 +1,287 @@
+"""
+实时推送：Server-Sent Events（SSE）集线器，把新入库的读数推送给打开页面的浏览器。
+
+Flask 开发服务器每个连接占用一个线程，长连接会很快耗尽线程。因此集线器在一个守护线程中运行
+独立的 asyncio 事件循环，单独监听一个端口（GET /stream?device_id=表号）：
+- 每个客户端只是事件循环中的一个协程加一个写缓冲，空闲连接几乎没有开销；
+- 抓取、写入线程调用 publish()，经 call_soon_threadsafe 交给事件循环，按表号广播给订阅者；
+- 每隔 keepalive 秒发送一行注释，防止代理与浏览器把空闲连接当作超时关闭；
+- 写缓冲超过 max_buffer 字节的慢客户端直接断开，浏览器的 EventSource 会自动重连。
+reuse_port=True 时以 SO_REUSEPORT 监听，WSGI 服务器的多个工作进程可共用同一端口，由内核分配连接。
+
+推送服务与监控页面端口不同，浏览器按跨域请求处理：只对允许的页面来源返回 Access-Control-Allow-Origin，
+其他网站的页面无法读取推送内容。
+"""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+MAX_REQUEST_HEADERS = 64
+HEADER_TIMEOUT = 10
+
+
+def _hostname(url):
+    """URL（或 //主机:端口）中的主机名，无法解析时为 None"""
+    try:
+        return urlsplit(url).hostname
+    except ValueError:
+        return None
+
+
+def format_event(event, data, event_id=None):
+    """一条 SSE 消息（data 为可 JSON 序列化的对象）"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class StreamHub:
+    """
+    按表号订阅的 SSE 服务。is_known(device_id) 用于拒绝未配置的表号（返回 404）；
+    max_clients 为同时在线的连接上限，超过时返回 503 并带 Retry-After。
+    allow_origins 为允许跨域读取推送的页面来源（如 http://example.com:9136），含 "*" 时允许任意来源；
+    为空时只允许与推送服务主机名相同的页面（同一主机上其他端口的监控页面）。
+    """
+
+    def __init__(self, host="0.0.0.0", port=5001, *, is_known=None, keepalive=25, retry_ms=5000,
+                 max_clients=1000, max_buffer=256 * 1024, allow_origins=(), reuse_port=False):
+        self.host = host
+        self.port = port
+        self.is_known = is_known
+        self.keepalive = keepalive
+        self.retry_ms = retry_ms
+        self.max_clients = max_clients
+        self.max_buffer = max_buffer
+        self.allow_origins = tuple(origin.rstrip("/") for origin in allow_origins)
+        self.reuse_port = reuse_port
+        self._subscribers = {}  # 表号 -> {StreamWriter, ...}，只在事件循环线程中修改
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+        self._counters = {"connected": 0, "rejected": 0, "published": 0, "sent": 0, "dropped_slow": 0}
+
+    @property
+    def running(self):
+        return self._loop is not None and self._server is not None
+
+    # ---- 供其他线程调用 ----
+    def start(self, timeout=5):
+        """在守护线程中启动事件循环并监听端口；端口被占用等错误直接抛出"""
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name="stream-hub", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        if self._error is not None:
+            self._thread = None
+            raise self._error
+        return self
+
+    def stop(self, timeout=5):
+        loop = self._loop
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def has_subscribers(self, device_id):
+        # 只读一次字典，无需加锁：最坏情况是刚断开的连接多算一次查询
+        return bool(self._subscribers.get(device_id))
+
+    def publish(self, device_id, event, data, event_id=None):
+        """把一条消息广播给订阅 device_id 的全部连接（可在任意线程调用，不阻塞）"""
+        loop = self._loop
+        if loop is None or not self.has_subscribers(device_id):
+            return
+        message = format_event(event, data, event_id)
+        with self._lock:
+            self._counters["published"] += 1
+        try:
+            loop.call_soon_threadsafe(self._broadcast, device_id, message)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def stats(self):
+        subscribers = dict(self._subscribers)
+        with self._lock:
+            return {
+                "port": self.port,
+                "running": self.running,
+                "clients": sum(len(writers) for writers in subscribers.values()),
+                "devices": sum(1 for writers in subscribers.values() if writers),
+                **self._counters,
+            }
+
+    # ---- 事件循环线程 ----
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, reuse_address=True,
+                                     reuse_port=self.reuse_port or None)
+            )
+            if not self.port:
+                self.port = self._server.sockets[0].getsockname()[1]
+        except OSError as exc:
+            self._error = exc
+            self._ready.set()
+            loop.close()
+            return
+        self._loop = loop
+        loop.create_task(self._keepalive())
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            for writers in self._subscribers.values():
+                for writer in writers:
+                    writer.transport.abort()
+            # 结束保活任务与各连接的协程后再关闭事件循环
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._subscribers.clear()
+            self._loop = None
+            self._server = None
+            loop.close()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _send(self, device_id, writer, message):
+        """写入一条消息；写缓冲积压过多（客户端读得太慢）时断开连接"""
+        if writer.transport.is_closing():
+            return
+        writer.write(message)
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            self._count("dropped_slow")
+            writer.transport.abort()
+            self._subscribers.get(device_id, set()).discard(writer)
+
+    def _broadcast(self, device_id, message):
+        writers = list(self._subscribers.get(device_id, ()))
+        for writer in writers:
+            self._send(device_id, writer, message)
+        self._count("sent", len(writers))
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.keepalive)
+            for device_id, writers in list(self._subscribers.items()):
+                for writer in list(writers):
+                    self._send(device_id, writer, b": ping\n\n")
+
+    def _client_count(self):
+        return sum(len(writers) for writers in self._subscribers.values())
+
+    async def _read_request(self, reader):
+        """读取请求行与请求头，返回 (方法, 路径, 查询参数, {小写头名: 值})；格式错误时返回 None"""
+        request_line = await reader.readline()
+        headers = {}
+        for _ in range(MAX_REQUEST_HEADERS):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return None
+        parts = urlsplit(target)
+        return method, parts.path, parse_qs(parts.query), headers
+
+    def _cors_headers(self, headers):
+        """请求来源允许跨域读取时的响应头；同源请求（没有 Origin）与不允许的来源不返回"""
+        origin = headers.get("origin", "").rstrip("/")
+        if not origin:
+            return ()
+        if "*" in self.allow_origins:
+            return ("Access-Control-Allow-Origin: *",)
+        if self.allow_origins:
+            allowed = origin in self.allow_origins
+        else:
+            allowed = _hostname(origin) is not None and _hostname(origin) == _hostname("//" + headers.get("host", ""))
+        return (f"Access-Control-Allow-Origin: {origin}", "Vary: Origin") if allowed else ("Vary: Origin",)
+
+    def _respond(self, writer, status, body="", extra_headers=()):
+        payload = body.encode("utf-8")
+        headers = [
+            f"HTTP/1.1 {status}",
+            "Content-Type: text/plain; charset=utf-8",
+            f"Content-Length: {len(payload)}",
+            "Connection: close",
+            *extra_headers,
+        ]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + payload)
+
+    async def _handle(self, reader, writer):
+        device_id = None
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader), HEADER_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.LimitOverrunError, ValueError):
+                request = None
+            if request is None:
+                self._respond(writer, "400 Bad Request", "bad request")
+                return
+            method, path, query, request_headers = request
+            cors = self._cors_headers(request_headers)
+            if method != "GET" or path.rstrip("/") != "/stream":
+                self._respond(writer, "404 Not Found", "not found", cors)
+                return
+            device_id = (query.get("device_id") or [""])[0]
+            if not device_id or (self.is_known is not None and not self.is_known(device_id)):
+                self._count("rejected")
+                self._respond(writer, "404 Not Found", "unknown device_id", cors)
+                device_id = None
+                return
+            if self._client_count() >= self.max_clients:
+                self._count("rejected")
+                self._respond(writer, "503 Service Unavailable", "too many clients",
+                              (f"Retry-After: {max(self.retry_ms // 1000, 1)}", *cors))
+                device_id = None
+                return
+
+            headers = (
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: text/event-stream; charset=utf-8\r\n"
+                "Cache-Control: no-cache\r\n"
+                "Connection: keep-alive\r\n"
+                "X-Accel-Buffering: no\r\n"
+                + "".join(f"{line}\r\n" for line in cors)
+                + "\r\n"
+            )
+            writer.write(headers.encode("latin-1") + f"retry: {self.retry_ms}\n\n".encode("ascii"))
+            self._subscribers.setdefault(device_id, set()).add(writer)
+            self._count("connected")
+            # 客户端不会再发送数据：读到 EOF 即表示连接已关闭
+            while await reader.read(1024):
+                pass
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass  # 客户端断开，或推送服务停止时取消
+        finally:
+            if device_id is not None:
+                writers = self._subscribers.get(device_id)
+                if writers is not None:
+                    writers.discard(writer)
+                    if not writers:
+                        del self._subscribers[device_id]
+            try:
+                writer.close()
+            except Exception:
+                pass
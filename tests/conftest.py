@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main 在导入时按环境变量创建存储后端：测试进程固定使用临时 SQLite 库，不读写 .env 中的数据库，
+# 需要 MySQL 的测试自行按 DB_HOST 等变量连接（见 test_storage.py）
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="electricity-tests-"), "main.db")
+os.environ.setdefault("STREAM_PORT", "0")
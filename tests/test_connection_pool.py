@@ -0,0 +1,146 @@
+"""ConnectionPool：池满时等待与超时、连接最大存活时间、借出时健康检查失败的连接被丢弃"""
+import threading
+import time
+
+import pytest
+
+from main import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    def __init__(self, backend):
+        self.backend = backend
+        self.closed = False
+
+    def ping(self, reconnect=False):
+        if self.backend.ping_fails:
+            raise ConnectionError("gone away")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBackend:
+    disconnect_errors = (ConnectionError,)
+
+    def __init__(self):
+        self.ping_fails = False
+        self.opened = []
+
+    def connect(self):
+        conn = FakeConnection(self)
+        self.opened.append(conn)
+        return conn
+
+
+def test_prefill_and_reuse():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, min_size=2, max_size=4)
+    pool.prefill()
+    assert pool.stats()["size"] == 2 and pool.stats()["idle"] == 2
+    for _ in range(5):
+        with pool.connection():
+            pass
+    assert len(backend.opened) == 2
+    assert pool.stats()["borrowed"] == 5
+
+
+def test_max_size_blocks_until_release():
+    pool = ConnectionPool(FakeBackend(), min_size=0, max_size=1, wait_timeout=5)
+    held = pool.acquire()
+    borrowed = []
+    waiter = threading.Thread(target=lambda: borrowed.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    assert not borrowed
+    pool.release(held)
+    waiter.join(timeout=5)
+    assert borrowed and borrowed[0].wrapped is held.wrapped
+    stats = pool.stats()
+    assert (stats["size"], stats["waited"], stats["timeouts"]) == (1, 1, 0)
+
+
+def test_wait_timeout_raises():
+    pool = ConnectionPool(FakeBackend(), min_size=0, max_size=1, wait_timeout=0.1)
+    pool.acquire()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    assert time.monotonic() - started >= 0.1
+    stats = pool.stats()
+    assert (stats["size"], stats["in_use"], stats["timeouts"]) == (1, 1, 1)
+
+
+def test_expired_connection_is_replaced():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, min_size=0, max_size=2, max_lifetime=0.05)
+    with pool.connection() as conn:
+        first = conn.wrapped
+    time.sleep(0.1)
+    # 空闲期间过期：借出时关闭并新建
+    with pool.connection() as conn:
+        assert conn.wrapped is not first
+    assert first.closed
+    stats = pool.stats()
+    assert (stats["created"], stats["expired"], stats["size"]) == (2, 1, 1)
+
+
+def test_expired_on_release_is_closed():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, min_size=0, max_size=2, max_lifetime=0.05)
+    conn = pool.acquire()
+    time.sleep(0.1)
+    pool.release(conn)
+    assert conn.wrapped.closed
+    assert (pool.stats()["size"], pool.stats()["idle"]) == (0, 0)
+
+
+def test_failed_health_check_discards_connection():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, min_size=1, max_size=2)
+    pool.prefill()
+    backend.ping_fails = True
+    with pool.connection() as conn:
+        # ping 失败的连接被关闭，借出的是新建的连接（新连接不再 ping）
+        assert conn.wrapped is backend.opened[1]
+    assert backend.opened[0].closed
+    stats = pool.stats()
+    assert (stats["health_check_failures"], stats["closed"], stats["size"]) == (1, 1, 1)
+
+
+def test_disconnect_error_discards_connection():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, min_size=0, max_size=2)
+    with pytest.raises(ConnectionError):
+        with pool.connection():
+            raise ConnectionError("lost")
+    assert backend.opened[0].closed
+    assert (pool.stats()["size"], pool.stats()["closed"]) == (0, 1)
+
+
+def test_counters_consistent_under_concurrency():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, min_size=0, max_size=3, max_lifetime=0.002, wait_timeout=10)
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(200):
+                backend.ping_fails = (n + i) % 7 == 0
+                with pool.connection():
+                    time.sleep(0.0005)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    stats = pool.stats()
+    assert stats["in_use"] == 0 and stats["size"] <= pool.max_size
+    assert stats["created"] - stats["closed"] == stats["size"]
+    assert stats["closed"] == sum(conn.closed for conn in backend.opened)
+    assert stats["expired"] + stats["health_check_failures"] <= stats["closed"]
+    assert stats["borrowed"] == 6 * 200
@@ -0,0 +1,103 @@
+"""DeviceCache：按表号失效、计算期间失效的结果不入缓存、按字节数淘汰、历史日期条目的保留与强制清除"""
+from main import DeviceCache
+
+
+def fill(cache, device_id, key, value, immutable=False):
+    return cache.get_or_compute(device_id, key, lambda: value, immutable=immutable)
+
+
+def cached(cache, device_id, key):
+    """条目仍在缓存中时返回 True（不会重新计算）"""
+    return cache.get_or_compute(device_id, key, lambda: "recomputed") != "recomputed"
+
+
+def test_hit_skips_compute():
+    cache = DeviceCache(max_bytes=1 << 20)
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_compute("a", ("day", "2024-05-01"), lambda: calls.append(1) or {"usage": 1}) == {"usage": 1}
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+    assert cache.kind_stats() == {("day", "hit"): 2, ("day", "miss"): 1}
+
+
+def test_invalidate_only_touches_one_device():
+    cache = DeviceCache(max_bytes=1 << 20)
+    fill(cache, "a", ("day", "today"), 1)
+    fill(cache, "a", ("kpi",), 2)
+    fill(cache, "b", ("day", "today"), 3)
+    cache.invalidate("a")
+    assert not cached(cache, "a", ("day", "today"))
+    assert not cached(cache, "a", ("kpi",))
+    assert cached(cache, "b", ("day", "today"))
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_immutable_entries_survive_invalidate_unless_included():
+    cache = DeviceCache(max_bytes=1 << 20)
+    fill(cache, "a", ("day", "2024-05-01"), "closed day", immutable=True)
+    fill(cache, "a", ("day", "today"), "today")
+    cache.invalidate("a")
+    assert cached(cache, "a", ("day", "2024-05-01"))
+    assert not cached(cache, "a", ("day", "today"))
+    # 补录历史读数：历史日期的结果也要清除
+    cache.invalidate("a", include_immutable=True)
+    assert not cached(cache, "a", ("day", "2024-05-01"))
+
+
+def test_invalidate_during_compute_is_not_cached():
+    cache = DeviceCache(max_bytes=1 << 20)
+
+    def compute():
+        # 查询进行中该表号有新读数入库
+        cache.invalidate("a")
+        return "stale"
+
+    assert cache.get_or_compute("a", ("kpi",), compute) == "stale"
+    assert cache.stats()["entries"] == 0
+    assert cache.get_or_compute("a", ("kpi",), lambda: "fresh") == "fresh"
+    assert cached(cache, "a", ("kpi",))
+
+
+def test_invalidate_other_device_during_compute_still_caches():
+    cache = DeviceCache(max_bytes=1 << 20)
+
+    def compute():
+        cache.invalidate("b")
+        return "value"
+
+    cache.get_or_compute("a", ("kpi",), compute)
+    assert cached(cache, "a", ("kpi",))
+
+
+def test_byte_bound_evicts_least_recently_used():
+    value = "x" * 400
+    size = DeviceCache._estimate_size(("a", ("day", 0)), value)
+    cache = DeviceCache(max_bytes=size * 3)
+    for i in range(3):
+        fill(cache, "a", ("day", i), value)
+    assert cached(cache, "a", ("day", 0))  # 0 变为最近使用，下一次淘汰 1
+    fill(cache, "a", ("day", 3), value)
+    stats = cache.stats()
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["entries"] == 3 and stats["evictions"] == 1
+    assert cached(cache, "a", ("day", 0))
+    assert not cached(cache, "a", ("day", 1))
+
+
+def test_value_larger_than_bound_is_returned_but_not_cached():
+    cache = DeviceCache(max_bytes=100)
+    assert fill(cache, "a", ("month",), "y" * 500) == "y" * 500
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (0, 0, 0)
+
+
+def test_eviction_and_invalidation_keep_byte_count_consistent():
+    cache = DeviceCache(max_bytes=2000)
+    for i in range(20):
+        fill(cache, f"m{i % 3}", ("day", i), {"points": list(range(i * 3))}, immutable=i % 2 == 0)
+    cache.invalidate("m0")
+    cache.invalidate("m1", include_immutable=True)
+    expected = sum(entry[1] for entry in cache._entries.values())
+    assert cache.stats()["bytes"] == expected <= cache.max_bytes
+    assert set(cache._by_device) == {device_id for device_id, _ in cache._entries}
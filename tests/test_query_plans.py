@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import queries
+import storage
+
+
+@pytest.fixture
+def sqlite_conn(tmp_path):
+    backend = storage.SQLiteBackend(str(tmp_path / "plans.db"))
+    conn = backend.connect()
+    with conn.cursor() as cursor:
+        for statement in backend.schema([]):
+            cursor.execute(statement)
+        start = datetime(2025, 1, 1)
+        cursor.executemany(
+            "INSERT INTO electricity_balance (meter_no, remain, collected_at) VALUES (%s, %s, %s)",
+            [(meter, 100 - i / 100, start + timedelta(minutes=5 * i)) for meter in ("m1", "m2") for i in range(500)],
+        )
+    yield conn
+    conn.close()
+
+
+def test_sqlite_query_plans_use_primary_key(sqlite_conn):
+    end = datetime(2025, 1, 3)
+    assert queries.check_query_plans(sqlite_conn, "m1", end - timedelta(days=2), end, "sqlite") == []
+
+
+def test_sqlite_full_scan_and_temp_sort_are_flagged():
+    problems = queries._sqlite_plan_problems(
+        ["SCAN electricity_balance", "USE TEMP B-TREE FOR ORDER BY"], "series_window"
+    )
+    assert len(problems) == 2
+
+
+def _mysql_row(**overrides):
+    row = {
+        "table": "electricity_balance", "type": "range", "possible_keys": "uk_meter_collected",
+        "key": "uk_meter_collected", "Extra": "Using where; Using index condition",
+    }
+    row.update(overrides)
+    return row
+
+
+def test_mysql_index_range_passes():
+    assert queries._plan_problems([_mysql_row()]) == []
+
+
+@pytest.mark.parametrize("row", [
+    _mysql_row(type="ALL", key=None, Extra="Using where"),
+    _mysql_row(type="index", Extra="Using index"),
+    _mysql_row(type="ref", key=None, possible_keys=None, Extra="Using where"),
+    _mysql_row(Extra="Using where; Using filesort"),
+    _mysql_row(table="<derived2>", type="ALL", key=None, Extra="Using temporary; Using filesort"),
+])
+def test_mysql_full_scan_and_filesort_are_flagged(row):
+    assert queries._plan_problems([row])
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import retention
+import storage
+
+
+class FakeConnection:
+    """按 SQL 前缀返回预设结果，并记录执行的语句"""
+
+    def __init__(self, partitions, archive_rows, spanning=None):
+        self.partitions = partitions
+        self.archive_rows = archive_rows  # 归档表名 -> 行数；不在其中的表不存在
+        self.spanning = spanning or {}  # 分区名 -> 确认到 cutoff 之后的行
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        if sql.startswith("SELECT partition_name"):
+            self._rows = [(name,) for name in self.conn.partitions]
+        elif sql.startswith("SELECT COUNT(*) FROM information_schema.tables"):
+            self._rows = [(int(params[0] in self.conn.archive_rows),)]
+        elif sql.startswith("SELECT 1 FROM"):
+            self._rows = [(1,)] if self.conn.archive_rows[sql.split()[3]] else []
+        elif sql.startswith("SELECT meter_no, remain, confirmed_at"):
+            self._rows = self.conn.spanning.get(sql.split("PARTITION (")[1].split(")")[0], [])
+        else:
+            self.conn.executed.append(sql)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeBackend:
+    def insert_readings(self, cursor, rows):
+        if rows:
+            cursor.conn.executed.append(("insert", rows))
+
+
+CUTOFF = datetime(2024, 3, 1)
+
+
+@pytest.mark.parametrize("archive_rows, expected", [
+    ({}, [
+        "CREATE TABLE electricity_balance_202401 LIKE electricity_balance",
+        "ALTER TABLE electricity_balance_202401 REMOVE PARTITIONING",
+        "ALTER TABLE electricity_balance EXCHANGE PARTITION p202401 WITH TABLE electricity_balance_202401",
+    ]),
+    ({"electricity_balance_202401": 0}, [
+        "ALTER TABLE electricity_balance EXCHANGE PARTITION p202401 WITH TABLE electricity_balance_202401",
+    ]),
+    # 已有数据的归档表不能交换，否则旧行被换回分区后随 DROP PARTITION 删除
+    ({"electricity_balance_202401": 5}, [
+        "INSERT INTO electricity_balance_202401 SELECT * FROM electricity_balance PARTITION (p202401)",
+    ]),
+])
+def test_archive_keeps_existing_archive_rows(archive_rows, expected):
+    conn = FakeConnection(["p202401", "p202403", "pmax"], archive_rows)
+    actions = retention.drop_expired_partitions(conn, FakeBackend(), CUTOFF, archive=True)
+    assert conn.executed == expected + ["ALTER TABLE electricity_balance DROP PARTITION p202401"]
+    assert len(actions) == 1
+
+
+def test_dry_run_executes_nothing():
+    conn = FakeConnection(["p202401", "p202402", "pmax"], {"electricity_balance_202401": 5})
+    actions = retention.drop_expired_partitions(conn, FakeBackend(), CUTOFF, archive=True, dry_run=True)
+    assert conn.executed == []
+    assert [action.split()[1] for action in actions] == ["p202401", "p202402"]
+
+
+def test_partition_drop_carries_rows_confirmed_past_cutoff():
+    # change_only 的一段读数从 1 月确认到 cutoff 之后：续接到 2 月 1 日，随后 2 月分区同样过期时再续接到 3 月 1 日
+    run = ("m1", 42.5, datetime(2024, 3, 2, 8))
+    conn = FakeConnection(
+        ["p202401", "p202402", "p202403", "pmax"], {},
+        spanning={"p202401": [run], "p202402": [run]},
+    )
+    actions = retention.drop_expired_partitions(conn, FakeBackend(), CUTOFF)
+    assert conn.executed == [
+        ("insert", [("m1", 42.5, datetime(2024, 2, 1), run[2])]),
+        "ALTER TABLE electricity_balance DROP PARTITION p202401",
+        ("insert", [("m1", 42.5, datetime(2024, 3, 1), run[2])]),
+        "ALTER TABLE electricity_balance DROP PARTITION p202402",
+    ]
+    assert len(actions) == 4
+
+
+def test_chunked_delete_keeps_rows_confirmed_past_cutoff(tmp_path):
+    """未分区时与分区表一致：cutoff 处的余额仍可查到，其余过期读数删除"""
+    backend = storage.SQLiteBackend(str(tmp_path / "retention.db"))
+    conn = backend.connect()
+    with conn.cursor() as cursor:
+        for statement in backend.schema([]):
+            cursor.execute(statement)
+        backend.insert_readings(cursor, [
+            ("m1", 50.0, CUTOFF - timedelta(days=3), None),
+            ("m1", 42.5, CUTOFF - timedelta(hours=2), CUTOFF + timedelta(hours=8)),
+            ("m1", 42.0, CUTOFF + timedelta(hours=9), None),
+        ])
+    retention.expire_raw_readings(conn, backend, ["m1"], CUTOFF, chunk_size=10)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT collected_at, remain FROM electricity_balance ORDER BY collected_at")
+        assert [(collected_at, float(remain)) for collected_at, remain in cursor.fetchall()] == [
+            (CUTOFF - timedelta(hours=2), 42.5), (CUTOFF + timedelta(hours=9), 42.0),
+        ]
+    conn.close()
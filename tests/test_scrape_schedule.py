@@ -0,0 +1,34 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import scrape_schedule
+
+
+class MaxRandom(random.Random):
+    """uniform 总是返回上限，即抖动取最大的放大倍数"""
+
+    def uniform(self, a, b):
+        return b
+
+
+def test_jitter_never_exceeds_max_interval():
+    clock = [0.0]
+    schedule = scrape_schedule.AdaptiveSchedule(
+        300, 60, 3600, low_balance=5.0, clock=lambda: clock[0], rng=MaxRandom()
+    )
+    at = datetime(2025, 1, 1)
+    # 余额一直不变：间隔逐次翻倍直到 max_interval
+    for _ in range(10):
+        delay = schedule.record_success("m1", 50.0, at)
+        assert delay <= schedule.max_interval
+        clock[0] += delay
+        at += timedelta(seconds=delay)
+    assert schedule.device_stats()["m1"][0] == schedule.max_interval
+
+
+def test_jitter_still_applies_below_cap():
+    schedule = scrape_schedule.AdaptiveSchedule(300, 60, 3600, clock=lambda: 0.0, rng=MaxRandom())
+    delay = schedule.record_success("m1", 50.0, datetime(2025, 1, 1))
+    assert delay == pytest.approx(300 * 1.1)
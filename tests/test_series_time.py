@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("2024-01-01", datetime(2024, 1, 1)),
+    ("2024-01-01 08:30", datetime(2024, 1, 1, 8, 30)),
+    ("2024-01-01T08:30:15", datetime(2024, 1, 1, 8, 30, 15)),
+    # 带时区的时间换算为中国标准时间
+    ("2024-01-01T08:00:00+08:00", datetime(2024, 1, 1, 8)),
+    ("2024-01-01T00:00:00+00:00", datetime(2024, 1, 1, 8)),
+    ("2024-01-01T00:00:00Z", datetime(2024, 1, 1, 8)),
+    ("2024-01-01T00:00:00z", datetime(2024, 1, 1, 8)),
+    ("2023-12-31T20:00:00-05:00", datetime(2024, 1, 1, 9)),
+])
+def test_parse_series_time(raw, expected):
+    assert main._parse_series_time(raw) == expected
+    assert main._parse_series_time(raw).tzinfo is None
+
+
+def test_end_date_includes_whole_day():
+    assert main._parse_series_time("2024-01-01", is_end=True) == datetime(2024, 1, 2)
+    assert main._parse_series_time(" 2024-01-01 ", is_end=True) == datetime(2024, 1, 2)
+    # 给出时刻时按原值作为（不含的）结束时间
+    assert main._parse_series_time("2024-01-01 12:00", is_end=True) == datetime(2024, 1, 1, 12)
+    assert main._parse_series_time("2024-01-01T00:00:00Z", is_end=True) == datetime(2024, 1, 1, 8)
+
+
+def test_series_accepts_utc_suffix():
+    main.ensure_schema()
+    response = main.app.test_client().get("/series?device_id=__series_time__&start=2024-01-01T00:00:00Z&end=2024-01-02")
+    assert response.status_code == 200
@@ -0,0 +1,174 @@
+"""
+两种存储后端的一致性测试：写入/覆盖、区间扫描、最新读数、汇总表、充值记录、分批删除。
+MySQL 只在显式指定测试库时运行（TEST_MYSQL_HOST、TEST_MYSQL_DB，可选 TEST_MYSQL_PORT / TEST_MYSQL_USER /
+TEST_MYSQL_PASSWORD），从不使用应用的 DB_* 配置：测试会在该库执行建表 DDL 并写入表号 __storage_check__* 的数据
+（结束后清理）。未指定或连接失败时跳过。electricity_balance 需已按 README 建好。
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+import queries
+import retention
+import storage
+import usage_engine
+
+METER = "__storage_check__"
+UPSERT_METER = "__storage_check_upsert__"
+DELETE_METER = "__storage_check_delete__"
+START = datetime(2024, 1, 1)
+DAYS = 30
+TABLES = (
+    "electricity_balance", "electricity_daily_usage", "electricity_hourly_usage", "electricity_recharge",
+    "electricity_ingest_log",
+)
+
+
+def synthetic_readings(meter_no=METER, days=DAYS):
+    """每 5 分钟一条，余额缓慢下降，每 10 天充值 100 元"""
+    readings, balance = [], 500.0
+    ts = START
+    while ts < START + timedelta(days=days):
+        balance = round(balance - 0.05, 2)
+        if ts.minute == 0 and ts.hour == 12 and ts.day % 10 == 0:
+            balance = round(balance + 100, 2)
+        readings.append({"meter_no": meter_no, "remain": balance, "collected_at": ts})
+        ts += timedelta(minutes=5)
+    return readings
+
+
+READINGS = synthetic_readings()
+
+
+def _create_backend(name, tmp_path_factory):
+    if name == "sqlite":
+        return storage.SQLiteBackend(str(tmp_path_factory.mktemp("storage") / "check.db"))
+    host, database = os.getenv("TEST_MYSQL_HOST", "").strip(), os.getenv("TEST_MYSQL_DB", "").strip()
+    if not host or not database:
+        pytest.skip("未指定 MySQL 测试库（TEST_MYSQL_HOST、TEST_MYSQL_DB）")
+    pytest.importorskip("pymysql")
+    backend = storage.MySQLBackend({
+        "host": host,
+        "port": main._cast_int_env(os.getenv("TEST_MYSQL_PORT", "3306")),
+        "user": os.getenv("TEST_MYSQL_USER", "root"),
+        "password": os.getenv("TEST_MYSQL_PASSWORD", ""),
+        "database": database,
+        "charset": "utf8mb4",
+        "autocommit": True,
+        "connect_timeout": 5,
+    })
+    try:
+        backend.connect().close()
+    except Exception as exc:
+        pytest.skip(f"MySQL 不可用：{exc}")
+    return backend
+
+
+def _cleanup():
+    with main.DB_POOL.connection() as conn, conn.cursor() as cursor:
+        for table in TABLES:
+            for meter_no in (METER, UPSERT_METER, DELETE_METER):
+                cursor.execute(f"DELETE FROM {table} WHERE meter_no=%s", (meter_no,))
+
+
+@pytest.fixture(scope="module", params=["sqlite", "mysql"])
+def conn(request, tmp_path_factory):
+    """把 main 的存储后端与连接池换成被测后端，写入 30 天读数（与抓取时的批量写入路径相同）"""
+    backend = _create_backend(request.param, tmp_path_factory)
+    pool = main.ConnectionPool(backend, min_size=0, max_size=2)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(main, "DB_BACKEND", backend)
+        mp.setattr(main, "DB_POOL", pool)
+        main.ensure_schema()
+        _cleanup()
+        try:
+            with pool.connection() as connection:
+                for i in range(0, len(READINGS), 200):
+                    main._write_readings(connection, READINGS[i:i + 200])
+                yield connection
+        finally:
+            _cleanup()
+
+
+def _scalar(conn, sql, params):
+    with conn.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+
+
+def test_bulk_write(conn):
+    assert _scalar(conn, "SELECT COUNT(*) FROM electricity_balance WHERE meter_no=%s", (METER,)) == len(READINGS)
+
+
+def test_upsert_overwrites_remain_and_keeps_latest_confirmed_at(conn):
+    first = START
+    with conn.cursor() as cursor:
+        main.DB_BACKEND.insert_readings(cursor, [(UPSERT_METER, 999.99, first, first + timedelta(minutes=3))])
+        main.DB_BACKEND.insert_readings(cursor, [(UPSERT_METER, 12.5, first, first + timedelta(minutes=1))])
+        main.DB_BACKEND.insert_readings(cursor, [(UPSERT_METER, 12.5, first, None)])
+        cursor.execute("SELECT remain, confirmed_at FROM electricity_balance WHERE meter_no=%s", (UPSERT_METER,))
+        rows = cursor.fetchall()
+    assert len(rows) == 1
+    remain, confirmed_at = rows[0]
+    assert float(remain) == 12.5
+    assert confirmed_at == first + timedelta(minutes=3)
+
+
+def test_series_window_is_half_open_with_previous_reading(conn):
+    day = START + timedelta(days=5)
+    prev_remain, points = main._fetch_series_window(conn, METER, day, day + timedelta(days=1))
+    assert points == [(r["collected_at"], r["remain"]) for r in READINGS if day <= r["collected_at"] < day + timedelta(days=1)]
+    assert prev_remain == [r["remain"] for r in READINGS if r["collected_at"] < day][-1]
+
+
+def test_latest_reading(conn):
+    collected_at, _, remain = main._load_latest_rows(conn, [METER])[METER]
+    assert collected_at == READINGS[-1]["collected_at"]
+    assert remain == READINGS[-1]["remain"]
+    with conn.cursor() as cursor:
+        cursor.execute(*queries.latest_balance(METER))
+        assert float(cursor.fetchone()[0]) == READINGS[-1]["remain"]
+
+
+def _series():
+    return usage_engine.Series.from_points([(r["collected_at"], r["remain"]) for r in READINGS])
+
+
+def test_daily_rollups_match_engine(conn):
+    expected = {edge.date(): summary for edge, summary in usage_engine.summarize_by(_series(), "day")}
+    daily = main._load_rollups(conn, "daily", METER, START.date(), (START + timedelta(days=DAYS)).date())
+    assert set(daily) == set(expected)
+    for key, summary in expected.items():
+        assert daily[key]["usage_total"] == pytest.approx(summary["usage_cents"] / 100, abs=0.005)
+        assert daily[key]["reading_count"] == summary["count"]
+
+
+def test_hourly_rollups_cover_every_reading(conn):
+    day = START + timedelta(days=5)
+    hourly = main._load_rollups(conn, "hourly", METER, day, day + timedelta(days=1))
+    assert len(hourly) == 24
+    assert sum(r["reading_count"] for r in hourly.values()) == 288
+
+
+def test_recharges_detected_on_write(conn):
+    expected = sum(
+        1 for _, before_cents, after_cents in usage_engine.recharge_events(_series())
+        if main._estimate_recharge_amount((after_cents - before_cents) / 100)
+    )
+    recharges = main._load_recharges(conn, METER, START)
+    assert expected > 0
+    assert len(recharges) == expected
+    assert all(r["amount"] == 100 for r in recharges)
+
+
+def test_batched_delete(conn):
+    rows = [(DELETE_METER, r["remain"], r["collected_at"], None) for r in synthetic_readings(DELETE_METER, days=2)]
+    with conn.cursor() as cursor:
+        main.DB_BACKEND.insert_readings(cursor, rows)
+    cutoff = START + timedelta(days=1)
+    retention.delete_expired_rows(conn, main.DB_BACKEND, "electricity_balance", "collected_at", [DELETE_METER], cutoff, 50)
+    count = "SELECT COUNT(*) FROM electricity_balance WHERE meter_no=%s"
+    assert _scalar(conn, count + " AND collected_at < %s", (DELETE_METER, cutoff)) == 0
+    assert _scalar(conn, count, (DELETE_METER,)) == len(rows) - 288
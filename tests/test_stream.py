@@ -0,0 +1,73 @@
+"""推送服务的跨域响应头：默认只允许同一主机名的页面，配置 allow_origins 后只允许列出的来源"""
+import socket
+
+import pytest
+
+import stream
+
+
+@pytest.fixture
+def start_hub():
+    hubs = []
+
+    def start(**kwargs):
+        hub = stream.StreamHub("127.0.0.1", 0, is_known=lambda device_id: device_id == "known", **kwargs)
+        hub.start()
+        hubs.append(hub)
+        return hub
+
+    yield start
+    for hub in hubs:
+        hub.stop()
+
+
+def response_headers(hub, path="/stream?device_id=known", origin=None, host="example.com:5001"):
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+    if origin:
+        request += f"Origin: {origin}\r\n"
+    with socket.create_connection(("127.0.0.1", hub.port), timeout=5) as sock:
+        sock.sendall((request + "\r\n").encode("latin-1"))
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    status, *lines = data.split(b"\r\n\r\n", 1)[0].decode("latin-1").split("\r\n")
+    return status, dict(line.split(": ", 1) for line in lines)
+
+
+@pytest.mark.parametrize("path, status", [
+    ("/stream?device_id=known", "200"),
+    ("/stream?device_id=unknown", "404"),
+    ("/other", "404"),
+])
+def test_same_host_dashboard_allowed_by_default(start_hub, path, status):
+    hub = start_hub()
+    code, headers = response_headers(hub, path, origin="http://example.com:9136")
+    assert status in code
+    assert headers["Access-Control-Allow-Origin"] == "http://example.com:9136"
+    assert headers["Vary"] == "Origin"
+
+
+def test_foreign_origin_gets_no_cors_header(start_hub):
+    hub = start_hub()
+    _, headers = response_headers(hub, origin="https://evil.example.net")
+    assert "Access-Control-Allow-Origin" not in headers
+    _, headers = response_headers(hub)
+    assert "Access-Control-Allow-Origin" not in headers
+
+
+def test_configured_origins(start_hub):
+    hub = start_hub(allow_origins=("https://dash.example.org/",))
+    _, headers = response_headers(hub, origin="https://dash.example.org")
+    assert headers["Access-Control-Allow-Origin"] == "https://dash.example.org"
+    # 配置了来源后同主机名的其他页面不再自动放行
+    _, headers = response_headers(hub, origin="http://example.com:9136")
+    assert "Access-Control-Allow-Origin" not in headers
+
+
+def test_wildcard_origin(start_hub):
+    hub = start_hub(allow_origins=("*",))
+    _, headers = response_headers(hub, origin="https://anywhere.example.net")
+    assert headers["Access-Control-Allow-Origin"] == "*"
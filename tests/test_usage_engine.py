@@ -0,0 +1,163 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import usage_engine
+from usage_engine import Series, bucket_edges, recharge_events, summarize, summarize_by
+
+
+def legacy_rollups(points, prev_balance, bucket):
+    """原来的逐条累加实现（_build_rollups / _accumulate_rollup），作为对照"""
+    rollups = {}
+    last_balance = prev_balance
+    for collected_at, balance in points:
+        summary = rollups.get(bucket(collected_at))
+        if summary is None:
+            summary = rollups[bucket(collected_at)] = {
+                "first_balance": balance, "last_balance": balance,
+                "min_balance": balance, "max_balance": balance,
+                "usage_total": 0.0, "recharge_total": 0.0, "reading_count": 0,
+                "first_at": collected_at, "last_at": collected_at,
+            }
+        if last_balance is not None:
+            if balance > last_balance:
+                summary["recharge_total"] += balance - last_balance
+            else:
+                summary["usage_total"] += last_balance - balance
+        summary["last_balance"] = balance
+        summary["min_balance"] = min(summary["min_balance"], balance)
+        summary["max_balance"] = max(summary["max_balance"], balance)
+        summary["reading_count"] += 1
+        summary["last_at"] = collected_at
+        last_balance = balance
+    return rollups
+
+
+def sample_points(seed=7):
+    """跨月的不规则采样：1~20 分钟一条，偶尔充值，偶尔停采几小时"""
+    rng = random.Random(seed)
+    points, ts, balance = [], datetime(2024, 1, 28, 0, 3, 17), 80.0
+    while ts < datetime(2024, 2, 3):
+        if rng.random() < 0.004:
+            balance = round(balance + rng.choice((50, 100, 200)), 2)
+        else:
+            balance = round(max(balance - rng.choice((0, 0, 0.01, 0.05, 0.12)), 0), 2)
+        points.append((ts, balance))
+        ts += timedelta(minutes=rng.randint(1, 20), seconds=rng.randint(0, 59))
+        if rng.random() < 0.002:
+            ts += timedelta(hours=rng.randint(2, 7))
+    return points
+
+
+def points_at(start, balances, step=timedelta(minutes=10)):
+    return [(start + step * i, balance) for i, balance in enumerate(balances)]
+
+
+def test_drops_and_recharges_in_one_bucket():
+    start = datetime(2024, 5, 1, 10)
+    series = Series.from_points(points_at(start, [100.0, 99.0, 150.0, 149.5, 149.5]))
+    [summary] = summarize(series, [start, start + timedelta(hours=1)])
+    assert summary["usage_cents"] == 150
+    assert summary["recharge_cents"] == 5100
+    assert (summary["first_cents"], summary["last_cents"]) == (10000, 14950)
+    assert (summary["min_cents"], summary["max_cents"]) == (9900, 15000)
+    assert summary["count"] == 5
+    assert summary["last_at"] == start + timedelta(minutes=40)
+
+
+def test_prev_cents_counts_against_first_reading():
+    start = datetime(2024, 5, 1)
+    series = Series.from_points(points_at(start, [100.0, 99.5]))
+    edges = [start, start + timedelta(hours=1)]
+    assert summarize(series, edges)[0]["usage_cents"] == 50
+    assert summarize(series, edges, prev_cents=10100)[0]["usage_cents"] == 150
+    assert summarize(series, edges, prev_cents=9000)[0]["recharge_cents"] == 1000
+
+
+def test_previous_reading_carries_across_bucket_boundary():
+    # 23:50 的 100 元到次日 00:10 的 98 元：下降计入第二天（读数所在的桶）
+    series = Series.from_points([(datetime(2024, 5, 1, 23, 50), 100.0), (datetime(2024, 5, 2, 0, 10), 98.0)])
+    (day1, first), (day2, second) = summarize_by(series, "day")
+    assert (day1, first["usage_cents"]) == (datetime(2024, 5, 1), 0)
+    assert (day2, second["usage_cents"]) == (datetime(2024, 5, 2), 200)
+
+
+def test_calendar_month_edges():
+    assert bucket_edges(datetime(2024, 1, 15), datetime(2024, 3, 2), "month") == [
+        datetime(2024, 1, 1), datetime(2024, 2, 1), datetime(2024, 3, 1), datetime(2024, 4, 1),
+    ]
+    assert bucket_edges(datetime(2023, 12, 31, 23), datetime(2024, 1, 1), "month") == [
+        datetime(2023, 12, 1), datetime(2024, 1, 1),
+    ]
+    series = Series.from_points([
+        (datetime(2024, 1, 31, 23, 59, 59), 10.0),
+        (datetime(2024, 2, 1), 9.0),
+        (datetime(2024, 2, 29, 23, 59), 8.0),
+        (datetime(2024, 3, 1), 7.5),
+    ])
+    assert [(edge, summary["usage_cents"], summary["count"]) for edge, summary in summarize_by(series, "month")] == [
+        (datetime(2024, 1, 1), 0, 1), (datetime(2024, 2, 1), 200, 2), (datetime(2024, 3, 1), 50, 1),
+    ]
+
+
+# 每桶读数多时走边界二分查找，稀疏时走桶号切分，两条路径都要覆盖
+@pytest.mark.parametrize("width, step", [
+    ("5min", timedelta(seconds=30)),
+    ("5min", timedelta(minutes=47)),
+    ("hour", timedelta(minutes=5)),
+    ("hour", timedelta(hours=9)),
+])
+def test_bucket_keys_split_at_edges(width, step):
+    start = datetime(2024, 5, 1)
+    # 恰好落在桶起点的读数属于新桶，前一微秒的读数属于上一个桶
+    width_delta = usage_engine.BUCKET_WIDTHS[width]
+    edge = start + width_delta * 3
+    times = sorted({start + step * i for i in range(60)} | {edge, edge - timedelta(microseconds=1)})
+    series = Series.from_points([(ts, 100 - i * 0.01) for i, ts in enumerate(times)])
+    buckets = dict(summarize_by(series, width))
+    assert buckets[edge]["first_at"] == edge
+    assert buckets[edge - width_delta]["last_at"] == edge - timedelta(microseconds=1)
+    assert sum(summary["count"] for summary in buckets.values()) == len(times)
+    assert all(key == usage_engine.floor_time(summary["first_at"], width_delta) for key, summary in buckets.items())
+
+
+def test_empty_series():
+    series = Series.from_points([])
+    edges = bucket_edges(datetime(2024, 5, 1), datetime(2024, 5, 2), "hour")
+    assert summarize(series, edges) == [None] * 24
+    assert summarize(series, edges, prev_cents=100) == [None] * 24
+    assert summarize_by(series, "day") == []
+    assert recharge_events(series) == []
+
+
+@pytest.mark.parametrize("width", ["5min", "hour", "day", "month"])
+@pytest.mark.parametrize("prev_balance", [None, 85.0])
+def test_matches_legacy_per_reading_loop(width, prev_balance):
+    points = sample_points()
+    width_delta = usage_engine.BUCKET_WIDTHS[width]
+    expected = legacy_rollups(points, prev_balance, lambda ts: usage_engine.floor_time(ts, width_delta))
+    prev_cents = usage_engine.to_cents(prev_balance) if prev_balance is not None else None
+    actual = dict(summarize_by(Series.from_points(points), width, prev_cents))
+    assert list(actual) == list(expected)
+    for key, summary in actual.items():
+        legacy = expected[key]
+        assert summary["usage_cents"] == usage_engine.to_cents(legacy["usage_total"])
+        assert summary["recharge_cents"] == usage_engine.to_cents(legacy["recharge_total"])
+        assert summary["count"] == legacy["reading_count"]
+        assert summary["first_cents"] == usage_engine.to_cents(legacy["first_balance"])
+        assert summary["last_cents"] == usage_engine.to_cents(legacy["last_balance"])
+        assert summary["min_cents"] == usage_engine.to_cents(legacy["min_balance"])
+        assert summary["max_cents"] == usage_engine.to_cents(legacy["max_balance"])
+        assert (summary["first_at"], summary["last_at"]) == (legacy["first_at"], legacy["last_at"])
+
+
+def test_recharge_events_match_rising_deltas():
+    points = sample_points()
+    events = recharge_events(Series.from_points(points))
+    expected = [
+        (ts, usage_engine.to_cents(before), usage_engine.to_cents(after))
+        for (_, before), (ts, after) in zip(points, points[1:]) if after > before
+    ]
+    assert events == expected
+    assert len(events) > 0
@@ -0,0 +1,162 @@
+"""
+充值感知的用电量计算引擎（全部视图共用同一套规则）。
+
+规则：相邻两条读数之间余额下降计为用电，上升计为充值；第一条读数与其之前的最后一条读数比较，
+没有更早读数时不计。余额在内部以整数“分”保存，避免浮点累加误差。
+
+实现：读数序列保存为 array（时间列表 + 余额分值），相邻差值及其前缀和都由
+map / itertools.accumulate 在 C 层一次算出；任意桶宽（5 分钟、小时、日、自然月）的汇总
+只需找到桶的读数下标区间（桶号变化处或边界二分查找），再用前缀和相减，不再逐条累加。
+"""
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import accumulate, compress, repeat
+from operator import floordiv, gt, ne, sub
+
+BUCKET_WIDTHS = {
+    "5min": timedelta(minutes=5),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "month": "month",
+}
+
+
+def to_cents(value):
+    """余额（元/度，float 或 Decimal）转换为整数分"""
+    return int(round(float(value) * 100))
+
+
+class Series:
+    """按时间升序的读数序列：times 为 datetime 列表，cents 为 array('q') 余额分值"""
+
+    __slots__ = ("times", "cents")
+
+    def __init__(self, times, cents):
+        self.times = times
+        self.cents = cents
+
+    @classmethod
+    def from_points(cls, points):
+        """由 [(collected_at, balance), ...]（已按时间排序）构建"""
+        times = [ts for ts, _ in points]
+        cents = array("q", (to_cents(balance) for _, balance in points))
+        return cls(times, cents)
+
+    def __len__(self):
+        return len(self.times)
+
+
+def _deltas(series, prev_cents):
+    """相邻读数的余额差（分）；首条读数与 prev_cents 比较，prev_cents 为 None 时差值记 0"""
+    cents = series.cents
+    first = cents[0] if prev_cents is None else prev_cents
+    return list(map(sub, cents, [first] + list(cents[:-1])))
+
+
+def floor_time(ts, width):
+    """把时间向下取整到桶起点（按当天 0 点对齐；自然月取当月 1 日）"""
+    if width == "month":
+        return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    midnight = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + ((ts - midnight) // width) * width
+
+
+def next_edge(edge, width):
+    """下一个桶边界"""
+    if width == "month":
+        return edge.replace(year=edge.year + 1, month=1) if edge.month == 12 else edge.replace(month=edge.month + 1)
+    return edge + width
+
+
+def bucket_edges(start_time, end_time, width):
+    """覆盖 [start_time, end_time) 的桶边界列表（首个边界为 start_time 所在桶的起点）"""
+    width = BUCKET_WIDTHS.get(width, width)
+    edges = [floor_time(start_time, width)]
+    while edges[-1] < end_time:
+        edges.append(next_edge(edges[-1], width))
+    return edges
+
+
+def _prefix_sums(series, prev_cents):
+    """
+    |差值| 与差值的前缀和。区间内用电 = (Σ|d| - Σd) / 2，充值 = (Σ|d| + Σd) / 2，均为整数分，
+    两次 accumulate 即可覆盖任意区间。
+    """
+    deltas = _deltas(series, prev_cents)
+    abs_prefix = list(accumulate(map(abs, deltas), initial=0))
+    delta_prefix = list(accumulate(deltas, initial=0))
+    return abs_prefix, delta_prefix
+
+
+def _bucket(series, i, j, abs_prefix, delta_prefix):
+    """读数下标 [i, j) 的汇总"""
+    cents = series.cents
+    window = cents[i:j]
+    moved = abs_prefix[j] - abs_prefix[i]
+    net = delta_prefix[j] - delta_prefix[i]
+    return {
+        "first_cents": cents[i],
+        "last_cents": cents[j - 1],
+        "min_cents": min(window),
+        "max_cents": max(window),
+        "usage_cents": (moved - net) // 2,
+        "recharge_cents": (moved + net) // 2,
+        "count": j - i,
+        "first_at": series.times[i],
+        "last_at": series.times[j - 1],
+    }
+
+
+def summarize(series, edges, prev_cents=None):
+    """
+    按桶边界 edges（n+1 个，得到 n 个半开区间桶）一次性汇总。
+    返回长度为 n 的列表，无读数的桶为 None，其余为：
+    {first_cents, last_cents, min_cents, max_cents, usage_cents, recharge_cents, count, first_at, last_at}
+    """
+    if not len(series):
+        return [None] * (len(edges) - 1)
+    abs_prefix, delta_prefix = _prefix_sums(series, prev_cents)
+    bounds = [bisect_left(series.times, edge) for edge in edges]
+    return [
+        _bucket(series, i, j, abs_prefix, delta_prefix) if i < j else None
+        for i, j in zip(bounds, bounds[1:])
+    ]
+
+
+def summarize_by(series, width, prev_cents=None):
+    """
+    按桶宽（"5min" / "hour" / "day" / "month" 或 timedelta）汇总全部读数，
+    返回 [(桶起点, 汇总), ...]，只包含有读数的桶。
+    桶数远少于读数时按桶边界二分查找；桶很细（如 5 分钟）时由 (时间 - 基准日) // 宽度 在 C 层
+    算出每条读数的桶号，只在桶号变化处切分，与空桶数量无关。
+    """
+    n = len(series)
+    if not n:
+        return []
+    width = BUCKET_WIDTHS.get(width, width)
+    first, last = series.times[0], series.times[-1]
+    # 桶数远少于读数（日、月、长区间的小时）时直接按边界二分查找
+    if width == "month" or (last - first) // width < n // 8:
+        edges = bucket_edges(first, last + timedelta(microseconds=1), width)
+        return [(edge, summary) for edge, summary in zip(edges, summarize(series, edges, prev_cents)) if summary]
+
+    origin = floor_time(first, timedelta(days=1))
+    keys = list(map(floordiv, map(sub, series.times, repeat(origin)), repeat(width)))
+    starts = [0]
+    starts.extend(compress(range(1, n), map(ne, keys[1:], keys[:-1])))
+    abs_prefix, delta_prefix = _prefix_sums(series, prev_cents)
+    return [
+        (origin + keys[i] * width, _bucket(series, i, j, abs_prefix, delta_prefix))
+        for i, j in zip(starts, starts[1:] + [n])
+    ]
+
+
+def recharge_events(series, prev_cents=None):
+    """全部余额上升事件 [(collected_at, before_cents, after_cents), ...]，按时间升序"""
+    if not len(series):
+        return []
+    deltas = _deltas(series, prev_cents)
+    rising = compress(range(len(deltas)), map(gt, deltas, repeat(0)))
+    cents = series.cents
+    return [(series.times[i], cents[i] - deltas[i], cents[i]) for i in rising]
@@ -0,0 +1,40 @@
+"""
+后台任务进程：只运行定时任务（抓取、每日报告、数据保留），不提供 Web 服务。
+
+Web 层以多个进程运行（见 wsgi.py，RUN_JOBS=false）时，用它单独运行定时任务：
+    python worker.py
+可以同时运行多个实例作为热备，只有持有数据库锁的一个执行任务（见 leader.py），
+其退出或崩溃后其他实例最迟 LEADER_CHECK_SECONDS 秒后接替。
+SCRAPE_SHARDING=true 时抓取任务在每个实例上执行，各实例通过抓取租约平分设备（见 shard.py），
+每日报告与数据保留仍只在持有锁的实例上执行。
+"""
+import signal
+import threading
+
+import main
+
+
+def run():
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    main.DB_POOL.prefill()
+    main.ensure_schema()
+    main.READING_WRITER.start()
+    election = main.start_job_runner()
+    print(f"[{main.now_cn().strftime('%Y-%m-%d %H:%M:%S')}] 后台任务进程 {main.PROCESS_ID} 启动完成"
+          f"（{'执行定时任务' if election.is_leader else '待命，其他实例持有任务锁'}）")
+    if main.SCRAPE_SHARDING:
+        print(f"- 分片抓取：{main.SCRAPE_SHARD.nodes} 个节点，本节点持有 {len(main.SCRAPE_SHARD.owned())} 台设备")
+    try:
+        stopping.wait()
+    finally:
+        # 先释放任务锁让其他实例尽快接替，再把缓冲中的读数写完
+        main.stop_job_runner()
+        main.DEVICE_REGISTRY.stop()
+        main.READING_WRITER.stop()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,14 @@
+"""
+WSGI 入口：以多个工作进程提供 Web 服务，定时任务由 worker.py 单独运行。
+
+    RUN_JOBS=false gunicorn -w 4 -b 0.0.0.0:5000 wsgi:app
+    python worker.py
+
+不要使用 --preload：每个工作进程需要各自启动缓存同步线程与实时推送的事件循环（共用 STREAM_PORT）。
+与 python main.py 相同，先建立连接池、建表，再启动后台服务（设备登记表与缓存同步依赖这些表）。
+"""
+from main import DB_POOL, app, ensure_schema, start_web_services
+
+DB_POOL.prefill()
+ensure_schema()
+start_web_services(shared_port=True)